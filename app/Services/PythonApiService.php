@@ -2,6 +2,7 @@
 
 namespace App\Services;
 
+use App\Models\Place;
 use Illuminate\Support\Facades\Http;
 use Illuminate\Support\Facades\Log;
 
@@ -105,9 +106,7 @@ class PythonApiService
                 'liked_hotels_count' => count($requestData['liked_hotels']),
             ]);
 
-            $response = Http::timeout($this->timeout)
-                ->withHeaders($headers)
-                ->post("{$this->baseUrl}/api/recommendations/by-city-name", $requestData);
+            $response = $this->postByCityName($cityName, $requestData, $headers);
 
             if ($response->successful()) {
                 return $response->json();
@@ -154,15 +153,13 @@ class PythonApiService
                 $headers['X-API-Key'] = $this->apiKey;
             }
 
-            $response = Http::timeout($this->timeout)
-                ->withHeaders($headers)
-                ->post("{$this->baseUrl}/api/recommendations/by-city-name", [
-                    'city_name' => $cityName,
-                    'guest_count' => $guestCount,
-                    'duration_days' => $durationDays,
-                    'target_budget' => $budget,
-                    'user_id' => $userId
-                ]);
+            $response = $this->postByCityName($cityName, [
+                'city_name' => $cityName,
+                'guest_count' => $guestCount,
+                'duration_days' => $durationDays,
+                'target_budget' => $budget,
+                'user_id' => $userId
+            ], $headers);
 
             if ($response->successful()) {
                 return $response->json();
@@ -186,6 +183,187 @@ class PythonApiService
         }
     }
 
+    /**
+     * POST /api/recommendations/by-city-name, uploading the city's place catalogue
+     * and retrying once when the Python API has no catalogue for it yet (404)
+     *
+     * @param string $cityName City name
+     * @param array $requestData Request body
+     * @param array $headers Request headers
+     * @return \Illuminate\Http\Client\Response
+     */
+    protected function postByCityName(string $cityName, array $requestData, array $headers)
+    {
+        $url = "{$this->baseUrl}/api/recommendations/by-city-name";
+        $response = Http::timeout($this->timeout)->withHeaders($headers)->post($url, $requestData);
+
+        if ($response->status() === 404) {
+            $sync = $this->syncCatalog($cityName);
+            if ($sync['success'] ?? false) {
+                $response = Http::timeout($this->timeout)->withHeaders($headers)->post($url, $requestData);
+            }
+        }
+
+        return $response;
+    }
+
+    /**
+     * Upload a city's activities, restaurants and hotels from the database to the
+     * Python place catalogue (used by /api/recommendations/by-city-name)
+     *
+     * Uploading unchanged content keeps the catalogue version on the Python side.
+     *
+     * @param string $cityName City name
+     * @param int $limit Max places per category
+     * @return array Response from Python API
+     */
+    public function syncCatalog(string $cityName, int $limit = 200): array
+    {
+        $places = [
+            'activities' => Place::getTouristAttractions($cityName, $limit)
+                ->map(fn ($place) => $this->catalogPlace($place, 'attraction'))->values()->toArray(),
+            'restaurants' => Place::getRestaurants($cityName, $limit)
+                ->map(fn ($place) => $this->catalogPlace($place, 'restaurant'))->values()->toArray(),
+            'hotels' => Place::getHotels($cityName, $limit)
+                ->map(fn ($place) => $this->catalogPlace($place, 'hotel'))->values()->toArray(),
+        ];
+
+        if (empty($places['activities']) && empty($places['restaurants']) && empty($places['hotels'])) {
+            return [
+                'success' => false,
+                'error' => "No places found for city {$cityName}",
+                'data' => null
+            ];
+        }
+
+        return $this->uploadCatalog($cityName, $places);
+    }
+
+    /**
+     * Format a Place for the Python place catalogue
+     *
+     * @param Place $place
+     * @param string $defaultCategory
+     * @return array
+     */
+    protected function catalogPlace($place, string $defaultCategory): array
+    {
+        $name = is_array($place->displayName) ? ($place->displayName['text'] ?? null) : $place->displayName;
+
+        return [
+            'id' => $place->id,
+            'place_id' => $place->id,
+            'name' => $name ?? $place->name ?? 'Unknown',
+            'category' => $place->types[0] ?? $defaultCategory,
+            'rating' => $place->rating ?? 0,
+            'reviews' => $place->userRatingCount ?? 0,
+            'latitude' => $place->location['latitude'] ?? null,
+            'longitude' => $place->location['longitude'] ?? null,
+            'avg_price' => $place->avg_price ?? 0,
+        ];
+    }
+
+    /**
+     * Get a city's place catalogue version and content_hash
+     *
+     * @param string $cityName City name
+     * @return array Response from Python API (404 -> success false)
+     */
+    public function getCatalog(string $cityName): array
+    {
+        return $this->catalogRequest('get', $cityName);
+    }
+
+    /**
+     * Upload (replace) a city's place catalogue
+     *
+     * @param string $cityName City name
+     * @param array $places ['activities' => [...], 'restaurants' => [...], 'hotels' => [...]]
+     * @return array Response from Python API
+     */
+    public function uploadCatalog(string $cityName, array $places): array
+    {
+        return $this->catalogRequest('put', $cityName, [
+            'activities' => $places['activities'] ?? [],
+            'restaurants' => $places['restaurants'] ?? [],
+            'hotels' => $places['hotels'] ?? [],
+        ]);
+    }
+
+    /**
+     * Delta update of a city's place catalogue
+     *
+     * $baseHash must be the current content_hash (from getCatalog/uploadCatalog);
+     * on a 409 conflict re-upload the full catalogue with uploadCatalog.
+     *
+     * @param string $cityName City name
+     * @param string $baseHash content_hash the delta applies to
+     * @param array $upsert Places to add or replace, by category
+     * @param array $remove Place ids to remove, by category
+     * @return array Response from Python API
+     */
+    public function updateCatalog(string $cityName, string $baseHash, array $upsert, array $remove = []): array
+    {
+        return $this->catalogRequest('patch', $cityName, [
+            'base_hash' => $baseHash,
+            // Cast so empty arrays are sent as {} rather than []
+            'upsert' => (object) $upsert,
+            'remove' => (object) $remove,
+        ]);
+    }
+
+    /**
+     * Send a request to /api/catalog/{city_name}
+     *
+     * @param string $method get|put|patch
+     * @param string $cityName City name
+     * @param array $payload Request body
+     * @return array Response from Python API
+     */
+    protected function catalogRequest(string $method, string $cityName, array $payload = []): array
+    {
+        try {
+            $headers = [];
+            if (!empty($this->apiKey)) {
+                $headers['X-API-Key'] = $this->apiKey;
+            }
+
+            $url = "{$this->baseUrl}/api/catalog/" . rawurlencode($cityName);
+            $request = Http::timeout($this->timeout)->withHeaders($headers);
+            $response = $method === 'get' ? $request->get($url) : $request->{$method}($url, $payload);
+
+            if ($response->successful()) {
+                return $response->json();
+            }
+
+            Log::warning('Python API Catalog Error', [
+                'method' => $method,
+                'city' => $cityName,
+                'status' => $response->status(),
+                'body' => $response->body()
+            ]);
+
+            return [
+                'success' => false,
+                'error' => "Python API returned status {$response->status()}",
+                'status' => $response->status(),
+                'data' => $response->json('data')
+            ];
+        } catch (\Exception $e) {
+            Log::error('Python API Catalog Exception', [
+                'method' => $method,
+                'city' => $cityName,
+                'message' => $e->getMessage()
+            ]);
+
+            return [
+                'success' => false,
+                'error' => $e->getMessage(),
+                'data' => null
+            ];
+        }
+    }
+
     /**
      * Get list of available cities
      *
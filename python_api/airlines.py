@@ -0,0 +1,151 @@
+"""
+Persistent airline reference store: carrierCode -> airline name
+
+Tên hãng bay hầu như không đổi, nên kết quả tra Amadeus được giữ trong một file
+JSON cục bộ (sống sót qua restart) với TTL. Mã không tìm thấy cũng được ghi lại
+(negative cache, TTL ngắn hơn) để không hỏi lại Amadeus mỗi request. Có thể nạp
+sẵn từ một file CSV offline (cột code,name); các entry seed không hết hạn.
+"""
+import csv
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import settings
+
+STORE_VERSION = 1
+
+
+class AirlineReferenceStore:
+    """
+    Bảng code -> tên hãng (None = Amadeus không biết mã này), nạp lười từ đĩa
+    ở lần dùng đầu tiên. An toàn khi dùng từ nhiều thread.
+    """
+
+    def __init__(self, path: Optional[str], ttl_seconds: float, negative_ttl_seconds: float,
+                 seed_path: Optional[str] = None):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.seed_path = seed_path
+        # code -> (name hoặc None, expires_at hoặc None nếu không hết hạn)
+        self._entries: Dict[str, Tuple[Optional[str], Optional[float]]] = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.seeded = 0
+
+    def load(self):
+        """Nạp file seed và store từ đĩa (idempotent)"""
+        with self._lock:
+            self._load_locked()
+
+    def _load_locked(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if self.seed_path:
+            try:
+                with open(self.seed_path, mode='r', encoding='utf-8', newline='') as f:
+                    for row in csv.DictReader(f):
+                        code = (row.get('code') or '').strip().upper()
+                        name = (row.get('name') or '').strip()
+                        if code and name:
+                            self._entries[code] = (name, None)
+                self.seeded = len(self._entries)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Airline seed file not loaded: {e}")
+        if self.path:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    record = json.load(f)
+            except FileNotFoundError:
+                record = None
+            except (OSError, ValueError) as e:
+                print(f"Airline store not loaded: {e}")
+                record = None
+            if record and record.get('version') == STORE_VERSION:
+                now = time.time()
+                for code, (name, expires_at) in record.get('airlines', {}).items():
+                    if expires_at is None or expires_at > now:
+                        self._entries[code] = (name, expires_at)
+
+    def _save_locked(self):
+        if not self.path:
+            return
+        airlines = {code: [name, expires_at] for code, (name, expires_at) in self._entries.items()
+                    if expires_at is not None}
+        tmp_path = f"{self.path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': STORE_VERSION, 'airlines': airlines}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Airline store write failed: {e}")
+
+    def lookup(self, codes: Iterable[str]) -> Tuple[Dict[str, str], List[str]]:
+        """
+        Tách các mã đã biết khỏi các mã phải hỏi Amadeus.
+
+        Returns:
+            (dict code -> tên (mã không tồn tại trả về chính mã đó), list mã còn thiếu)
+        """
+        known, missing = {}, []
+        now = time.time()
+        with self._lock:
+            self._load_locked()
+            for code in codes:
+                entry = self._entries.get(code)
+                if entry is None or (entry[1] is not None and entry[1] <= now):
+                    self.misses += 1
+                    missing.append(code)
+                elif entry[0] is None:
+                    self.negative_hits += 1
+                    known[code] = code
+                else:
+                    self.hits += 1
+                    known[code] = entry[0]
+        return known, missing
+
+    def update(self, names: Dict[str, str], not_found: Iterable[str] = ()):
+        """Ghi tên vừa tra được và các mã Amadeus không biết, rồi lưu xuống đĩa"""
+        now = time.time()
+        with self._lock:
+            self._load_locked()
+            for code, name in names.items():
+                self._entries[code] = (name, now + self.ttl_seconds)
+            for code in not_found:
+                self._entries[code] = (None, now + self.negative_ttl_seconds)
+            self._save_locked()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "seeded": self.seeded,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "persistent": bool(self.path)
+        }
+
+
+def _default_seed_path() -> Optional[str]:
+    if settings.AIRLINE_SEED_PATH:
+        return settings.AIRLINE_SEED_PATH
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(base_dir, 'airlines_seed.csv')
+
+
+airline_store = AirlineReferenceStore(
+    settings.AIRLINE_STORE_PATH or None,
+    ttl_seconds=settings.AIRLINE_STORE_TTL,
+    negative_ttl_seconds=settings.AIRLINE_STORE_NEGATIVE_TTL,
+    seed_path=_default_seed_path()
+)
@@ -0,0 +1,274 @@
+"""
+Offline city/airport name -> IATA resolver
+
+Gộp `city_airport_codes.csv` (City,Airport Code - bảng chọn tay, ưu tiên) và
+`airports_clean.csv` (City,IATA) thành một index đã biên dịch:
+
+- exact: dict tên chuẩn hoá -> mã
+- prefix: list tên đã sắp xếp + bisect ("HO CHI" -> HO CHI MINH)
+- fuzzy: khoảng cách sửa (Damerau-Levenshtein) có giới hạn; ứng viên khoảng cách 1
+  lấy từ bảng các biến thể xoá-một-ký-tự (kiểu SymSpell), khoảng cách 2 quét các tên
+  cùng chữ cái đầu và độ dài gần bằng
+
+Index được pickle vào AIRPORT_INDEX_PATH và tự build lại khi file CSV thay đổi
+(mtime/size) hoặc INDEX_VERSION tăng. File cache nằm trong thư mục do server quản
+lý (không nhận pickle từ nguồn ngoài).
+"""
+import csv
+import os
+import pickle
+import re
+import unicodedata
+from bisect import bisect_left
+from functools import lru_cache
+from typing import List, NamedTuple, Optional, Tuple
+
+from config import settings
+
+INDEX_VERSION = 1
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# (file, cột tên, cột mã) theo thứ tự ưu tiên: tên trùng thì file đứng trước thắng
+SOURCES = (
+    ('city_airport_codes.csv', 'City', 'Airport Code'),
+    ('airports_clean.csv', 'City', 'IATA'),
+)
+# Tiền tố tên hành chính và hậu tố bị bỏ khi chuẩn hoá ("Thành phố Hồ Chí Minh", "Ho Chi Minh City")
+_DROP_PREFIXES = (('THANH', 'PHO'), ('TP',))
+_DROP_SUFFIXES = (('INTERNATIONAL', 'AIRPORT'), ('AIRPORT',), ('CITY',))
+MIN_PREFIX_LENGTH = 4
+MAX_PREFIX_CANDIDATES = 64
+
+
+def normalize_place_name(name: str, strip_affixes: bool = True) -> str:
+    """
+    Bỏ dấu (kể cả đ/Đ), viết hoa, thay ký tự không phải chữ/số bằng khoảng trắng;
+    với strip_affixes, bỏ thêm tiền tố "Thành phố"/"TP" và hậu tố "City"/"Airport"
+    nếu còn lại tên khác.
+    """
+    text = unicodedata.normalize('NFKD', name or '').replace('đ', 'd').replace('Đ', 'D')
+    text = ''.join(c for c in text if not unicodedata.combining(c)).upper()
+    tokens = re.sub(r'[^0-9A-Z]+', ' ', text).split()
+    if not strip_affixes:
+        return ' '.join(tokens)
+    for prefix in _DROP_PREFIXES:
+        if len(tokens) > len(prefix) and tuple(tokens[:len(prefix)]) == prefix:
+            tokens = tokens[len(prefix):]
+            break
+    for suffix in _DROP_SUFFIXES:
+        if len(tokens) > len(suffix) and tuple(tokens[-len(suffix):]) == suffix:
+            tokens = tokens[:-len(suffix)]
+            break
+    return ' '.join(tokens)
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """
+    Khoảng cách Damerau-Levenshtein (optimal string alignment) giữa a và b,
+    dừng sớm và trả về max_distance + 1 khi chắc chắn vượt ngưỡng.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        row_min = current[0]
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if previous2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, previous2[j - 2] + 1)
+            current[j] = value
+            row_min = min(row_min, value)
+        if row_min > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def _deletes(name: str) -> set:
+    return {name[:i] + name[i + 1:] for i in range(len(name))}
+
+
+class AirportMatch(NamedTuple):
+    code: str
+    name: str  # tên chuẩn hoá khớp trong index
+    kind: str  # "exact" | "prefix" | "fuzzy"
+    distance: int = 0
+
+
+class AirportIndex:
+    """Index tên chuẩn hoá -> IATA, build một lần từ các file CSV"""
+
+    def __init__(self, entries: List[Tuple[str, str]]):
+        """entries: (tên chuẩn hoá, mã IATA) theo thứ tự ưu tiên; tên trùng giữ bản đầu"""
+        self.codes = {}
+        self.rank = {}
+        for name, code in entries:
+            if name and name not in self.codes:
+                self.rank[name] = len(self.codes)
+                self.codes[name] = code
+        self.names = sorted(self.codes)
+        # Tên viết liền bỏ khoảng trắng -> tên gốc ưu tiên nhất ("HA NOI" và "HANOI" cùng khớp)
+        self.compact = {}
+        for name in self.codes:
+            self.compact.setdefault(name.replace(' ', ''), name)
+        # Biến thể xoá một ký tự -> tên gốc (str) hoặc các tên gốc (tuple) - ứng viên khoảng cách 1
+        deletes = {}
+        for name in self.names:
+            for variant in _deletes(name):
+                deletes.setdefault(variant, []).append(name)
+        self.deletes = {variant: names[0] if len(names) == 1 else tuple(names)
+                        for variant, names in deletes.items()}
+        # (chữ cái đầu, độ dài) -> các tên, cho tìm khoảng cách 2
+        self.buckets = {}
+        for name in self.names:
+            self.buckets.setdefault((name[0], len(name)), []).append(name)
+
+    @classmethod
+    def from_csv(cls, sources=SOURCES, base_dir: str = BASE_DIR) -> "AirportIndex":
+        entries, aliases = [], []
+        for filename, name_col, code_col in sources:
+            try:
+                with open(os.path.join(base_dir, filename), mode='r', encoding='utf-8', newline='') as f:
+                    for row in csv.DictReader(f):
+                        code = (row.get(code_col) or '').strip().upper()
+                        if len(code) != 3 or not code.isalpha():
+                            continue
+                        name = row.get(name_col) or ''
+                        entries.append((normalize_place_name(name, strip_affixes=False), code))
+                        aliases.append((normalize_place_name(name), code))
+            except FileNotFoundError:
+                continue
+        # Tên đầy đủ ưu tiên hơn tên đã bỏ tiền tố/hậu tố ("PANAMA CITY" khác "PANAMA")
+        return cls(entries + aliases)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def exact(self, key: str) -> Optional[str]:
+        """Khớp chính xác, kể cả khi khác nhau chỉ ở khoảng trắng"""
+        code = self.codes.get(key)
+        if code is None:
+            name = self.compact.get(key.replace(' ', ''))
+            code = self.codes.get(name) if name else None
+        return code
+
+    def prefix(self, key: str, limit: int = 10) -> List[str]:
+        """Các tên bắt đầu bằng key: tên ngắn nhất trước, cùng độ dài thì theo ưu tiên nguồn"""
+        if len(key) < MIN_PREFIX_LENGTH:
+            return []
+        matches = []
+        position = bisect_left(self.names, key)
+        while position < len(self.names) and len(matches) < MAX_PREFIX_CANDIDATES:
+            name = self.names[position]
+            if not name.startswith(key):
+                break
+            matches.append(name)
+            position += 1
+        matches.sort(key=lambda name: (len(name), self.rank[name]))
+        return matches[:limit]
+
+    def fuzzy(self, key: str, max_distance: int) -> Optional[Tuple[str, int]]:
+        """Tên gần key nhất trong phạm vi max_distance (1 hoặc 2): (tên, khoảng cách) hoặc None"""
+        if max_distance <= 0 or not key:
+            return None
+        # Khoảng cách 1: key và tên có chung một biến thể xoá (thay thế/chèn/xoá/đổi chỗ)
+        candidates = set()
+        for variant in (key, *_deletes(key)):
+            if variant is not key and variant in self.codes:
+                candidates.add(variant)
+            names = self.deletes.get(variant)
+            if isinstance(names, str):
+                candidates.add(names)
+            elif names:
+                candidates.update(names)
+        best = self._best(key, candidates, 1)
+        if best is not None or max_distance < 2:
+            return best
+        candidates = []
+        for length in range(len(key) - max_distance, len(key) + max_distance + 1):
+            candidates.extend(self.buckets.get((key[0], length), ()))
+        return self._best(key, candidates, max_distance)
+
+    def _best(self, key: str, candidates, max_distance: int) -> Optional[Tuple[str, int]]:
+        best = None
+        for name in candidates:
+            distance = edit_distance(key, name, max_distance)
+            if distance <= max_distance:
+                rank = (distance, self.rank[name])
+                if best is None or rank < best[0]:
+                    best = (rank, name)
+        return (best[1], best[0][0]) if best else None
+
+    def lookup(self, name_or_code: str) -> Optional[AirportMatch]:
+        """exact -> prefix -> fuzzy; None nếu không đủ chắc chắn (để gọi Amadeus)"""
+        full_key = normalize_place_name(name_or_code, strip_affixes=False)
+        if full_key in self.codes:
+            return AirportMatch(self.codes[full_key], full_key, 'exact')
+        key = normalize_place_name(name_or_code)
+        if not key:
+            return None
+        code = self.exact(key)
+        if code:
+            return AirportMatch(code, key, 'exact')
+        prefixed = self.prefix(key, limit=1)
+        if prefixed:
+            return AirportMatch(self.codes[prefixed[0]], prefixed[0], 'prefix')
+        # Tên ngắn dễ khớp nhầm: chỉ cho phép sửa 1 ký tự từ 5 ký tự, 2 ký tự từ 9 ký tự
+        max_distance = 2 if len(key) >= 9 else (1 if len(key) >= 5 else 0)
+        found = self.fuzzy(key, max_distance)
+        if found is None and ' ' in key:
+            # Nguồn có thể viết liền ("DANANG"): thử lại với key bỏ khoảng trắng
+            found = self.fuzzy(key.replace(' ', ''), max_distance)
+        if found:
+            return AirportMatch(self.codes[found[0]], found[0], 'fuzzy', found[1])
+        return None
+
+    def resolve(self, name_or_code: str) -> Optional[str]:
+        match = self.lookup(name_or_code)
+        return match.code if match else None
+
+
+def _source_signature(base_dir: str = BASE_DIR) -> tuple:
+    signature = [INDEX_VERSION]
+    for filename, _, _ in SOURCES:
+        try:
+            stat = os.stat(os.path.join(base_dir, filename))
+            signature.append((filename, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append((filename, None, None))
+    return tuple(signature)
+
+
+def load_airport_index(cache_path: Optional[str] = None) -> AirportIndex:
+    """Nạp index từ file pickle nếu còn khớp với các file CSV, nếu không thì build và ghi lại"""
+    signature = _source_signature()
+    if cache_path:
+        try:
+            with open(cache_path, 'rb') as f:
+                cached_signature, index = pickle.load(f)
+            if cached_signature == signature:
+                return index
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Airport index cache ignored: {e}")
+
+    index = AirportIndex.from_csv()
+    if cache_path:
+        tmp_path = f"{cache_path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                pickle.dump((signature, index), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"Airport index cache write failed: {e}")
+    return index
+
+
+@lru_cache(maxsize=1)
+def get_airport_index() -> AirportIndex:
+    """Index dùng chung trong process, nạp lần đầu cần dùng (hoặc khi warm-up)"""
+    return load_airport_index(settings.AIRPORT_INDEX_PATH or None)
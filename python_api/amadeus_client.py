@@ -0,0 +1,155 @@
+"""
+Async Amadeus REST client with pooled HTTP connections and cached OAuth token
+"""
+import asyncio
+import time
+from typing import Optional
+
+import httpx
+
+from config import settings
+
+AMADEUS_HOSTS = {
+    'test': 'https://test.api.amadeus.com',
+    'production': 'https://api.amadeus.com',
+}
+
+
+class AmadeusAPIError(Exception):
+    """Lỗi trả về từ Amadeus API (status_code=None nếu lỗi mạng)"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class AmadeusAsyncClient:
+    """
+    Client async cho Amadeus, dùng chung một connection pool httpx và một
+    access token OAuth cho toàn bộ worker (token được làm mới trước khi hết hạn)
+    """
+
+    def __init__(self, client_id: str, client_secret: str, hostname: str = 'test',
+                 timeout: float = 30.0, max_connections: int = 20):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.base_url = AMADEUS_HOSTS.get(hostname, AMADEUS_HOSTS['test'])
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._http: Optional[httpx.AsyncClient] = None
+        self._loop = None
+        self._token: Optional[str] = None
+        self._token_expires_at = 0.0
+        self._token_lock: Optional[asyncio.Lock] = None
+
+    def _get_http(self) -> httpx.AsyncClient:
+        """Tạo httpx client lazily, gắn với event loop hiện tại"""
+        loop = asyncio.get_running_loop()
+        if self._http is None or self._loop is not loop:
+            self._http = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+            )
+            self._loop = loop
+            self._token_lock = asyncio.Lock()
+        return self._http
+
+    async def _get_token(self, force_refresh: bool = False) -> str:
+        http = self._get_http()
+        # Làm mới token sớm 60s để tránh hết hạn giữa chừng
+        if not force_refresh and self._token and time.monotonic() < self._token_expires_at - 60:
+            return self._token
+
+        async with self._token_lock:
+            if not force_refresh and self._token and time.monotonic() < self._token_expires_at - 60:
+                return self._token
+            try:
+                response = await http.post('/v1/security/oauth2/token', data={
+                    'grant_type': 'client_credentials',
+                    'client_id': self.client_id,
+                    'client_secret': self.client_secret,
+                })
+            except httpx.HTTPError as e:
+                raise AmadeusAPIError(f"Amadeus auth request failed: {e}") from e
+            if response.status_code != 200:
+                raise AmadeusAPIError(f"Amadeus auth failed: {response.text}", response.status_code)
+            payload = response.json()
+            self._token = payload['access_token']
+            self._token_expires_at = time.monotonic() + float(payload.get('expires_in', 1799))
+            return self._token
+
+    async def get(self, path: str, params: dict) -> dict:
+        """GET có xác thực; tự làm mới token một lần nếu gặp 401"""
+        http = self._get_http()
+        for attempt in range(2):
+            token = await self._get_token(force_refresh=attempt > 0)
+            try:
+                response = await http.get(path, params=params,
+                                          headers={'Authorization': f'Bearer {token}'})
+            except httpx.HTTPError as e:
+                raise AmadeusAPIError(f"Amadeus request failed: {e}") from e
+            if response.status_code == 401 and attempt == 0:
+                continue
+            if response.status_code >= 400:
+                raise AmadeusAPIError(f"Amadeus API error [{response.status_code}]: {response.text}",
+                                      response.status_code)
+            return response.json()
+        raise AmadeusAPIError("Amadeus authentication failed", 401)
+
+    async def flight_offers_search(self, origin: str, destination: str, departure_date: str,
+                                   adults: int = 1, max_results: int = 100) -> list:
+        payload = await self.get('/v2/shopping/flight-offers', {
+            'originLocationCode': origin,
+            'destinationLocationCode': destination,
+            'departureDate': departure_date,
+            'adults': adults,
+            'max': max_results,
+        })
+        return payload.get('data', [])
+
+    async def airlines(self, codes: str) -> list:
+        payload = await self.get('/v1/reference-data/airlines', {'airlineCodes': codes})
+        return payload.get('data', [])
+
+    async def locations(self, keyword: str, sub_type: str = 'CITY,AIRPORT', limit: int = 5,
+                        country_code: Optional[str] = None) -> list:
+        params = {'keyword': keyword, 'subType': sub_type, 'page[limit]': limit}
+        if country_code:
+            params['countryCode'] = country_code
+        payload = await self.get('/v1/reference-data/locations', params)
+        return payload.get('data', [])
+
+    async def warm_up(self):
+        """Mở sẵn kết nối tới Amadeus và lấy access token trước request đầu tiên"""
+        await self._get_token()
+
+    async def close(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+            self._loop = None
+
+
+_client: Optional[AmadeusAsyncClient] = None
+
+
+def get_client() -> AmadeusAsyncClient:
+    """Trả về client Amadeus async dùng chung trong worker"""
+    global _client
+    if _client is None:
+        _client = AmadeusAsyncClient(
+            client_id=settings.AMADEUS_CLIENT_ID,
+            client_secret=settings.AMADEUS_CLIENT_SECRET,
+            hostname=settings.AMADEUS_HOSTNAME,
+            timeout=settings.AMADEUS_TIMEOUT,
+            max_connections=settings.AMADEUS_MAX_CONNECTIONS,
+        )
+    return _client
+
+
+async def close_client():
+    """Đóng connection pool (gọi khi tắt ứng dụng)"""
+    if _client is not None:
+        await _client.close()
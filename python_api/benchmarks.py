@@ -0,0 +1,427 @@
+"""
+Micro-benchmarks for the Python Travel API
+
+Usage:
+    python benchmarks.py prompt [--places 300] [--count-tokens]
+    python benchmarks.py distance [--sizes 100 1000 5000]
+    python benchmarks.py ingest [--places 10000]
+    python benchmarks.py startup [--runs 3] [--online]
+    python benchmarks.py airports [--lookups 2000]
+    python benchmarks.py responses [--days 30] [--offers 100]
+"""
+import argparse
+import random
+import time
+
+from config import settings
+
+
+def make_places(count: int, prefix: str, seed: int = 42, center=(21.0285, 105.8542)) -> list:
+    """Tạo danh sách place giả lập giống payload Laravel gửi sang"""
+    rng = random.Random(f"{seed}-{prefix}")
+    places = []
+    for index in range(count):
+        places.append({
+            "id": f"{prefix}_{index}",
+            "place_id": None,
+            "name": {"text": f"{prefix.title()} Place {index}", "languageCode": "en"},
+            "category": rng.choice(["museum", "park", "market", "temple", "cafe", "restaurant", "hotel"]),
+            "rating": round(rng.uniform(2.5, 5.0), 1),
+            "reviews": rng.randint(0, 20000),
+            "latitude": center[0] + rng.uniform(-0.08, 0.08),
+            "longitude": center[1] + rng.uniform(-0.08, 0.08),
+            "avg_price": round(rng.uniform(0, 150), 2),
+        })
+    return places
+
+
+def make_places_data(count: int, seed: int = 42) -> dict:
+    return {
+        "activities": make_places(count, "activity", seed),
+        "restaurants": make_places(count, "restaurant", seed),
+        "hotels": make_places(max(5, count // 10), "hotel", seed),
+    }
+
+
+def bench_prompt(args):
+    """So sánh kích thước prompt: json (cũ), compact, compact + pre-ranking"""
+    import copy
+    import services
+
+    places_data = make_places_data(args.places)
+    user_prefs = {
+        "liked_activities": places_data["activities"][:3],
+        "disliked_activities": places_data["activities"][3:5],
+        "liked_restaurants": places_data["restaurants"][:2],
+        "disliked_restaurants": [],
+        "liked_hotels": places_data["hotels"][:1],
+        "disliked_hotels": [],
+        "liked_transport": ["taxi"],
+        "disliked_transport": [],
+    }
+    user_input = services.create_user_tour_info_simple("bench", "Hanoi", "Hanoi", 2, 3, 1500.0)
+
+    print(f"Prompt size with {args.places} activities/restaurants:")
+    original = (settings.PROMPT_ENCODING, settings.PRERANK_ENABLED)
+    try:
+        for encoding, prerank in (("json", False), ("compact", False), ("compact", True)):
+            settings.PROMPT_ENCODING, settings.PRERANK_ENABLED = encoding, prerank
+            prefs_copy, places_copy = copy.deepcopy(user_prefs), copy.deepcopy(places_data)
+            start = time.perf_counter()
+            context = services._prepare_itinerary_context(user_input, "Hanoi", prefs_copy, places_copy)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            label = encoding + ("+prerank" if prerank else "")
+            line = (f"  {label:16s} chars={len(context['prompt']):>9,d} "
+                    f"est_tokens={context['prompt_tokens_estimate']:>8,d} build={elapsed_ms:.1f}ms")
+            if args.count_tokens:
+                line += f" gemini_tokens={services.get_gemini_model().count_tokens(context['prompt']).total_tokens:,d}"
+            print(line)
+    finally:
+        settings.PROMPT_ENCODING, settings.PRERANK_ENABLED = original
+
+
+def bench_distance(args):
+    """Ma trận khoảng cách/thời gian/chi phí: vòng lặp scalar vs NumPy vectorized"""
+    import numpy as np
+    import utils
+
+    # Vòng lặp scalar O(N^2) rất chậm với N lớn: chỉ đo tối đa `--scalar-rows` hàng rồi ngoại suy
+    for n in args.sizes:
+        places = make_places(n, "place")
+        lats = np.array([p["latitude"] for p in places])
+        lons = np.array([p["longitude"] for p in places])
+        rows = min(n, args.scalar_rows)
+
+        start = time.perf_counter()
+        for i in range(rows):
+            for j in range(n):
+                distance = utils.haversine_distance(lats[i], lons[i], lats[j], lons[j])
+                utils.calculate_travel_time(distance, "taxi")
+                utils.calculate_transport_cost(distance, "taxi")
+        scalar_s = (time.perf_counter() - start) * n / rows
+
+        start = time.perf_counter()
+        matrix = utils.haversine_matrix(lats, lons)
+        matrix_s = time.perf_counter() - start
+        start = time.perf_counter()
+        utils.calculate_travel_times(matrix, "taxi")
+        utils.calculate_transport_costs(matrix, "taxi")
+        derived_s = time.perf_counter() - start
+        start = time.perf_counter()
+        utils.haversine_matrix(lats, lons, condensed=True)
+        condensed_s = time.perf_counter() - start
+
+        vector_s = matrix_s + derived_s
+        estimated = " (extrapolated)" if rows < n else ""
+        print(f"  N={n:>5,d} scalar={scalar_s * 1000:>10.1f}ms{estimated:15s} "
+              f"matrix={matrix_s * 1000:7.1f}ms time+cost={derived_s * 1000:7.1f}ms "
+              f"condensed={condensed_s * 1000:7.1f}ms speedup={scalar_s / vector_s:6.0f}x "
+              f"matrix_mb={matrix.nbytes / 1e6:.1f}")
+
+
+def _legacy_ingest(request):
+    """Đường cũ: model_dump + đổi tên field name -> normalize_price -> DataFrame -> to_dict"""
+    import pandas as pd
+
+    def serialize(place):
+        place_dict = place.model_dump()
+        if isinstance(place_dict.get("name"), dict) and "language_code" in place_dict["name"]:
+            place_dict["name"]["languageCode"] = place_dict["name"].pop("language_code")
+        return place_dict
+
+    def normalize_price(place):
+        price_val = place.get('avg_price', '0')
+        if isinstance(price_val, str):
+            price_str = price_val.replace('$', '').replace(',', '').strip()
+            try:
+                place['avg_price'] = float(price_str) if price_str and price_str != '-' else 0.0
+            except ValueError:
+                place['avg_price'] = 0.0
+        elif price_val is None:
+            place['avg_price'] = 0.0
+        return place
+
+    travel_data = {}
+    for key in ("activities", "restaurants", "hotels"):
+        places = [normalize_price(serialize(place)) for place in getattr(request, key)]
+        frame = pd.DataFrame(places) if places else pd.DataFrame()
+        travel_data[key] = frame.to_dict('records') if not frame.empty else []
+    return travel_data
+
+
+def _new_ingest(request):
+    """Đường mới: ingest ở main.py rồi lượt chuẩn hoá (no-op) trong services"""
+    from ingest import PLACE_CATEGORIES, ingest_places
+
+    places_data = {key: ingest_places(getattr(request, key)) for key in PLACE_CATEGORIES}
+    return {key: ingest_places(places_data[key]) for key in PLACE_CATEGORIES}
+
+
+def bench_ingest(args):
+    """CPU time và bộ nhớ đỉnh (tracemalloc) của bước ingest places sau khi pydantic validate"""
+    import tracemalloc
+    from models import TravelPreferencesRequest
+
+    payload = make_places_data(args.places)
+    for places in payload.values():
+        for index, place in enumerate(places):
+            if index % 3 == 0:
+                place["name"] = place["name"]["text"]
+            if index % 5 == 0:
+                place["avg_price"] = None
+    request = TravelPreferencesRequest(city_name="Hanoi", **payload)
+    total = sum(len(places) for places in payload.values())
+    print(f"Ingest of {total:,d} validated places:")
+
+    pipelines = [("new", _new_ingest)]
+    try:
+        import pandas  # noqa: F401
+        pipelines.insert(0, ("legacy", _legacy_ingest))
+    except ImportError:
+        print("  legacy: skipped (pandas not installed)")
+
+    for label, pipeline in pipelines:
+        pipeline(request)  # warm-up (imports, caches)
+        start = time.process_time()
+        for _ in range(args.repeat):
+            pipeline(request)
+        cpu_ms = (time.process_time() - start) * 1000 / args.repeat
+
+        tracemalloc.start()
+        result = pipeline(request)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"  {label:8s} cpu={cpu_ms:8.1f}ms peak_mem={peak / 1e6:7.1f}MB "
+              f"keys/place={len(result['activities'][0]) if result['activities'] else 0}")
+
+
+# Chạy trong process con mới: đo import main, thời gian warm-up và request đầu tiên
+_STARTUP_PROBE = """
+import asyncio, json, time
+start = time.perf_counter()
+import main
+import_ms = (time.perf_counter() - start) * 1000
+import httpx
+import flight, services
+
+async def probe():
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            start = time.perf_counter()
+            while not (await client.get("/health")).json()["ready"]:
+                await asyncio.sleep(0.005)
+            ready_ms = (time.perf_counter() - start) * 1000
+            # Request đầu tiên điển hình: resolve thành phố + tên sân bay (flights), Gemini model (itinerary)
+            start = time.perf_counter()
+            flight.resolve_city_or_airport_code("Ho Chi Minh City")
+            flight.get_airport_name("SGN")
+            services.get_gemini_model()
+            await client.get("/health")
+            first_ms = (time.perf_counter() - start) * 1000
+    return {"import_ms": import_ms, "ready_ms": ready_ms, "first_ms": first_ms}
+
+print(json.dumps(asyncio.run(probe())))
+"""
+
+
+def bench_startup(args):
+    """Thời gian import main, warm-up và request đầu tiên, có/không warm-up (mỗi lần một process mới)"""
+    import json
+    import os
+    import statistics
+    import subprocess
+    import sys
+
+    base_env = dict(os.environ, GEMINI_API_KEY=os.environ.get("GEMINI_API_KEY") or "bench-key")
+    if not args.online:
+        # Không mở kết nối Amadeus thật trong warm-up
+        base_env.update(AMADEUS_CLIENT_ID="", AMADEUS_CLIENT_SECRET="")
+    here = os.path.dirname(os.path.abspath(__file__))
+    for label, warm in (("no warm-up", "False"), ("warm-up", "True")):
+        runs = []
+        for _ in range(args.runs):
+            output = subprocess.run([sys.executable, "-W", "ignore", "-c", _STARTUP_PROBE], cwd=here,
+                                    env=dict(base_env, WARMUP_ENABLED=warm),
+                                    capture_output=True, text=True, check=True).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        median = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+        print(f"  {label:11s} import={median['import_ms']:7.1f}ms ready_after={median['ready_ms']:7.1f}ms "
+              f"first_request={median['first_ms']:7.1f}ms")
+
+
+def bench_airports(args):
+    """Build/nạp airport index và thời gian tra cứu exact/prefix/fuzzy (không gọi API)"""
+    import os
+    import statistics
+    import tempfile
+    from airport_index import AirportIndex, load_airport_index
+
+    start = time.perf_counter()
+    index = AirportIndex.from_csv()
+    build_ms = (time.perf_counter() - start) * 1000
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_path = os.path.join(tmp, "airport_index.pkl")
+        load_airport_index(cache_path)
+        start = time.perf_counter()
+        load_airport_index(cache_path)
+        load_ms = (time.perf_counter() - start) * 1000
+        size_kb = os.path.getsize(cache_path) / 1024
+    print(f"Airport index: {len(index):,d} names, build={build_ms:.1f}ms, "
+          f"load from cache={load_ms:.1f}ms ({size_kb:.0f}KB)")
+
+    rng = random.Random(42)
+    names = rng.sample(index.names, min(args.lookups, len(index.names)))
+    queries = {
+        "exact": [name.title() for name in names],
+        "prefix": [name[:max(4, len(name) - 3)] for name in names if len(name) >= 7],
+        "fuzzy": [name[:len(name) // 2] + name[len(name) // 2 + 1:] for name in names if len(name) >= 6],
+        "miss": [f"Qzx{name}" for name in names],
+    }
+    for kind, items in queries.items():
+        timings, resolved = [], 0
+        for query in items:
+            start = time.perf_counter()
+            resolved += index.resolve(query) is not None
+            timings.append((time.perf_counter() - start) * 1e6)
+        print(f"  {kind:7s} n={len(items):5d} resolved={resolved / len(items):6.1%} "
+              f"median={statistics.median(timings):7.1f}us p99={sorted(timings)[int(len(timings) * 0.99)]:7.1f}us")
+
+
+def _make_itinerary_response(days: int) -> dict:
+    """Payload /api/recommendations cho chuyến `days` ngày, mỗi ngày 6 hoạt động"""
+    rng = random.Random(42)
+    schedule = []
+    for day in range(1, days + 1):
+        activities = [{
+            "time": f"{8 + 2 * slot:02d}:00",
+            "place_id": f"place_{day}_{slot}",
+            "place_name": f"Địa điểm tham quan số {day}-{slot}",
+            "type": rng.choice(["restaurant", "attraction", "museum", "park"]),
+            "description": "Khám phá ẩm thực và văn hoá địa phương cùng hướng dẫn viên",
+            "duration_hours": 1.5,
+            "estimated_cost": round(rng.uniform(50_000, 500_000), 0),
+            "transport": {"mode": "taxi", "distance_km": round(rng.uniform(1, 15), 2), "cost": 80_000},
+        } for slot in range(6)]
+        schedule.append({"day": day, "date": f"2026-11-{day:02d}", "activities": activities,
+                         "daily_cost": sum(a["estimated_cost"] for a in activities)})
+    return {
+        "success": True,
+        "error": None,
+        "data": {
+            "tour_info": {"tour_id": "bench", "user_id": "1", "start_city": "Hà Nội",
+                          "destination_city": "Đà Nẵng", "duration_days": days, "guest_count": 2,
+                          "current_day": 1, "budget": 50_000_000.0, "total_estimated_cost": 42_000_000.0,
+                          "generated_by": "gemini", "created_at": "2026-10-18 09:00:00"},
+            "itinerary": schedule,
+            "summary": {"total_days": days, "total_activities": days * 6,
+                        "cost_per_person": 21_000_000.0, "budget_utilized": 84.0},
+        },
+    }
+
+
+def _make_flight_response(offers: int) -> dict:
+    """Payload /api/flight-search: `offers` chuyến bay đã rút gọn, nhóm theo hãng"""
+    from flight import group_by_airline
+
+    rng = random.Random(42)
+    airlines = ["Vietnam Airlines", "VietJet Air", "Bamboo Airways", "Pacific Airlines"]
+    flights = []
+    for i in range(offers):
+        stops = [{"iata": "DAD", "name": "Da Nang International Airport",
+                  "arrival": "2026-11-01T10:05:00", "departure": "2026-11-01T11:30:00"}] if i % 3 == 0 else []
+        flights.append({
+            "airline": airlines[i % len(airlines)], "flight_code": f"VN{100 + i}",
+            "dep_iata": "HAN", "arr_iata": "SGN",
+            "dep_airport": "Noi Bai International Airport", "arr_airport": "Tan Son Nhat International Airport",
+            "dep_time": f"2026-11-01T{6 + i % 16:02d}:00:00", "arr_time": f"2026-11-01T{8 + i % 14:02d}:10:00",
+            "dep_timezone": "Asia/Ho_Chi_Minh", "arr_timezone": "Asia/Ho_Chi_Minh",
+            "duration_minutes": 130 + 85 * (i % 3 == 0),
+            "price": f"{rng.uniform(1_000_000, 4_000_000):.2f}", "currency": "VND", "stops": stops,
+        })
+    return {"success": True, "data": group_by_airline(flights)}
+
+
+def bench_responses(args):
+    """Kích thước payload (thô/gzip/br) và thời gian serialize theo endpoint: json chuẩn vs orjson, có/không re-validate"""
+    import gzip
+    import statistics
+    from starlette.responses import JSONResponse
+    import responses
+    from models import TravelRecommendationResponse
+
+    def timed(func, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
+
+    payloads = {
+        f"/api/recommendations ({args.days}d)": _make_itinerary_response(args.days),
+        f"/api/flight-search ({args.offers} offers)": _make_flight_response(args.offers),
+    }
+    print(f"orjson: {'yes' if responses.orjson else 'no'}, brotli: {'yes' if responses.brotli else 'no'}")
+    for label, content in payloads.items():
+        body = responses.FastJSONResponse(content).body
+        sizes = f"raw={len(body) / 1024:7.1f}KB gzip={len(gzip.compress(body, responses.GZIP_LEVEL)) / 1024:6.1f}KB"
+        if responses.brotli:
+            sizes += f" br={len(responses.compress(body, 'br')) / 1024:6.1f}KB"
+        print(f"{label}: {sizes}")
+        std_ms = timed(lambda: JSONResponse(content), args.repeat)
+        fast_ms = timed(lambda: responses.FastJSONResponse(content), args.repeat)
+        print(f"  json (JSONResponse)        {std_ms:7.2f}ms")
+        print(f"  orjson (FastJSONResponse)  {fast_ms:7.2f}ms  x{std_ms / fast_ms:.1f}")
+        if "itinerary" in content["data"]:
+            # Đường cũ: dựng TravelRecommendationResponse rồi FastAPI validate + dump lại trước khi encode
+            validate_ms = timed(lambda: JSONResponse(
+                TravelRecommendationResponse.model_validate(TravelRecommendationResponse(**content).model_dump())
+                .model_dump(mode="json")), args.repeat)
+            print(f"  re-validate + json (old)   {validate_ms:7.2f}ms  x{validate_ms / fast_ms:.1f} vs orjson")
+        gzip_ms = timed(lambda: responses.compress(body, "gzip"), args.repeat)
+        print(f"  gzip level {responses.GZIP_LEVEL}               {gzip_ms:7.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    prompt = sub.add_parser("prompt", help="prompt token count: json vs compact encoding vs pre-ranking")
+    prompt.add_argument("--places", type=int, default=300)
+    prompt.add_argument("--count-tokens", action="store_true",
+                        help="also ask Gemini count_tokens (needs GEMINI_API_KEY)")
+    prompt.set_defaults(func=bench_prompt)
+
+    distance = sub.add_parser("distance", help="distance/time/cost matrices: scalar loops vs NumPy")
+    distance.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000])
+    distance.add_argument("--scalar-rows", type=int, default=200,
+                          help="rows timed with the scalar loop before extrapolating")
+    distance.set_defaults(func=bench_distance)
+
+    ingest = sub.add_parser("ingest", help="places ingestion: legacy DataFrame round trip vs single pass")
+    ingest.add_argument("--places", type=int, default=10000)
+    ingest.add_argument("--repeat", type=int, default=5)
+    ingest.set_defaults(func=bench_ingest)
+
+    startup = sub.add_parser("startup", help="import time, warm-up and first-request latency")
+    startup.add_argument("--runs", type=int, default=3)
+    startup.add_argument("--online", action="store_true", help="also open the Amadeus connection during warm-up")
+    startup.set_defaults(func=bench_startup)
+
+    airports = sub.add_parser("airports", help="offline city/airport index: build, load and lookup latency")
+    airports.add_argument("--lookups", type=int, default=2000)
+    airports.set_defaults(func=bench_airports)
+
+    responses = sub.add_parser("responses", help="response payload size and serialization time per endpoint")
+    responses.add_argument("--days", type=int, default=30)
+    responses.add_argument("--offers", type=int, default=100)
+    responses.add_argument("--repeat", type=int, default=50)
+    responses.set_defaults(func=bench_responses)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
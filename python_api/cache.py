@@ -0,0 +1,384 @@
+"""
+In-process caches: TTL + LRU in memory with an optional on-disk tier, and an
+async stale-while-revalidate cache for upstream API responses
+"""
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+from concurrency import SingleFlight
+
+
+def canonical_hash(payload: Any) -> str:
+    """SHA-256 của JSON chuẩn hoá (sort keys, không khoảng trắng) - dùng làm cache key"""
+    encoded = json.dumps(payload, sort_keys=True, separators=(',', ':'),
+                         ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class TTLCache:
+    """
+    Cache key -> value với TTL, giới hạn số entry theo LRU.
+
+    Nếu có `disk_dir`, mỗi entry còn được ghi thành một file JSON để sống sót
+    qua restart; entry chỉ có trên đĩa sẽ được nạp lại vào bộ nhớ khi đọc.
+    mtime của file được đặt bằng thời điểm hết hạn, nên sweep_disk() chỉ cần
+    stat để xoá file hết hạn và giữ tầng đĩa trong giới hạn max_disk_entries /
+    max_disk_bytes (xoá file sắp hết hạn nhất trước). Sweep chạy định kỳ qua
+    run_sweeper() và sau mỗi ~10% max_disk_entries lượt ghi.
+    Giá trị được deep-copy khi ghi và khi đọc để caller không làm hỏng cache.
+    Code async dùng get_async/set_async để đọc/ghi file trong thread.
+    """
+
+    def __init__(self, name: str, ttl_seconds: float, max_entries: int = 256,
+                 disk_dir: Optional[str] = None, max_disk_entries: int = 0, max_disk_bytes: int = 0):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_disk_entries = max_disk_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._sweep_lock = threading.Lock()
+        self._writes_since_sweep = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_entries = 0
+        self.disk_bytes = 0
+        self.disk_evictions = 0
+        self.disk_expired = 0
+        self.sweeps = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _read_disk(self, key: str):
+        try:
+            with open(self._disk_path(key), 'r', encoding='utf-8') as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if record.get('expires_at', 0) <= time.time():
+            self._delete_disk(key)
+            return None
+        return record
+
+    def _write_disk(self, key: str, value: Any, expires_at: float):
+        path = self._disk_path(key)
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'expires_at': expires_at, 'value': value}, f, ensure_ascii=False, default=str)
+            # mtime = thời điểm hết hạn: sweep không cần đọc nội dung file
+            os.utime(tmp_path, (expires_at, expires_at))
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Cache '{self.name}' disk write failed: {e}")
+            return
+        with self._lock:
+            self._writes_since_sweep += 1
+            due = self.max_disk_entries and self._writes_since_sweep >= max(1, self.max_disk_entries // 10)
+        if due:
+            self.sweep_disk()
+
+    def _delete_disk(self, key: str):
+        try:
+            os.remove(self._disk_path(key))
+        except OSError:
+            pass
+
+    def _store(self, key: str, value: Any, expires_at: float):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _get_memory(self, key: str, now: float):
+        """(found, bản sao giá trị) từ bộ nhớ; gọi khi giữ _lock"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, copy.deepcopy(value)
+            del self._entries[key]
+        return False, None
+
+    def _load_disk(self, key: str) -> Optional[Any]:
+        record = self._read_disk(key)
+        with self._lock:
+            if record is None:
+                self.misses += 1
+                return None
+            self._store(key, record['value'], record['expires_at'])
+            self.hits += 1
+            self.disk_hits += 1
+            return copy.deepcopy(record['value'])
+
+    def get(self, key: str) -> Optional[Any]:
+        """Trả về bản sao giá trị còn hạn, hoặc None"""
+        with self._lock:
+            found, value = self._get_memory(key, time.time())
+            if found:
+                return value
+            if not self.disk_dir:
+                self.misses += 1
+                return None
+        return self._load_disk(key)
+
+    async def get_async(self, key: str) -> Optional[Any]:
+        """Như get(), đọc tầng đĩa trong thread để không chặn event loop"""
+        with self._lock:
+            found, value = self._get_memory(key, time.time())
+            if found:
+                return value
+            if not self.disk_dir:
+                self.misses += 1
+                return None
+        return await asyncio.to_thread(self._load_disk, key)
+
+    def _set_memory(self, key: str, value: Any, ttl_seconds: Optional[float]) -> tuple:
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        expires_at = time.time() + ttl
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._store(key, value, expires_at)
+        return value, expires_at
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        value, expires_at = self._set_memory(key, value, ttl_seconds)
+        if self.disk_dir:
+            self._write_disk(key, value, expires_at)
+
+    async def set_async(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        """Như set(), ghi file (và sweep nếu đến lượt) trong thread"""
+        value, expires_at = self._set_memory(key, value, ttl_seconds)
+        if self.disk_dir:
+            await asyncio.to_thread(self._write_disk, key, value, expires_at)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.disk_dir:
+            self._delete_disk(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.disk_dir:
+            for filename in os.listdir(self.disk_dir):
+                if filename.endswith('.json'):
+                    self._delete_disk(filename[:-5])
+
+    def sweep_disk(self) -> int:
+        """
+        Xoá file hết hạn (và file .tmp bỏ dở), rồi xoá file sắp hết hạn nhất cho tới khi
+        tầng đĩa nằm trong max_disk_entries / max_disk_bytes. Trả về số file đã xoá.
+        """
+        if not self.disk_dir:
+            return 0
+        with self._sweep_lock:
+            now = time.time()
+            removed = expired = 0
+            files = []
+            try:
+                entries = list(os.scandir(self.disk_dir))
+            except OSError as e:
+                print(f"Cache '{self.name}' sweep failed: {e}")
+                return 0
+            for entry in entries:
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if entry.name.endswith('.json.tmp'):
+                    # File tạm của lượt ghi bị ngắt giữa chừng (còn mới thì có thể đang ghi)
+                    if now - stat.st_mtime > 60 and _remove(entry.path):
+                        removed += 1
+                    continue
+                if not entry.name.endswith('.json'):
+                    continue
+                if stat.st_mtime <= now:
+                    if _remove(entry.path):
+                        removed += 1
+                        expired += 1
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+            files.sort()
+            total_bytes = sum(size for _, size, _ in files)
+            evicted = 0
+            while files and ((self.max_disk_entries and len(files) > self.max_disk_entries)
+                             or (self.max_disk_bytes and total_bytes > self.max_disk_bytes)):
+                _, size, path = files.pop(0)
+                total_bytes -= size
+                if _remove(path):
+                    removed += 1
+                    evicted += 1
+
+            with self._lock:
+                self._writes_since_sweep = 0
+                self.disk_entries = len(files)
+                self.disk_bytes = total_bytes
+                self.disk_expired += expired
+                self.disk_evictions += evicted
+                self.sweeps += 1
+            return removed
+
+    async def run_sweeper(self, interval: float):
+        """Sweep tầng đĩa định kỳ (chạy như background task trong lifespan)"""
+        while True:
+            await asyncio.to_thread(self.sweep_disk)
+            await asyncio.sleep(interval)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "disk_tier": bool(self.disk_dir),
+            "disk_entries": self.disk_entries,
+            "disk_bytes": self.disk_bytes,
+            "disk_expired": self.disk_expired,
+            "disk_evictions": self.disk_evictions,
+            "sweeps": self.sweeps
+        }
+
+
+def _remove(path: str) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
+
+
+class StaleWhileRevalidateCache:
+    """
+    Cache async cho kết quả API upstream: TTL ngắn + cửa sổ ân hạn (stale).
+
+    - Còn hạn (tuổi < ttl_seconds): trả ngay.
+    - Quá hạn nhưng trong cửa sổ ân hạn (tuổi < ttl_seconds + stale_seconds): trả
+      bản cũ ngay và làm mới ở background (mỗi key tối đa một lượt làm mới).
+    - Không có / quá cửa sổ ân hạn: gọi upstream; các lượt miss đồng thời cùng key
+      dùng chung một lời gọi.
+    Lời gọi upstream lỗi (raise) không được ghi vào cache; làm mới ở background lỗi
+    thì giữ bản cũ. Giới hạn số entry theo LRU. Giá trị được dùng chung, không copy:
+    caller không được sửa giá trị trả về.
+    """
+
+    def __init__(self, name: str, ttl_seconds: float, stale_seconds: float, max_entries: int = 1024):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._fetches = SingleFlight(f"{name}_fetch")
+        self._refreshing: dict = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.evictions = 0
+
+    def _store(self, key, value):
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def _fetch(self, key, fetch: Callable[[], Awaitable[Any]]):
+        async def fetch_and_store():
+            value = await fetch()
+            self._store(key, value)
+            return value
+        return await self._fetches.do(key, fetch_and_store)
+
+    def _refresh_in_background(self, key, fetch: Callable[[], Awaitable[Any]]):
+        if key in self._refreshing:
+            return
+
+        async def refresh():
+            try:
+                await self._fetch(key, fetch)
+                self.refreshes += 1
+            except Exception as e:
+                self.refresh_failures += 1
+                print(f"Cache '{self.name}' background refresh failed: {e}")
+            finally:
+                self._refreshing.pop(key, None)
+
+        self._refreshing[key] = asyncio.ensure_future(refresh())
+
+    async def get_or_fetch(self, key, fetch: Callable[[], Awaitable[Any]]):
+        """
+        Trả về giá trị cho key, gọi `await fetch()` khi cần.
+
+        Args:
+            key: khoá hashable
+            fetch: hàm không tham số trả về awaitable; raise nếu kết quả không nên cache
+        Returns:
+            chính object đang nằm trong cache (không copy, để lượt hit không tốn chi phí copy):
+            chỉ đọc. Caller cần sửa hoặc trả ra ngoài thì tự copy phần mình dùng.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            stored_at, value = entry
+            age = time.monotonic() - stored_at
+            if age < self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            if age < self.ttl_seconds + self.stale_seconds:
+                self._entries.move_to_end(key)
+                self.stale_hits += 1
+                self._refresh_in_background(key, fetch)
+                return value
+            del self._entries[key]
+
+        self.misses += 1
+        return await self._fetch(key, fetch)
+
+    def delete(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "stale_seconds": self.stale_seconds,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+            "refreshing": len(self._refreshing),
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0
+        }
@@ -0,0 +1,327 @@
+"""
+Server-side place catalogue: activities/restaurants/hotels của từng thành phố
+
+Laravel upload catalogue của một thành phố một lần (PUT) hoặc gửi phần thay đổi
+(PATCH, kèm base_hash của phiên bản đang có), sau đó /api/recommendations/by-city-name
+chỉ cần gửi tên thành phố và preferences thay vì toàn bộ danh sách place.
+
+- Place được ingest một lần khi upload, đánh index theo category -> key (id,
+  place_id hoặc tên) nên delta update chỉ tốn O(số place thay đổi).
+- content_hash là tổng (mod 2^256) digest của từng place: không phụ thuộc thứ tự,
+  cập nhật tăng dần khi delta; cùng nội dung luôn cùng hash.
+- Mỗi phiên bản giữ một snapshot places_data bất biến để các lượt sinh lịch trình
+  đang chạy không thấy catalogue đổi giữa chừng.
+- Tên thành phố được so khớp không dấu, bỏ "Thành phố"/"City" và khoảng trắng
+  ("Hà Nội" = "Ha Noi" = "HANOI").
+- CATALOG_DIR (nếu có): mỗi thành phố một file JSON, ghi atomic sau mỗi thay đổi.
+  File là nguồn chính khi chạy nhiều process (uvicorn workers): mỗi lượt tra cứu
+  so mtime/size/inode của file và nạp lại nếu process khác vừa ghi; thao tác ghi
+  giữ file lock (fcntl) để đọc - kiểm tra base_hash - ghi không xen kẽ giữa các process.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: không khoá file giữa các process
+    fcntl = None
+
+from airport_index import normalize_place_name
+from config import settings
+from ingest import PLACE_CATEGORIES, ingest_places
+
+STORE_VERSION = 1
+_HASH_MODULUS = 2 ** 256
+
+
+class CatalogConflict(Exception):
+    """Delta gửi cho phiên bản khác phiên bản hiện tại (client cần upload lại toàn bộ)"""
+
+    def __init__(self, message: str, current_hash: Optional[str]):
+        super().__init__(message)
+        self.current_hash = current_hash
+
+
+def city_key(city_name: str) -> str:
+    return normalize_place_name(city_name).replace(' ', '')
+
+
+def place_key(place: dict) -> Optional[str]:
+    """Khoá của place trong catalogue: id, rồi place_id, rồi tên"""
+    return place.get('id') or place.get('place_id') or place.get('name') or None
+
+
+def _file_stamp(path: str) -> Optional[tuple]:
+    """Dấu hiệu thay đổi của file (os.replace tạo inode mới); None nếu chưa có file"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def _place_digest(category: str, place: dict) -> int:
+    payload = json.dumps(place, sort_keys=True, ensure_ascii=False, default=str)
+    return int.from_bytes(hashlib.sha256(f"{category}\x00{payload}".encode('utf-8')).digest(), 'big')
+
+
+class CityCatalog:
+    """Catalogue của một thành phố: category -> {key: place}, kèm digest từng place"""
+
+    def __init__(self, city: str):
+        self.city = city
+        self.places: Dict[str, Dict[str, dict]] = {category: {} for category in PLACE_CATEGORIES}
+        self._digests: Dict[tuple, int] = {}
+        self._hash_sum = 0
+        self.version = 0
+        self.updated_at: Optional[float] = None
+        self._snapshot: Optional[dict] = None
+
+    @property
+    def content_hash(self) -> str:
+        return f"{self._hash_sum:064x}"
+
+    def upsert(self, category: str, places: Iterable[dict]):
+        index = self.places[category]
+        for place in places:
+            key = place_key(place)
+            if key is None:
+                continue
+            self.remove(category, (key,))
+            digest = _place_digest(category, place)
+            index[key] = place
+            self._digests[(category, key)] = digest
+            self._hash_sum = (self._hash_sum + digest) % _HASH_MODULUS
+
+    def remove(self, category: str, keys: Iterable[str]):
+        index = self.places[category]
+        for key in keys:
+            if index.pop(key, None) is not None:
+                digest = self._digests.pop((category, key))
+                self._hash_sum = (self._hash_sum - digest) % _HASH_MODULUS
+
+    def commit(self, updated_at: Optional[float] = None):
+        """Chốt một phiên bản mới sau khi upsert/remove"""
+        self.version += 1
+        self.updated_at = updated_at or time.time()
+        self._snapshot = None
+
+    def places_data(self) -> dict:
+        """
+        Snapshot places_data cho build_final_tour_json (không sửa). catalog_hash cho
+        phép itinerary_cache_key dùng luôn hash thay vì băm lại toàn bộ place.
+        """
+        if self._snapshot is None:
+            snapshot = {category: list(self.places[category].values()) for category in PLACE_CATEGORIES}
+            snapshot['catalog_hash'] = self.content_hash
+            self._snapshot = snapshot
+        return self._snapshot
+
+    def meta(self) -> dict:
+        return {
+            "city": self.city,
+            "version": self.version,
+            "content_hash": self.content_hash,
+            "counts": {category: len(self.places[category]) for category in PLACE_CATEGORIES},
+            "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.updated_at))
+            if self.updated_at else None,
+        }
+
+
+class PlaceCatalogStore:
+    """
+    Các CityCatalog theo city_key, an toàn khi dùng từ nhiều thread (endpoint gọi
+    các thao tác ghi qua asyncio.to_thread vì ingest/ghi file tốn thời gian với catalogue lớn).
+    """
+
+    def __init__(self, directory: Optional[str]):
+        self.directory = directory
+        self._catalogs: Dict[str, CityCatalog] = {}
+        self._stamps: Dict[str, tuple] = {}
+        self._lock = threading.RLock()
+        self.uploads = 0
+        self.unchanged_uploads = 0
+        self.deltas = 0
+        self.conflicts = 0
+        self.lookups = 0
+        self.lookup_misses = 0
+        self.reloads = 0
+
+    def _path(self, key: str) -> Optional[str]:
+        return os.path.join(self.directory, f"{key}.json") if self.directory else None
+
+    @contextmanager
+    def _write_lock(self, key: str):
+        """Khoá thread + khoá file theo thành phố (các process khác cùng CATALOG_DIR)"""
+        with self._lock:
+            path = self._path(key)
+            if not path or fcntl is None:
+                yield
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            with open(f"{path}.lock", 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load_locked(self, key: str) -> Optional[CityCatalog]:
+        """Catalogue trong RAM, nạp (lại) từ file nếu file mới hơn bản đang giữ"""
+        catalog = self._catalogs.get(key)
+        path = self._path(key)
+        if not path:
+            return catalog
+        stamp = _file_stamp(path)
+        if stamp is None or stamp == self._stamps.get(key):
+            return catalog
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            return catalog
+        except (OSError, ValueError) as e:
+            print(f"Place catalogue {key} not loaded: {e}")
+            return catalog
+        if not record or record.get('store_version') != STORE_VERSION:
+            return catalog
+        if catalog is not None:
+            self.reloads += 1
+        catalog = CityCatalog(record['city'])
+        for category in PLACE_CATEGORIES:
+            catalog.upsert(category, record['places'].get(category) or [])
+        catalog.version = record['version']
+        catalog.updated_at = record['updated_at']
+        self._catalogs[key] = catalog
+        self._stamps[key] = stamp
+        return catalog
+
+    def _save_locked(self, key: str, catalog: CityCatalog):
+        path = self._path(key)
+        if not path:
+            return
+        record = {
+            'store_version': STORE_VERSION,
+            'city': catalog.city,
+            'version': catalog.version,
+            'updated_at': catalog.updated_at,
+            'places': {category: list(catalog.places[category].values()) for category in PLACE_CATEGORIES},
+        }
+        tmp_path = f"{path}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(record, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            self._stamps[key] = _file_stamp(path)
+        except OSError as e:
+            print(f"Place catalogue {key} write failed: {e}")
+
+    def get(self, city_name: str) -> Optional[CityCatalog]:
+        key = city_key(city_name)
+        with self._lock:
+            self.lookups += 1
+            catalog = self._load_locked(key) if key else None
+            if catalog is None:
+                self.lookup_misses += 1
+            return catalog
+
+    def snapshot(self, city_name: str) -> Optional[tuple]:
+        """
+        (meta, places_data) của phiên bản hiện tại, lấy trong lock nên không lẫn với
+        một delta đang áp dụng; None nếu thành phố chưa có catalogue.
+        """
+        with self._lock:
+            catalog = self.get(city_name)
+            if catalog is None:
+                return None
+            return catalog.meta(), catalog.places_data()
+
+    def meta(self, city_name: str) -> Optional[dict]:
+        snapshot = self.snapshot(city_name)
+        return snapshot[0] if snapshot else None
+
+    def replace(self, city_name: str, places_data: dict) -> tuple:
+        """
+        Thay toàn bộ catalogue của thành phố. Nội dung giống hệt phiên bản hiện tại
+        thì giữ nguyên version.
+
+        Returns:
+            (meta của catalogue, changed)
+        """
+        key = city_key(city_name)
+        if not key:
+            raise ValueError("city_name is required")
+        catalog = CityCatalog(city_name)
+        for category in PLACE_CATEGORIES:
+            catalog.upsert(category, ingest_places(places_data.get(category)))
+        with self._write_lock(key):
+            self.uploads += 1
+            current = self._load_locked(key)
+            if current is not None and current.content_hash == catalog.content_hash:
+                self.unchanged_uploads += 1
+                return current.meta(), False
+            catalog.version = current.version if current is not None else 0
+            catalog.commit()
+            self._catalogs[key] = catalog
+            self._save_locked(key, catalog)
+            return catalog.meta(), True
+
+    def apply_delta(self, city_name: str, base_hash: str, upsert: dict, remove: dict) -> dict:
+        """
+        Cập nhật một phần: upsert (category -> places) rồi remove (category -> keys).
+        Raise KeyError nếu thành phố chưa có catalogue, CatalogConflict nếu base_hash
+        khác content_hash hiện tại.
+        """
+        key = city_key(city_name)
+        if not key:
+            raise KeyError(city_name)
+        upserts = {category: ingest_places(upsert.get(category)) for category in PLACE_CATEGORIES}
+        with self._write_lock(key):
+            catalog = self._load_locked(key)
+            if catalog is None:
+                raise KeyError(city_name)
+            if catalog.content_hash != base_hash:
+                self.conflicts += 1
+                raise CatalogConflict(f"Catalogue for {city_name} has changed (base_hash does not match)",
+                                      catalog.content_hash)
+            self.deltas += 1
+            for category in PLACE_CATEGORIES:
+                catalog.upsert(category, upserts[category])
+                catalog.remove(category, remove.get(category) or [])
+            if catalog.content_hash != base_hash:
+                catalog.commit()
+                self._save_locked(key, catalog)
+            return catalog.meta()
+
+    def cities(self) -> list:
+        """Mọi catalogue, kể cả thành phố do process khác upload vào CATALOG_DIR"""
+        with self._lock:
+            keys = set(self._catalogs)
+            if self.directory and os.path.isdir(self.directory):
+                keys.update(name[:-len('.json')] for name in os.listdir(self.directory) if name.endswith('.json'))
+            catalogs = (self._load_locked(key) for key in sorted(keys))
+            return [catalog.meta() for catalog in catalogs if catalog is not None]
+
+    def stats(self) -> dict:
+        return {
+            "cities": len(self._catalogs),
+            "places": sum(sum(len(places) for places in catalog.places.values())
+                          for catalog in self._catalogs.values()),
+            "uploads": self.uploads,
+            "unchanged_uploads": self.unchanged_uploads,
+            "deltas": self.deltas,
+            "conflicts": self.conflicts,
+            "lookups": self.lookups,
+            "lookup_misses": self.lookup_misses,
+            "reloads": self.reloads,
+            "persistent": bool(self.directory),
+        }
+
+
+place_catalog = PlaceCatalogStore(settings.CATALOG_DIR or None)
@@ -0,0 +1,245 @@
+"""
+Concurrency primitives for LLM-bound work: admission control with a bounded queue,
+single-flight coalescing of identical concurrent calls
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
+
+
+class AdmissionRejected(Exception):
+    """
+    Request bị từ chối vì quá tải: status_code 429 (hàng đợi đầy) hoặc 503
+    (không kịp được phục vụ trước deadline), retry_after tính bằng giây
+    """
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def _granted(future: asyncio.Future) -> bool:
+    """Future chờ slot đã được trao slot (không bị huỷ, không bị từ chối)"""
+    return future.done() and not future.cancelled() and future.exception() is None
+
+
+class AdmissionController:
+    """
+    Giới hạn số request chạy đồng thời (in-flight) trong một process, với một
+    hàng đợi FIFO có giới hạn phía trước.
+
+    - Hàng đợi đầy: từ chối ngay với 429.
+    - Mỗi request chờ có deadline; nếu thời gian chờ ước lượng (từ thời gian phục
+      vụ trung bình) đã vượt deadline thì từ chối ngay với 503 thay vì chờ vô ích,
+      hết deadline khi đang chờ cũng trả 503.
+    - Khi một slot được trả, slot được chuyển thẳng cho request chờ kế tiếp còn hạn,
+      request đã quá hạn bị bỏ qua.
+    """
+
+    def __init__(self, name: str, max_in_flight: int, max_queue: int, max_wait_seconds: float):
+        self.name = name
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max(0, max_queue)
+        self.max_wait_seconds = max_wait_seconds
+        self.in_flight = 0
+        self._waiters: deque = deque()
+        self.admitted = 0
+        self.queued_total = 0
+        self.rejected_queue_full = 0
+        self.rejected_deadline = 0
+        # Trung bình trượt (EWMA) của thời gian chờ và thời gian phục vụ
+        self._avg_wait = 0.0
+        self._avg_service: Optional[float] = None
+        self.max_wait_observed = 0.0
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for future, _ in self._waiters if not future.done())
+
+    def _estimated_wait(self, position: int) -> float:
+        """Thời gian chờ ước lượng cho request ở vị trí `position` (0 = đầu hàng đợi)"""
+        if self._avg_service is None:
+            return 0.0
+        return self._avg_service * (position // self.max_in_flight + 1)
+
+    def retry_after(self) -> int:
+        """Số giây gợi ý cho header Retry-After: thời gian ước lượng để hàng đợi hiện tại chạy hết"""
+        return max(1, math.ceil(self._estimated_wait(self.queued)))
+
+    def _record_wait(self, seconds: float):
+        self._avg_wait = seconds if self.admitted <= 1 else 0.8 * self._avg_wait + 0.2 * seconds
+        self.max_wait_observed = max(self.max_wait_observed, seconds)
+
+    def _record_service(self, seconds: float):
+        self._avg_service = seconds if self._avg_service is None else 0.8 * self._avg_service + 0.2 * seconds
+
+    async def acquire(self, deadline: Optional[float] = None):
+        """
+        Chờ tới khi có slot (raise AdmissionRejected nếu quá tải).
+
+        Args:
+            deadline: thời điểm time.monotonic() muộn nhất được phép bắt đầu;
+                mặc định bây giờ + max_wait_seconds
+        """
+        now = time.monotonic()
+        deadline = now + self.max_wait_seconds if deadline is None else deadline
+        if self.in_flight < self.max_in_flight and not self.queued:
+            self.in_flight += 1
+            self.admitted += 1
+            self._record_wait(0.0)
+            return
+
+        queued = self.queued
+        if queued >= self.max_queue:
+            self.rejected_queue_full += 1
+            raise AdmissionRejected(f"{self.name}: too many requests queued ({queued})", 429, self.retry_after())
+        if now + self._estimated_wait(queued) > deadline:
+            self.rejected_deadline += 1
+            raise AdmissionRejected(f"{self.name}: estimated wait exceeds the request deadline",
+                                    503, self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((future, deadline))
+        self.queued_total += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=max(deadline - now, 0))
+        except asyncio.TimeoutError:
+            if _granted(future):
+                # Slot được trao đúng lúc hết hạn: vẫn nhận
+                pass
+            elif future.done():
+                # release() đã báo quá hạn cùng lúc
+                raise future.exception()
+            else:
+                future.cancel()
+                self.rejected_deadline += 1
+                raise AdmissionRejected(f"{self.name}: timed out waiting for a free slot",
+                                        503, self.retry_after())
+        except asyncio.CancelledError:
+            # Client huỷ khi đang chờ: nếu đã được trao slot thì trả lại
+            if _granted(future):
+                self.release(service_seconds=None)
+            else:
+                future.cancel()
+            raise
+        self.admitted += 1
+        self._record_wait(time.monotonic() - now)
+
+    def release(self, service_seconds: Optional[float] = None):
+        """Trả slot: chuyển cho request chờ kế tiếp còn hạn, hoặc giảm in_flight"""
+        if service_seconds is not None:
+            self._record_service(service_seconds)
+        now = time.monotonic()
+        while self._waiters:
+            future, deadline = self._waiters.popleft()
+            if future.done():
+                continue
+            if deadline < now:
+                # Quá hạn trong hàng đợi (wait_for chưa kịp timeout, ví dụ loop bị chặn):
+                # báo 503 cho request đó thay vì huỷ future (sẽ thành CancelledError)
+                self.rejected_deadline += 1
+                future.set_exception(AdmissionRejected(
+                    f"{self.name}: timed out waiting for a free slot", 503, self.retry_after()
+                ))
+                continue
+            future.set_result(True)
+            return
+        self.in_flight = max(0, self.in_flight - 1)
+
+    @asynccontextmanager
+    async def slot(self, deadline: Optional[float] = None):
+        """async with controller.slot(): ... - giữ một slot trong suốt khối lệnh"""
+        await self.acquire(deadline)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "max_wait_seconds": self.max_wait_seconds,
+            "admitted": self.admitted,
+            "queued_total": self.queued_total,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_deadline": self.rejected_deadline,
+            "avg_wait_ms": round(self._avg_wait * 1000, 1),
+            "max_wait_ms": round(self.max_wait_observed * 1000, 1),
+            "avg_service_ms": round(self._avg_service * 1000, 1) if self._avg_service is not None else None,
+        }
+
+
+class SingleFlight:
+    """
+    Gộp các lời gọi đồng thời có cùng key thành một lời gọi upstream duy nhất.
+
+    Lời gọi đầu tiên (leader) chạy trong một task riêng được shield: client của
+    leader ngắt kết nối không huỷ lời gọi mà các follower đang chờ. Các follower
+    nhận chung kết quả (caller tự copy nếu sẽ sửa). Nếu lời gọi chung lỗi hoặc bị
+    huỷ, mỗi follower thử lại một lần (các follower thử lại lại được gộp với nhau),
+    nên một leader lỗi không làm hỏng cả nhóm.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: dict = {}
+        self.leaders = 0
+        self.followers = 0
+        self.follower_retries = 0
+
+    def _start(self, key, func) -> asyncio.Task:
+        task = asyncio.ensure_future(func())
+        self._calls[key] = task
+
+        def _forget(done_task, key=key):
+            if self._calls.get(key) is done_task:
+                del self._calls[key]
+            # Tránh cảnh báo "exception was never retrieved" khi không còn ai chờ
+            if not done_task.cancelled():
+                done_task.exception()
+
+        task.add_done_callback(_forget)
+        self.leaders += 1
+        return task
+
+    async def do(self, key, func: Callable, retry: bool = True):
+        """
+        Chạy `await func()` hoặc chờ lời gọi cùng key đang chạy.
+
+        Args:
+            key: khoá hashable (ví dụ canonical hash của request)
+            func: hàm không tham số trả về awaitable
+        """
+        task = self._calls.get(key)
+        if task is None:
+            return await asyncio.shield(self._start(key, func))
+
+        self.followers += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                # Chính follower bị huỷ
+                raise
+        except Exception:
+            pass
+        if not retry:
+            return await asyncio.shield(task)
+        self.follower_retries += 1
+        return await self.do(key, func, retry=False)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "follower_retries": self.follower_retries,
+        }
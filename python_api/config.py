@@ -30,6 +30,21 @@ class Settings:
     # Gemini AI Settings (REQUIRED)
     GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
     GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")  # Use gemini-1.5-flash for stability
+    # Cách encode places trong prompt: "compact" (bảng + id ngắn) hoặc "json" (JSON đầy đủ như cũ)
+    PROMPT_ENCODING = os.getenv("PROMPT_ENCODING", "compact").lower()
+    
+    # Pre-ranking: chỉ giữ top-K place mỗi loại trước khi tạo prompt
+    PRERANK_ENABLED = os.getenv("PRERANK_ENABLED", "True").lower() == "true"
+    PRERANK_ACTIVITIES_PER_DAY = int(os.getenv("PRERANK_ACTIVITIES_PER_DAY", "8"))
+    PRERANK_RESTAURANTS_PER_DAY = int(os.getenv("PRERANK_RESTAURANTS_PER_DAY", "5"))
+    PRERANK_MAX_HOTELS = int(os.getenv("PRERANK_MAX_HOTELS", "8"))
+    
+    # Amadeus Flight API Settings
+    AMADEUS_CLIENT_ID = os.getenv("AMADEUS_CLIENT_ID", "")
+    AMADEUS_CLIENT_SECRET = os.getenv("AMADEUS_CLIENT_SECRET", "")
+    AMADEUS_HOSTNAME = os.getenv("AMADEUS_HOSTNAME", "test")  # test | production
+    AMADEUS_TIMEOUT = float(os.getenv("AMADEUS_TIMEOUT", "30"))
+    AMADEUS_MAX_CONNECTIONS = int(os.getenv("AMADEUS_MAX_CONNECTIONS", "20"))
     
     # API Security
     API_KEY = os.getenv("API_KEY", "")
@@ -38,6 +53,90 @@ class Settings:
     # Performance Settings
     REQUEST_TIMEOUT = int(os.getenv("REQUEST_TIMEOUT", "300"))
     MAX_WORKERS = int(os.getenv("MAX_WORKERS", "4"))
+    # Số lời gọi Gemini chạy đồng thời tối đa trên mỗi worker
+    GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+    # Warm-up khi khởi động: nạp bảng sân bay/CSV, tạo Gemini model, mở kết nối Amadeus
+    WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "True").lower() == "true"
+    # Admission control cho request sinh lịch trình (mỗi process): số request chạy
+    # đồng thời, số request được xếp hàng chờ và thời gian chờ tối đa (giây)
+    ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "16"))
+    ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+    ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "30"))
+    # Gộp các request lịch trình/chuyến bay giống hệt nhau đang chạy đồng thời thành một lời gọi upstream
+    SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "True").lower() == "true"
+    # Timeout (giây) cho mỗi lời gọi Gemini; quá hạn thì dùng local planner
+    GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "60"))
+    # Thời gian tối đa (giây) của cả một stream /api/recommendations/stream
+    STREAM_TIMEOUT = float(os.getenv("STREAM_TIMEOUT", "180"))
+    # Planner mặc định: "gemini" hoặc "local" (thuật toán cục bộ, không gọi LLM)
+    DEFAULT_PLANNER = os.getenv("DEFAULT_PLANNER", "gemini")
+    
+    # Fan-out: chuyến dài được chia thành nhiều nhóm ngày sinh song song
+    FANOUT_ENABLED = os.getenv("FANOUT_ENABLED", "True").lower() == "true"
+    FANOUT_MIN_DAYS = int(os.getenv("FANOUT_MIN_DAYS", "4"))
+    FANOUT_DAYS_PER_CHUNK = int(os.getenv("FANOUT_DAYS_PER_CHUNK", "2"))
+    
+    # Flight offer cache: TTL ngắn (giây), cửa sổ trả bản cũ + làm mới background, số entry tối đa
+    FLIGHT_CACHE_ENABLED = os.getenv("FLIGHT_CACHE_ENABLED", "True").lower() == "true"
+    FLIGHT_CACHE_TTL = float(os.getenv("FLIGHT_CACHE_TTL", "300"))
+    FLIGHT_CACHE_STALE_SECONDS = float(os.getenv("FLIGHT_CACHE_STALE_SECONDS", "900"))
+    FLIGHT_CACHE_MAX_ENTRIES = int(os.getenv("FLIGHT_CACHE_MAX_ENTRIES", "1024"))
+    # Mã sân bay/thành phố đã resolve qua Amadeus locations: TTL (giây), số entry tối đa (LRU)
+    RESOLVED_CODE_CACHE_TTL = int(os.getenv("RESOLVED_CODE_CACHE_TTL", "86400"))
+    RESOLVED_CODE_CACHE_MAX_ENTRIES = int(os.getenv("RESOLVED_CODE_CACHE_MAX_ENTRIES", "2048"))
+    
+    # Airline reference store: tên hãng bay đã tra (JSON trên đĩa, trống = chỉ RAM), TTL (giây)
+    # cho tên tra được và cho mã không tồn tại; file CSV seed (code,name), trống = airlines_seed.csv
+    AIRLINE_STORE_PATH = os.getenv("AIRLINE_STORE_PATH", "cache/airlines.json")
+    AIRLINE_STORE_TTL = float(os.getenv("AIRLINE_STORE_TTL", str(30 * 24 * 3600)))
+    AIRLINE_STORE_NEGATIVE_TTL = float(os.getenv("AIRLINE_STORE_NEGATIVE_TTL", str(24 * 3600)))
+    AIRLINE_SEED_PATH = os.getenv("AIRLINE_SEED_PATH", "")
+    
+    # File pickle của airport index đã biên dịch (tự build lại khi CSV đổi), trống = build mỗi lần khởi động
+    AIRPORT_INDEX_PATH = os.getenv("AIRPORT_INDEX_PATH", "cache/airport_index.pkl")
+    
+    # Số lời gọi tìm chuyến bay Amadeus đồng thời tối đa (dùng chung cho mọi request, vd. tìm ±N ngày)
+    FLIGHT_SEARCH_MAX_CONCURRENCY = int(os.getenv("FLIGHT_SEARCH_MAX_CONCURRENCY", "4"))
+    # Số ngày tối đa cho tìm kiếm linh hoạt (flex_days)
+    FLIGHT_FLEX_MAX_DAYS = int(os.getenv("FLIGHT_FLEX_MAX_DAYS", "7"))
+    
+    # Số cặp đi/về tối đa trả về cho tìm kiếm khứ hồi
+    ROUND_TRIP_MAX_PAIRS = int(os.getenv("ROUND_TRIP_MAX_PAIRS", "20"))
+    
+    # Response compression: nén gzip/br response từ COMPRESSION_MIN_SIZE byte trở lên
+    COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "True").lower() == "true"
+    COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+    
+    # Batch recommendations: số item tối đa mỗi batch và số item sinh đồng thời
+    BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "50"))
+    BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+    
+    # Async job API (/api/jobs): sqlite store (trống = chỉ RAM), số worker, hàng đợi, TTL job đã xong
+    JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "cache/jobs.sqlite3")
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+    JOB_MAX_QUEUE = int(os.getenv("JOB_MAX_QUEUE", "100"))
+    JOB_TTL = int(os.getenv("JOB_TTL", "86400"))
+    JOB_CLEANUP_INTERVAL = int(os.getenv("JOB_CLEANUP_INTERVAL", "300"))
+    JOB_WEBHOOK_SECRET = os.getenv("JOB_WEBHOOK_SECRET", "")  # Có thì ký webhook bằng HMAC-SHA256 (header X-Signature)
+    # Host được nhận webhook, phân cách bằng dấu phẩy ("*.example.com" cho subdomain);
+    # trống = mọi host có địa chỉ public (chặn loopback/private/link-local)
+    JOB_CALLBACK_ALLOWED_HOSTS = os.getenv("JOB_CALLBACK_ALLOWED_HOSTS", "")
+    # Nhận lại job mồ côi (process chạy nó không còn heartbeat); an toàn với nhiều worker dùng chung store
+    JOB_RESUME_ON_STARTUP = os.getenv("JOB_RESUME_ON_STARTUP", "True").lower() == "true"
+    JOB_HEARTBEAT_INTERVAL = int(os.getenv("JOB_HEARTBEAT_INTERVAL", "15"))
+    
+    # Place catalogue (/api/catalog): thư mục lưu catalogue từng thành phố, trống = chỉ RAM
+    CATALOG_DIR = os.getenv("CATALOG_DIR", "cache/catalog")
+    
+    # Itinerary Cache Settings (cache kết quả build_final_tour_json theo hash input)
+    ITINERARY_CACHE_ENABLED = os.getenv("ITINERARY_CACHE_ENABLED", "True").lower() == "true"
+    ITINERARY_CACHE_TTL = int(os.getenv("ITINERARY_CACHE_TTL", "3600"))
+    ITINERARY_CACHE_MAX_ENTRIES = int(os.getenv("ITINERARY_CACHE_MAX_ENTRIES", "512"))
+    ITINERARY_CACHE_DIR = os.getenv("ITINERARY_CACHE_DIR", "")  # Ví dụ: cache/itineraries; trống = chỉ RAM
+    # Giới hạn tầng đĩa (số file, MB; 0 = không giới hạn) và chu kỳ dọn file hết hạn (giây)
+    ITINERARY_CACHE_DISK_MAX_ENTRIES = int(os.getenv("ITINERARY_CACHE_DISK_MAX_ENTRIES", "5000"))
+    ITINERARY_CACHE_DISK_MAX_MB = int(os.getenv("ITINERARY_CACHE_DISK_MAX_MB", "256"))
+    ITINERARY_CACHE_SWEEP_INTERVAL = int(os.getenv("ITINERARY_CACHE_SWEEP_INTERVAL", "600"))
     
     @classmethod
     def get_database_url(cls):
@@ -2,45 +2,90 @@ import sys
 # Xử lý tạm cho bug Streamlit watcher với torch
 if "torch._classes" in sys.modules:
     sys.modules.pop("torch._classes")
+import asyncio
+import base64
+import copy
+import hashlib
+import math
 from datetime import datetime, date, time, timedelta
 from zoneinfo import ZoneInfo
-from amadeus import Client, ResponseError
-import airportsdata
 from functools import lru_cache
-import csv
-import os
+from typing import Iterator, NamedTuple
+
+from config import settings
+from airlines import airline_store
+from airport_index import get_airport_index
+from amadeus_client import AmadeusAPIError, get_client as get_amadeus_async
+from cache import StaleWhileRevalidateCache, TTLCache
+from concurrency import SingleFlight
 
 LOCAL_TZ = ZoneInfo('Asia/Bangkok')  # Múi giờ địa phương
 
-# Khởi tạo Amadeus API client
-AMADEUS = Client(
-    client_id='aDGISIQtyCV5sb9N4EurAh1TKQKwEhtS',
-    client_secret='KztfC0Hut3A7BgdZ'
-)
+@lru_cache(maxsize=1)
+def get_amadeus():
+    """Amadeus SDK client (sync), chỉ import và khởi tạo khi lần đầu cần dùng"""
+    from amadeus import Client
+    return Client(
+        client_id=settings.AMADEUS_CLIENT_ID,
+        client_secret=settings.AMADEUS_CLIENT_SECRET,
+        hostname=settings.AMADEUS_HOSTNAME
+    )
 
-# Tải dữ liệu sân bay
-AIRPORTS = airportsdata.load('IATA')
 
-@lru_cache(maxsize=128)
+@lru_cache(maxsize=1)
+def get_airports() -> dict:
+    """Bảng sân bay airportsdata theo IATA, tải lần đầu cần dùng (hoặc khi warm-up)"""
+    import airportsdata
+    return airportsdata.load('IATA')
+
+# Số mã hãng tối đa trong một request airlineCodes=
+AIRLINE_BATCH_SIZE = 20
+
+def _normalize_carrier_codes(codes) -> list:
+    return sorted({c.strip().upper() for c in codes if c and c.strip()})
+
+def _airline_batches(codes: list) -> list:
+    return [codes[i:i + AIRLINE_BATCH_SIZE] for i in range(0, len(codes), AIRLINE_BATCH_SIZE)]
+
+def _record_airlines(batch: list, data: list) -> dict:
+    """Ghi kết quả một batch vào airline_store (mã không có trong data = không tồn tại)"""
+    names = {}
+    for item in data or []:
+        code = (item.get('iataCode') or '').upper()
+        if code in batch:
+            names[code] = item.get('businessName') or item.get('commonName') or code
+    airline_store.update(names, not_found=[code for code in batch if code not in names])
+    return names
+
+def resolve_airline_names(codes) -> dict:
+    """
+    Tra tên nhiều hãng bay, trả về dict carrierCode -> tên (không tra được thì là chính mã).
+    Mã chưa có trong airline_store được hỏi Amadeus theo batch `airlineCodes=A,B,C`.
+    """
+    from amadeus import ResponseError
+    codes = _normalize_carrier_codes(codes)
+    names, missing = airline_store.lookup(codes)
+    for batch in _airline_batches(missing):
+        try:
+            response = get_amadeus().reference_data.airlines.get(airlineCodes=','.join(batch))
+            names.update(_record_airlines(batch, response.data if isinstance(response.data, list) else []))
+        except ResponseError:
+            # Lỗi tạm thời: không ghi negative cache, lần sau hỏi lại
+            pass
+    return {code: names.get(code, code) for code in codes}
+
 def get_airline_name(code: str) -> str:
     """
-    Lấy tên đầy đủ của hãng bay từ Amadeus API, có cache.
+    Lấy tên đầy đủ của hãng bay (qua airline_store, hỏi Amadeus nếu chưa biết).
     """
-    code = code.upper()
-    try:
-        response = AMADEUS.reference_data.airlines.get(airlineCodes=code)
-        if response.data and isinstance(response.data, list):
-            return response.data[0].get('businessName') or response.data[0].get('commonName') or code
-    except ResponseError:
-        pass
-    return code
+    return resolve_airline_names([code]).get(code.upper(), code.upper())
 
 @lru_cache(maxsize=256)
 def get_airport_name(iata_code: str) -> str:
     """
     Lấy tên sân bay từ airportsdata theo IATA code.
     """
-    airport = AIRPORTS.get(iata_code.upper())
+    airport = get_airports().get(iata_code.upper())
     return airport['name'] if airport else iata_code
 
 
@@ -116,9 +161,10 @@ def fetch_flights(dep_iata: str, arr_iata: str, departure_date: str, adults: int
     """
     Fetch flight offers và truy vấn thêm trạng thái cho từng segment.
     """
+    from amadeus import ResponseError
     try:
         # 1) Lấy flight offers
-        response = AMADEUS.shopping.flight_offers_search.get(
+        response = get_amadeus().shopping.flight_offers_search.get(
             originLocationCode=dep_iata,
             destinationLocationCode=arr_iata,
             departureDate=departure_date,
@@ -136,11 +182,48 @@ def fetch_flights(dep_iata: str, arr_iata: str, departure_date: str, adults: int
         print(f"Amadeus API error: {error}")
         return []
 
-def filter_flights(flight_offers: list, target_date: date, target_time: time = None, timezone_str: str = 'Asia/Bangkok') -> list:
-    tz = ZoneInfo(timezone_str)
-    now = datetime.now(tz)
-    filtered = []
+@lru_cache(maxsize=1024)
+def airport_timezone(iata_code: str, default: str = 'Asia/Bangkok') -> ZoneInfo:
+    """Múi giờ của sân bay theo airportsdata (field tz), không có thì dùng `default`"""
+    airport = get_airports().get((iata_code or '').upper())
+    try:
+        return ZoneInfo(airport['tz']) if airport and airport.get('tz') else ZoneInfo(default)
+    except (KeyError, ValueError):
+        return ZoneInfo(default)
+
+
+def _local_time(at: str, tz: ZoneInfo) -> datetime | None:
+    """Giờ Amadeus (giờ địa phương của sân bay, thường không kèm offset) -> datetime có múi giờ"""
+    try:
+        moment = datetime.fromisoformat(at)
+    except (TypeError, ValueError):
+        return None
+    return moment.replace(tzinfo=tz) if moment.tzinfo is None else moment.astimezone(tz)
+
+
+def _timezone_name(moment: datetime | None) -> str | None:
+    """Tên IANA của múi giờ (ZoneInfo), offset cố định thì dùng str(tzinfo)"""
+    if moment is None or moment.tzinfo is None:
+        return None
+    return getattr(moment.tzinfo, 'key', None) or str(moment.tzinfo)
+
+
+class ParsedOffer(NamedTuple):
+    offer: dict
+    segments: list
+    departure: datetime  # giờ khởi hành theo múi giờ sân bay đi
+    arrival: datetime | None  # giờ đến theo múi giờ sân bay đến
 
+
+def iter_offers(flight_offers: list, target_date: date, target_time: time = None,
+                timezone_str: str = 'Asia/Bangkok', upcoming_only: bool = True) -> Iterator[ParsedOffer]:
+    """
+    Generator: lọc offers khởi hành đúng target_date (giờ địa phương của sân bay đi), mỗi
+    timestamp chỉ parse một lần. Không truyền target_time thì chỉ lấy chuyến sau thời điểm hiện tại
+    (upcoming_only=False: giữ cả chuyến đã khởi hành, dùng khi kết quả được cache rồi lọc lúc trả về),
+    có target_time thì lấy chuyến khởi hành trước target_time + 3 giờ.
+    """
+    now = datetime.now(ZoneInfo(timezone_str))
     for offer in flight_offers:
         itineraries = offer.get('itineraries', [])
         if not itineraries:
@@ -149,83 +232,211 @@ def filter_flights(flight_offers: list, target_date: date, target_time: time = N
         if not segments:
             continue
 
-        dep_str = segments[0]['departure'].get('at')
-        if not dep_str:
-            continue
-
-        # Parse rồi convert về timezone
-        dep_time = datetime.fromisoformat(dep_str).astimezone(tz)
-
-        # Lọc ngày
-        if dep_time.date() != target_date:
+        departure_info = segments[0]['departure']
+        dep_tz = airport_timezone(departure_info.get('iataCode'), timezone_str)
+        dep_time = _local_time(departure_info.get('at'), dep_tz)
+        if dep_time is None or dep_time.date() != target_date:
             continue
 
-        # Lọc giờ nếu cần
         if target_time:
-            target_dt = datetime.combine(target_date, target_time).replace(tzinfo=tz)
-            window_end   = target_dt + timedelta(hours=3)
+            window_end = datetime.combine(target_date, target_time).replace(tzinfo=dep_tz) + timedelta(hours=3)
             if not (dep_time <= window_end):
                 continue
-        else:
+        elif upcoming_only and dep_time <= now:
             # nếu không truyền target_time thì chỉ lấy chuyến sau now
-            if dep_time <= now:
-                continue
+            continue
 
-        # Gán thêm để frontend dùng
-        offer['local_departure'] = dep_time
+        arrival_info = segments[-1]['arrival']
+        arr_time = _local_time(arrival_info.get('at'), airport_timezone(arrival_info.get('iataCode'), timezone_str))
+        yield ParsedOffer(offer, segments, dep_time, arr_time)
 
-        filtered.append(offer)
 
+def filter_flights(flight_offers: list, target_date: date, target_time: time = None, timezone_str: str = 'Asia/Bangkok') -> list:
+    filtered = []
+    for parsed in iter_offers(flight_offers, target_date, target_time, timezone_str):
+        # Gán thêm để frontend dùng (chuỗi ISO có offset, encode JSON trực tiếp được)
+        parsed.offer['local_departure'] = parsed.departure.isoformat()
+        filtered.append(parsed.offer)
     return filtered
 
-def simplify_flights(flight_offers: list) -> list:
+
+def simplify_offer(parsed: ParsedOffer, airline_names: dict) -> dict:
     """
-    Đơn giản hoá thông tin chuyến bay, bao gồm các trạm dừng (stopover) với thời gian đến và thời gian tiếp.
+    Đơn giản hoá một offer, bao gồm các trạm dừng (stopover) với thời gian đến và thời gian tiếp.
     """
-    simplified = []
+    offer, segments = parsed.offer, parsed.segments
+    dep_seg = segments[0]
+    arr_seg = segments[-1]
+    dep_iata = dep_seg['departure'].get('iataCode')
+    arr_iata = arr_seg['arrival'].get('iataCode')
+    flight_code = dep_seg['carrierCode'] + dep_seg['number']
+
+    # Build stops list: capture arrival of each intermediate layover and next departure
+    stops = []
+    for idx, seg in enumerate(segments[:-1]):  # exclude final destination
+        stop_iata = seg['arrival'].get('iataCode')
+        arrival_time = seg['arrival'].get('at')
+        next_seg = segments[idx + 1]
+        departure_time = next_seg['departure'].get('at')
+        stops.append({
+            'iata': stop_iata,
+            'name': get_airport_name(stop_iata),
+            'arrival': arrival_time,
+            'departure': departure_time
+        })
 
+    carrier = dep_seg['carrierCode']
+    duration = None
+    if parsed.arrival is not None:
+        duration = int((parsed.arrival - parsed.departure).total_seconds() // 60)
+
+    return {
+        'airline': airline_names.get(carrier, carrier),
+        'flight_code': flight_code,
+        'dep_iata': dep_iata,
+        'arr_iata': arr_iata,
+        'dep_airport': get_airport_name(dep_iata),
+        'arr_airport': get_airport_name(arr_iata),
+        'dep_time': dep_seg['departure'].get('at'),
+        'arr_time': arr_seg['arrival'].get('at'),
+        'dep_timezone': _timezone_name(parsed.departure),
+        'arr_timezone': _timezone_name(parsed.arrival),
+        'duration_minutes': duration,
+        'price': offer.get('price', {}).get('total'),
+        'currency': offer.get('price', {}).get('currency'),
+        'stops': stops
+    }
+
+
+def flight_sort_key(flight: dict, parsed: ParsedOffer) -> tuple:
+    """(giá, giờ khởi hành UTC, thời gian bay, số điểm dừng) - tính một lần, dùng cho rank_flights"""
+    price = _parse_price(flight.get('price'))
+    duration = flight.get('duration_minutes')
+    return (
+        price if price is not None else math.inf,
+        parsed.departure.timestamp(),
+        duration if duration is not None else math.inf,
+        len(flight['stops']),
+    )
+
+
+def _parsed_carrier_codes(parsed_offers: list) -> set:
+    return {p.segments[0]['carrierCode'] for p in parsed_offers if p.segments[0].get('carrierCode')}
+
+
+def simplify_flights(flight_offers: list, airline_names: dict = None) -> list:
+    """
+    Đơn giản hoá thông tin chuyến bay (offers đã qua filter_flights).
+    Nếu truyền `airline_names` (carrierCode -> tên) thì dùng luôn, nếu không thì tra tên
+    tất cả hãng trong một lượt trước vòng lặp.
+    """
+    parsed_offers = []
     for offer in flight_offers:
         itin = offer.get('itineraries', [])
-        if not itin:
-            continue
-        segments = itin[0].get('segments', [])
+        segments = itin[0].get('segments', []) if itin else []
         if not segments:
             continue
+        dep_info = segments[0]['departure']
+        dep_tz = airport_timezone(dep_info.get('iataCode'))
+        departure = offer.get('local_departure')
+        if isinstance(departure, str):
+            # Chuỗi ISO chỉ giữ offset cố định: đổi lại về ZoneInfo của sân bay đi
+            departure = _local_time(departure, dep_tz)
+        elif isinstance(departure, datetime):
+            departure = departure.astimezone(dep_tz) if departure.tzinfo else departure.replace(tzinfo=dep_tz)
+        if departure is None:
+            departure = _local_time(dep_info.get('at'), dep_tz)
+            if departure is None:
+                continue
+        arr_info = segments[-1]['arrival']
+        arrival = _local_time(arr_info.get('at'), airport_timezone(arr_info.get('iataCode')))
+        parsed_offers.append(ParsedOffer(offer, segments, departure, arrival))
 
-        dep_seg = segments[0]
-        arr_seg = segments[-1]
-        dep_iata = dep_seg['departure'].get('iataCode')
-        arr_iata = arr_seg['arrival'].get('iataCode')
-        flight_code = dep_seg['carrierCode'] + dep_seg['number']
-
-        # Build stops list: capture arrival of each intermediate layover and next departure
-        stops = []
-        for idx, seg in enumerate(segments[:-1]):  # exclude final destination
-            stop_iata = seg['arrival'].get('iataCode')
-            arrival_time = seg['arrival'].get('at')
-            next_seg = segments[idx + 1]
-            departure_time = next_seg['departure'].get('at')
-            stops.append({
-                'iata': stop_iata,
-                'name': get_airport_name(stop_iata),
-                'arrival': arrival_time,
-                'departure': departure_time
-            })
+    if airline_names is None:
+        airline_names = resolve_airline_names(_parsed_carrier_codes(parsed_offers))
+    return [simplify_offer(parsed, airline_names) for parsed in parsed_offers]
+
+
+SORT_KEYS = {'price': 0, 'departure': 1, 'duration': 2, 'stops': 3}
+
+
+def _encode_cursor(offset: int, signature: str) -> str:
+    return base64.urlsafe_b64encode(f"{offset}:{signature}".encode()).decode().rstrip('=')
+
+
+class InvalidCursor(ValueError):
+    """Cursor phân trang không hợp lệ hoặc thuộc lượt tìm/cách sắp xếp khác"""
+
+
+def cursor_search(dep: str, arr: str, departure_date: str, return_date: str | None, adults: int) -> str:
+    """Định danh lượt tìm (tuyến, ngày đi/về, số khách) mà cursor phân trang gắn vào"""
+    parts = (dep, arr, departure_date, return_date or '', adults)
+    return '|'.join(str(part).strip().casefold() for part in parts)
+
+
+def _cursor_signature(search: str | None, sort_by: str | None, top_per_airline: int | None,
+                      limit: int | None) -> str:
+    raw = f"{search or ''}|{sort_by or ''}|{top_per_airline or ''}|{limit or ''}"
+    return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+
+def _decode_cursor(cursor: str, signature: str) -> int:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        offset, cursor_signature = raw.split(':', 1)
+        offset = int(offset)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursor("Invalid cursor")
+    if cursor_signature != signature or offset < 0:
+        raise InvalidCursor("Cursor does not match this search")
+    return offset
+
+
+def rank_flights(flights: list, sort_keys: list, sort_by: str = None, top_per_airline: int = None,
+                 limit: int = None, cursor: str = None, search: str = None) -> tuple:
+    """
+    Sắp xếp, giữ top-N mỗi hãng và phân trang bằng cursor.
+
+    Args:
+        flights, sort_keys: list chuyến bay và khoá sắp xếp song song (flight_sort_key)
+        sort_by: price | departure | duration | stops (None = giữ thứ tự Amadeus);
+            hoà nhau thì xét lần lượt giá, giờ khởi hành
+        top_per_airline: chỉ giữ N chuyến đầu tiên (theo sort_by) của mỗi hãng
+        limit: số chuyến mỗi trang (None = tất cả)
+        cursor: next_cursor của trang trước
+        search: định danh lượt tìm (cursor_search); cursor của lượt tìm khác bị từ chối
+    Returns:
+        (các chuyến của trang, thông tin phân trang)
+    Raises:
+        InvalidCursor: cursor không hợp lệ hoặc thuộc lượt tìm khác
+    """
+    order = list(range(len(flights)))
+    if sort_by:
+        primary = SORT_KEYS[sort_by]
+        order.sort(key=lambda i: (sort_keys[i][primary], sort_keys[i][0], sort_keys[i][1]))
+    if top_per_airline:
+        kept, per_airline = [], {}
+        for i in order:
+            airline = flights[i]['airline']
+            if per_airline.get(airline, 0) < top_per_airline:
+                per_airline[airline] = per_airline.get(airline, 0) + 1
+                kept.append(i)
+        order = kept
+
+    signature = _cursor_signature(search, sort_by, top_per_airline, limit)
+    offset = _decode_cursor(cursor, signature) if cursor else 0
+    end = len(order) if limit is None else offset + limit
+    page = [flights[i] for i in order[offset:end]]
+    return page, {
+        'sort_by': sort_by,
+        'top_per_airline': top_per_airline,
+        'limit': limit,
+        'total': len(order),
+        'offset': offset,
+        'returned': len(page),
+        'next_cursor': _encode_cursor(end, signature) if end < len(order) else None,
+    }
 
-        simplified.append({
-            'airline': get_airline_name(dep_seg['carrierCode']),
-            'flight_code': flight_code,
-            'dep_iata': dep_iata,
-            'arr_iata': arr_iata,
-            'dep_airport': get_airport_name(dep_iata),
-            'arr_airport': get_airport_name(arr_iata),
-            'dep_time': dep_seg['departure'].get('at'),
-            'arr_time': arr_seg['arrival'].get('at'),
-            'price': offer.get('price', {}).get('total'),
-            'currency': offer.get('price', {}).get('currency'),
-            'stops': stops
-        })
-    return simplified
 
 def group_by_airline(flights: list) -> dict:
     grouped = {}
@@ -242,55 +453,44 @@ def _strip_accents(s: str) -> str:
     nfkd = unicodedata.normalize('NFKD', s)
     return ''.join(c for c in nfkd if not unicodedata.combining(c))
 
-@lru_cache(maxsize=1)
-def _load_city_to_iata_from_csv() -> dict:
+def _resolve_offline(name_or_code: str) -> str | None:
     """
-    Load mapping City -> IATA code from local CSV `city_airport_codes.csv`.
-    Uses accent-stripped, uppercased city names as keys, keeps first occurrence.
+    Resolve không cần gọi API: mã IATA nhập sẵn hoặc airport index offline
+    (không dấu, khớp chính xác/tiền tố/gần đúng). Trả về None nếu phải hỏi Amadeus.
     """
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    csv_path = os.path.join(base_dir, 'airports_clean.csv')
-    mapping = {}
-    try:
-        with open(csv_path, mode='r', encoding='utf-8', newline='') as f:
-            reader = csv.DictReader(f)
-            city_col = 'City'
-            code_col = 'IATA'
-            for row in reader:
-                city = (row.get(city_col) or '').strip()
-                code = (row.get(code_col) or '').strip().upper()
-                if not city or not code or len(code) != 3:
-                    continue
-                key = _strip_accents(city).upper()
-                if key not in mapping:
-                    mapping[key] = code
-    except FileNotFoundError:
-        # If file not found, return empty mapping and allow API fallback
-        return {}
-    return mapping
+    s = name_or_code.strip().upper()
+    # Nếu người dùng đã nhập sẵn mã IATA 3 ký tự, dùng luôn
+    if len(s) == 3 and s.isalpha():
+        return s
+
+    return get_airport_index().resolve(name_or_code)
+
+def _pick_location_code(locations: list) -> str | None:
+    """Ưu tiên CITY trước, nếu không có thì lấy AIRPORT đầu tiên"""
+    if not locations:
+        return None
+    cities = [x for x in locations if x.get('subType') == 'CITY']
+    airports = [x for x in locations if x.get('subType') == 'AIRPORT']
+    pick = cities[0] if cities else (airports[0] if airports else None)
+    if pick and pick.get('iataCode'):
+        return pick['iataCode']
+    return None
 
 @lru_cache(maxsize=256)
 def resolve_city_or_airport_code(name_or_code: str, country_code: str | None = None) -> str:
     """
     Nhận tên thành phố/sân bay (có/không dấu) hoặc mã IATA; 
     trả về mã IATA hợp lệ (CITY hoặc AIRPORT) để gọi Amadeus search.
-    Ưu tiên map offline từ `city_airport_codes.csv` trước khi gọi API.
+    Ưu tiên airport index offline (`city_airport_codes.csv` + `airports_clean.csv`) trước khi gọi API.
     """
     if not name_or_code:
         return name_or_code
 
-    s = name_or_code.strip().upper()
-    # Nếu người dùng đã nhập sẵn mã IATA 3 ký tự, dùng luôn
-    if len(s) == 3 and s.isalpha():
-        return s
-
-    # Try local CSV mapping first (accent-insensitive)
-    normalized_key = _strip_accents(name_or_code).strip().upper()
-    city_map = _load_city_to_iata_from_csv()
-    mapped = city_map.get(normalized_key)
+    mapped = _resolve_offline(name_or_code)
     if mapped:
         return mapped
 
+    from amadeus import ResponseError
     keyword = _strip_accents(name_or_code).strip()
     try:
         kwargs = {
@@ -300,19 +500,15 @@ def resolve_city_or_airport_code(name_or_code: str, country_code: str | None = N
         }
         if country_code:
             kwargs['countryCode'] = country_code
-        resp = AMADEUS.reference_data.locations.get(**kwargs)
-        # Ưu tiên CITY trước, nếu không có thì lấy AIRPORT đầu tiên
-        if resp.data:
-            cities = [x for x in resp.data if x.get('subType') == 'CITY']
-            airports = [x for x in resp.data if x.get('subType') == 'AIRPORT']
-            pick = cities[0] if cities else (airports[0] if airports else None)
-            if pick and pick.get('iataCode'):
-                return pick['iataCode']
+        resp = get_amadeus().reference_data.locations.get(**kwargs)
+        picked = _pick_location_code(resp.data)
+        if picked:
+            return picked
     except ResponseError:
         pass
 
     # Cuối cùng, trả về chuỗi viết hoa (để lỗi được lộ sớm ở tầng gọi)
-    return s
+    return name_or_code.strip().upper()
 def information_flight(dep, arr, target_date) -> list:
     target_date = datetime.strptime(target_date, "%Y-%m-%d").date()
 
@@ -327,4 +523,346 @@ def information_flight(dep, arr, target_date) -> list:
     simplified = simplify_flights(filtered)
     grouped = group_by_airline(simplified)
 
-    return grouped
\ No newline at end of file
+    return grouped
+
+
+# ---------------------------------------------------------------------------
+# Async pipeline: dùng chung connection pool/token Amadeus, không chặn event loop
+# ---------------------------------------------------------------------------
+
+# Tên thành phố/sân bay -> mã IATA đã resolve qua Amadeus (input tự do của người dùng nên cần giới hạn)
+resolved_code_cache = TTLCache(
+    "resolved_codes",
+    ttl_seconds=settings.RESOLVED_CODE_CACHE_TTL,
+    max_entries=settings.RESOLVED_CODE_CACHE_MAX_ENTRIES
+)
+
+async def get_airline_names_async(codes) -> dict:
+    """
+    Phiên bản async của resolve_airline_names: các batch mã còn thiếu được hỏi song song.
+    """
+    codes = _normalize_carrier_codes(codes)
+    names, missing = airline_store.lookup(codes)
+
+    async def fetch(batch):
+        try:
+            data = await get_amadeus_async().airlines(','.join(batch))
+        except AmadeusAPIError:
+            return {}
+        return await asyncio.to_thread(_record_airlines, batch, data)
+
+    for fetched in await asyncio.gather(*(fetch(batch) for batch in _airline_batches(missing))):
+        names.update(fetched)
+    return {code: names.get(code, code) for code in codes}
+
+async def resolve_city_or_airport_code_async(name_or_code: str, country_code: str | None = None) -> str:
+    """
+    Phiên bản async của resolve_city_or_airport_code.
+    """
+    if not name_or_code:
+        return name_or_code
+
+    mapped = _resolve_offline(name_or_code)
+    if mapped:
+        return mapped
+
+    cache_key = f"{name_or_code}|{country_code or ''}"
+    cached = resolved_code_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    keyword = _strip_accents(name_or_code).strip()
+    try:
+        locations = await get_amadeus_async().locations(keyword, country_code=country_code)
+        picked = _pick_location_code(locations)
+        if picked:
+            resolved_code_cache.set(cache_key, picked)
+            return picked
+    except AmadeusAPIError:
+        pass
+
+    return name_or_code.strip().upper()
+
+async def fetch_flights_async(dep_iata: str, arr_iata: str, departure_date: str, adults: int = 1, max_results: int = 100) -> list:
+    """
+    Phiên bản async của fetch_flights.
+    """
+    try:
+        async with _get_flight_search_slots():
+            return await get_amadeus_async().flight_offers_search(
+                dep_iata, arr_iata, departure_date, adults=adults, max_results=max_results
+            )
+    except AmadeusAPIError as error:
+        return _fallback_flight_offers(error, dep_iata, arr_iata, departure_date, adults)
+
+def _fallback_flight_offers(error: AmadeusAPIError, dep_iata: str, arr_iata: str, departure_date: str, adults: int) -> list:
+    if error.status_code == 500:
+        # Trả về mock data khi API lỗi 500
+        return _generate_mock_flight_data(dep_iata, arr_iata, departure_date, adults)
+    print(f"Amadeus API error: {error}")
+    return []
+
+# Cache flight offers theo (dep_code, arr_code, ngày, adults): TTL ngắn vì giá/chỗ thay đổi,
+# hết TTL vẫn trả bản cũ trong cửa sổ ân hạn và làm mới ở background. Giá trị cache dùng chung
+# giữa các request và không được sửa: upcoming_offers tạo list mới, present_flights và
+# round_trip_search_async chỉ deepcopy phần trả cho client
+flight_offers_cache = StaleWhileRevalidateCache(
+    "flight_offers",
+    ttl_seconds=settings.FLIGHT_CACHE_TTL,
+    stale_seconds=settings.FLIGHT_CACHE_STALE_SECONDS,
+    max_entries=settings.FLIGHT_CACHE_MAX_ENTRIES
+)
+
+# Giới hạn chung số lời gọi flight_offers_search đồng thời trên mỗi worker (quota Amadeus)
+# Semaphore tạo lười trong event loop đang chạy (như services._get_gemini_slots)
+_flight_search_slots: asyncio.Semaphore | None = None
+_flight_search_slots_loop = None
+
+
+def _get_flight_search_slots() -> asyncio.Semaphore:
+    global _flight_search_slots, _flight_search_slots_loop
+    loop = asyncio.get_running_loop()
+    if _flight_search_slots is None or _flight_search_slots_loop is not loop:
+        _flight_search_slots = asyncio.Semaphore(settings.FLIGHT_SEARCH_MAX_CONCURRENCY)
+        _flight_search_slots_loop = loop
+    return _flight_search_slots
+
+
+async def _build_offers(raw: list, target_date: date) -> dict:
+    """
+    Mọi chuyến trong ngày, kể cả chuyến đã khởi hành: giá trị này được cache tới
+    TTL + cửa sổ stale nên việc bỏ chuyến đã bay làm ở upcoming_offers lúc trả về.
+    """
+    parsed_offers = list(iter_offers(raw, target_date, upcoming_only=False))
+    airline_names = await get_airline_names_async(_parsed_carrier_codes(parsed_offers))
+    simplified, sort_keys, departures = [], [], []
+    for parsed in parsed_offers:
+        flight = simplify_offer(parsed, airline_names)
+        simplified.append(flight)
+        sort_keys.append(flight_sort_key(flight, parsed))
+        departures.append(parsed.departure)
+    return {'raw': raw, 'simplified': simplified, 'sort_keys': sort_keys, 'departures': departures}
+
+
+def upcoming_offers(offers: dict, now: datetime | None = None) -> dict:
+    """Bỏ các chuyến đã khởi hành tại thời điểm trả về (offers của cache không bị sửa)"""
+    now = now or datetime.now(LOCAL_TZ)
+    keep = [index for index, departure in enumerate(offers['departures']) if departure > now]
+    if len(keep) == len(offers['departures']):
+        return offers
+    return {
+        'raw': offers['raw'],
+        'simplified': [offers['simplified'][index] for index in keep],
+        'sort_keys': [offers['sort_keys'][index] for index in keep],
+        'departures': [offers['departures'][index] for index in keep],
+    }
+
+
+def present_flights(offers: dict, ranking: dict | None = None) -> tuple:
+    """
+    Chuyến bay của một chặng để trả về client: (dict theo hãng, thông tin phân trang hoặc None).
+    Có `ranking` (tham số của rank_flights) thì sắp xếp/top-N/phân trang trước khi nhóm.
+    """
+    flights, pagination = offers['simplified'], None
+    if ranking:
+        flights, pagination = rank_flights(flights, offers['sort_keys'], **ranking)
+    # group_by_airline giữ nguyên các dict chuyến bay: copy để không sửa vào cache
+    return group_by_airline(copy.deepcopy(flights)), pagination
+
+async def search_flight_offers_async(dep_code: str, arr_code: str, target_date: date, adults: int = 1) -> dict:
+    """
+    Flight offers của một chặng: {'raw': offers Amadeus, 'simplified': chuyến bay đã lọc theo
+    ngày và rút gọn, 'sort_keys': khoá sắp xếp song song, 'departures': giờ khởi hành song song},
+    qua flight_offers_cache. Chuyến đã khởi hành bị bỏ mỗi lần trả về (không phải lúc cache), nên
+    bản cache cũ không trả chuyến đã bay. Giá trị trả về dùng chung với cache - không sửa.
+    Kết quả dự phòng khi Amadeus lỗi (mock data / list rỗng) không được cache.
+    """
+    departure_date = target_date.isoformat()
+
+    async def fetch():
+        # AmadeusAPIError được raise ra ngoài để kết quả lỗi không vào cache
+        async with _get_flight_search_slots():
+            raw = await get_amadeus_async().flight_offers_search(dep_code, arr_code, departure_date, adults=adults)
+        return await _build_offers(raw, target_date)
+
+    if not settings.FLIGHT_CACHE_ENABLED:
+        offers = await _build_offers(await fetch_flights_async(dep_code, arr_code, departure_date, adults),
+                                     target_date)
+        return upcoming_offers(offers)
+    try:
+        offers = await flight_offers_cache.get_or_fetch((dep_code, arr_code, departure_date, adults), fetch)
+    except AmadeusAPIError as error:
+        raw = _fallback_flight_offers(error, dep_code, arr_code, departure_date, adults)
+        offers = await _build_offers(raw, target_date)
+    return upcoming_offers(offers)
+
+# Số chuyến rẻ nhất mỗi chiều được xét khi ghép cặp khứ hồi
+ROUND_TRIP_LEG_CANDIDATES = 15
+
+# Gộp các lượt tìm chuyến bay giống hệt nhau đang chạy đồng thời
+flight_searches = SingleFlight("flight_search")
+
+
+async def information_flight_async(dep, arr, target_date, adults: int = 1, ranking: dict | None = None) -> dict:
+    """
+    Phiên bản async của information_flight: resolve hai thành phố song song,
+    tra tên các hãng bay song song, tổng độ trễ ≈ lời gọi upstream chậm nhất mỗi bước.
+    Các lượt tìm cùng (nơi đi, nơi đến, ngày) đang chạy đồng thời dùng chung một lời gọi Amadeus.
+
+    Returns:
+        {'flights': chuyến bay theo hãng, 'pagination': thông tin phân trang (None nếu không có ranking)}
+    """
+    if not settings.SINGLEFLIGHT_ENABLED:
+        return await _information_flight_async(dep, arr, target_date, adults, ranking)
+    key = (str(dep).strip().casefold(), str(arr).strip().casefold(), str(target_date).strip(), adults,
+           tuple(sorted((ranking or {}).items())))
+    result = await flight_searches.do(key, lambda: _information_flight_async(dep, arr, target_date, adults, ranking))
+    return copy.deepcopy(result)
+
+
+async def _resolve_route_async(dep, arr) -> tuple:
+    return await asyncio.gather(
+        resolve_city_or_airport_code_async(dep),
+        resolve_city_or_airport_code_async(arr),
+    )
+
+
+async def _information_flight_async(dep, arr, target_date, adults: int = 1, ranking: dict | None = None) -> dict:
+    target_date = datetime.strptime(target_date, "%Y-%m-%d").date()
+    dep_code, arr_code = await _resolve_route_async(dep, arr)
+
+    offers = await search_flight_offers_async(dep_code, arr_code, target_date, adults)
+    flights, pagination = present_flights(offers, ranking)
+    return {'flights': flights, 'pagination': pagination}
+
+
+def _parse_price(value) -> float | None:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _calendar_day(day: date, flights: list | None, selected: bool) -> dict:
+    """Một ô lịch giá: giá rẻ nhất trong ngày (None nếu không có chuyến hoặc lỗi)"""
+    entry = {'date': day.isoformat(), 'selected': selected, 'flight_count': 0,
+             'cheapest_price': None, 'currency': None, 'airline': None}
+    if flights is None:
+        entry['error'] = True
+        return entry
+    priced = [(price, f) for f in flights if (price := _parse_price(f.get('price'))) is not None]
+    entry['flight_count'] = len(flights)
+    if priced:
+        price, cheapest = min(priced, key=lambda item: item[0])
+        entry.update(cheapest_price=price, currency=cheapest.get('currency'), airline=cheapest.get('airline'))
+    return entry
+
+
+async def flexible_date_search_async(dep, arr, target_date, flex_days: int, adults: int = 1,
+                                     ranking: dict | None = None) -> dict:
+    """
+    Tìm chuyến bay linh hoạt ±flex_days ngày quanh target_date: các ngày được tìm song song
+    (qua flight_offers_cache và giới hạn lời gọi Amadeus chung), ngày đã qua bị bỏ.
+
+    Returns:
+        {'flights': chuyến bay ngày được chọn theo hãng, 'pagination': phân trang (nếu có ranking),
+         'calendar': giá rẻ nhất từng ngày, 'cheapest_date': ngày rẻ nhất (hoặc None)}
+    """
+    target_date = datetime.strptime(target_date, "%Y-%m-%d").date()
+    dep_code, arr_code = await _resolve_route_async(dep, arr)
+
+    today = datetime.now(LOCAL_TZ).date()
+    days = [target_date + timedelta(days=offset) for offset in range(-flex_days, flex_days + 1)]
+    days = [day for day in days if day >= today or day == target_date]
+    results = await asyncio.gather(
+        *(search_flight_offers_async(dep_code, arr_code, day, adults) for day in days),
+        return_exceptions=True
+    )
+
+    calendar, selected = [], {'simplified': [], 'sort_keys': []}
+    for day, result in zip(days, results):
+        if isinstance(result, Exception):
+            print(f"Flexible search failed for {day}: {result}")
+            result = None
+        flights = result['simplified'] if result is not None else None
+        calendar.append(_calendar_day(day, flights, day == target_date))
+        if day == target_date and result is not None:
+            selected = result
+
+    priced = [entry for entry in calendar if entry['cheapest_price'] is not None]
+    cheapest = min(priced, key=lambda entry: entry['cheapest_price'])['date'] if priced else None
+    flights, pagination = present_flights(selected, ranking)
+    return {
+        'flights': flights,
+        'pagination': pagination,
+        'calendar': calendar,
+        'cheapest_date': cheapest,
+    }
+
+
+
+def _departure_at(flight: dict) -> datetime | None:
+    return _local_time(flight.get('dep_time'), airport_timezone(flight.get('dep_iata')))
+
+
+def _arrival_at(flight: dict) -> datetime | None:
+    return _local_time(flight.get('arr_time'), airport_timezone(flight.get('arr_iata')))
+
+
+def _cheapest(flights: list, limit: int) -> list:
+    priced = [(price, f) for f in flights if (price := _parse_price(f.get('price'))) is not None]
+    priced.sort(key=lambda item: item[0])
+    return priced[:limit]
+
+
+def pair_round_trips(outbound: list, inbound: list, max_pairs: int = None) -> list:
+    """
+    Ghép chuyến đi/về theo tổng giá tăng dần: chỉ xét ROUND_TRIP_LEG_CANDIDATES chuyến rẻ
+    nhất mỗi chiều, cùng tiền tệ, chuyến về khởi hành sau khi chuyến đi đã hạ cánh.
+    """
+    max_pairs = settings.ROUND_TRIP_MAX_PAIRS if max_pairs is None else max_pairs
+    inbound_candidates = [(price, f, _departure_at(f)) for price, f in _cheapest(inbound, ROUND_TRIP_LEG_CANDIDATES)]
+    pairs = []
+    for out_price, out_flight in _cheapest(outbound, ROUND_TRIP_LEG_CANDIDATES):
+        landed_at = _arrival_at(out_flight)
+        for in_price, in_flight, departs_at in inbound_candidates:
+            if in_flight.get('currency') != out_flight.get('currency'):
+                continue
+            if landed_at and departs_at and departs_at <= landed_at:
+                continue
+            pairs.append({
+                'total_price': round(out_price + in_price, 2),
+                'currency': out_flight.get('currency'),
+                'outbound': out_flight,
+                'return': in_flight,
+            })
+    pairs.sort(key=lambda pair: pair['total_price'])
+    return pairs[:max_pairs]
+
+
+async def round_trip_search_async(dep, arr, departure_date, return_date, adults: int = 1) -> dict:
+    """
+    Chuyến khứ hồi: chiều đi và chiều về được tìm song song qua cùng pipeline
+    (flight_offers_cache -> lọc -> rút gọn), nên độ trễ ≈ một lượt tìm một chiều.
+    Chiều đi dùng chung lời gọi Amadeus với lượt tìm một chiều cùng ngày (cache/coalescing).
+
+    Returns:
+        {'return': chiều về theo hãng, 'pairs': các cặp đi/về rẻ nhất theo tổng giá,
+         'cheapest_total': tổng giá cặp rẻ nhất (hoặc None)}. Chiều đi không trả về ở đây:
+        caller đã có nó từ lượt tìm một chiều.
+    """
+    departure_day = datetime.strptime(departure_date, "%Y-%m-%d").date()
+    return_day = datetime.strptime(return_date, "%Y-%m-%d").date()
+    dep_code, arr_code = await _resolve_route_async(dep, arr)
+
+    outbound, inbound = await asyncio.gather(
+        search_flight_offers_async(dep_code, arr_code, departure_day, adults),
+        search_flight_offers_async(arr_code, dep_code, return_day, adults),
+    )
+    # Các dict chuyến bay thuộc cache: chỉ copy chiều về và các cặp (ít) được trả về
+    pairs = copy.deepcopy(pair_round_trips(outbound['simplified'], inbound['simplified']))
+    return {
+        'return': group_by_airline(copy.deepcopy(inbound['simplified'])),
+        'pairs': pairs,
+        'cheapest_total': pairs[0]['total_price'] if pairs else None,
+    }
@@ -0,0 +1,114 @@
+"""
+Single-pass ingestion of place data sent by Laravel
+
+Mỗi place (PlaceData đã được pydantic validate, hoặc dict thô) được chiếu một
+lần vào một dict gọn với đúng các field mà pipeline dùng: id, place_id, name
+(chuỗi), category, rating, reviews, latitude, longitude, avg_price (float).
+Không còn bước model_dump -> normalize_price -> DataFrame -> to_dict.
+"""
+import math
+from typing import Iterable, Optional
+
+from models import PlaceData, PlaceName
+
+PLACE_FIELDS = ('id', 'place_id', 'name', 'category', 'rating', 'reviews', 'latitude', 'longitude', 'avg_price')
+PLACE_CATEGORIES = ('activities', 'restaurants', 'hotels')
+
+
+def parse_price(value) -> float:
+    """avg_price -> float: "$1,200" -> 1200.0, None/"-"/không hợp lệ -> 0.0"""
+    if isinstance(value, bool):
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value) if math.isfinite(value) else 0.0
+    if isinstance(value, str):
+        # Remove $ and any non-numeric characters except . and -
+        price_str = value.replace('$', '').replace(',', '').strip()
+        try:
+            price = float(price_str) if price_str and price_str != '-' else 0.0
+        except ValueError:
+            return 0.0
+        return price if math.isfinite(price) else 0.0
+    return 0.0
+
+
+def name_text(name) -> str:
+    """Tên place dạng chuỗi (name có thể là chuỗi, PlaceName hoặc dict {text, languageCode})"""
+    if isinstance(name, PlaceName):
+        return name.text
+    if isinstance(name, dict):
+        return str(name.get('text') or '')
+    return str(name or '')
+
+
+def _optional_float(value) -> Optional[float]:
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+def _optional_id(value) -> Optional[str]:
+    if value is None or value == '':
+        return None
+    return str(value)
+
+
+def place_from_model(place: PlaceData) -> dict:
+    """Chiếu một PlaceData (đã validate) thành dict gọn, đọc thẳng thuộc tính không qua model_dump"""
+    return {
+        'id': place.id,
+        'place_id': place.place_id,
+        'name': name_text(place.name),
+        'category': place.category or '',
+        'rating': _optional_float(place.rating),
+        'reviews': place.reviews,
+        'latitude': _optional_float(place.latitude),
+        'longitude': _optional_float(place.longitude),
+        'avg_price': parse_price(place.avg_price),
+    }
+
+
+def normalize_place(place: dict) -> dict:
+    """
+    Chuẩn hoá tại chỗ một dict place (idempotent: dict đã chuẩn hoá gần như không tốn gì).
+    Field thừa được giữ nguyên, field thiếu được bổ sung bằng None.
+    """
+    for field in PLACE_FIELDS:
+        place.setdefault(field, None)
+    if not isinstance(place['avg_price'], float) or not math.isfinite(place['avg_price']):
+        place['avg_price'] = parse_price(place['avg_price'])
+    if not isinstance(place['name'], str):
+        place['name'] = name_text(place['name'])
+    for field in ('id', 'place_id'):
+        if place[field] is not None and not isinstance(place[field], str):
+            place[field] = _optional_id(place[field])
+    for field in ('latitude', 'longitude', 'rating'):
+        value = place[field]
+        if value is not None and not (isinstance(value, float) and math.isfinite(value)):
+            place[field] = _optional_float(value)
+    if place['category'] is None:
+        place['category'] = ''
+    return place
+
+
+def ingest_places(items: Optional[Iterable]) -> list:
+    """Một lượt qua list place: PlaceData -> dict gọn, dict -> chuẩn hoá tại chỗ, loại bỏ phần tử khác"""
+    places = []
+    for item in items or []:
+        if isinstance(item, PlaceData):
+            places.append(place_from_model(item))
+        elif isinstance(item, dict):
+            places.append(normalize_place(item))
+    return places
+
+
+def ingest_places_data(places_data: Optional[dict]) -> dict:
+    """Áp dụng ingest_places cho activities/restaurants/hotels (field khác giữ nguyên)"""
+    places_data = dict(places_data or {})
+    for key in PLACE_CATEGORIES:
+        places_data[key] = ingest_places(places_data.get(key))
+    return places_data
@@ -0,0 +1,585 @@
+"""
+Asynchronous job API for itinerary generation: submit -> poll / webhook
+
+Client (Laravel) gửi request và nhận job_id ngay, không giữ kết nối HTTP trong
+lúc Gemini sinh lịch trình. Một pool worker trong process chạy các job từ hàng
+đợi; trạng thái và kết quả lưu trong sqlite (JOB_STORE_PATH) nên còn sau khi
+restart. Khi xong, nếu job có callback_url thì kết quả được POST tới đó (thử lại
+vài lần). Job đã xong bị xoá sau JOB_TTL giây.
+
+callback_url chỉ được trỏ tới host trong JOB_CALLBACK_ALLOWED_HOSTS; nếu danh sách
+trống thì tới bất kỳ host nào có địa chỉ public (không loopback/private/link-local),
+kiểm tra lúc submit và lại lúc gửi; lúc gửi, request đi thẳng tới địa chỉ IP vừa kiểm
+tra (chống DNS rebinding). Webhook không theo redirect.
+
+Nhiều process (uvicorn workers) dùng chung một file store: poll ở process nào cũng
+được. Worker chỉ chạy job sau khi claim được nó bằng một UPDATE có điều kiện
+(status='queued'), nên mỗi job chạy đúng một lần. Process đang chạy job ghi
+heartbeat định kỳ; job "running" mất heartbeat quá lâu (process đã chết) được đưa
+lại về hàng đợi (JOB_RESUME_ON_STARTUP).
+
+Trạng thái: queued -> running (stage: preparing / generating / formatting) -> succeeded | failed
+Job bị admission control từ chối khi chạy (quá tải) được đưa lại hàng đợi sau Retry-After.
+"""
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import math
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, Iterable, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+import httpx
+
+from concurrency import AdmissionRejected
+from config import settings
+
+# Tiến độ ước lượng theo stage (Gemini chiếm phần lớn thời gian)
+STAGE_PROGRESS = {
+    "queued": 0.0,
+    "preparing": 0.1,
+    "generating": 0.3,
+    "formatting": 0.9,
+    "succeeded": 1.0,
+    "failed": 1.0,
+}
+WEBHOOK_ATTEMPTS = 3
+WEBHOOK_TIMEOUT = 10.0
+# Thời gian chạy một job ước lượng khi chưa đo được job nào (giây), cho Retry-After
+DEFAULT_JOB_SECONDS = 30.0
+
+
+class CallbackRejected(ValueError):
+    """callback_url không hợp lệ hoặc trỏ tới host không được phép"""
+
+
+def _host_allowed(host: str, allowed_hosts: Iterable[str]) -> bool:
+    for allowed in allowed_hosts:
+        if allowed.startswith("*.") and host.endswith(allowed[1:]):
+            return True
+        if host == allowed:
+            return True
+    return False
+
+
+def resolve_callback_url(url: str, allowed_hosts: Iterable[str] = ()) -> Optional[str]:
+    """
+    Kiểm tra callback_url trước khi POST kết quả tới đó (resolve DNS - gọi trong thread).
+
+    Host có trong allowed_hosts (chính xác hoặc "*.example.com") luôn được phép, kể cả
+    địa chỉ nội bộ. allowed_hosts trống: chấp nhận mọi host mà tất cả địa chỉ resolve
+    được đều là địa chỉ public. Raise CallbackRejected nếu không đạt.
+
+    Returns:
+        địa chỉ IP đã kiểm tra để gửi tới (None với host trong allowed_hosts)
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise CallbackRejected("callback_url must be an http(s) URL")
+    if parts.username or parts.password:
+        raise CallbackRejected("callback_url must not contain credentials")
+    host = parts.hostname.lower().rstrip(".")
+    allowed_hosts = [allowed.strip().lower() for allowed in allowed_hosts if allowed.strip()]
+    if allowed_hosts:
+        if _host_allowed(host, allowed_hosts):
+            return None
+        raise CallbackRejected(f"callback_url host {host} is not allowed")
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        infos = socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)
+    except (OSError, ValueError) as e:
+        raise CallbackRejected(f"callback_url host {host} cannot be resolved: {e}")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if not address.is_global or address.is_multicast:
+            raise CallbackRejected(f"callback_url host {host} resolves to a non-public address")
+    return infos[0][4][0].split("%")[0]
+
+
+def validate_callback_url(url: str, allowed_hosts: Iterable[str] = ()) -> str:
+    """resolve_callback_url, trả về chính url nếu hợp lệ"""
+    resolve_callback_url(url, allowed_hosts)
+    return url
+
+
+def pin_callback_url(url: str, address: Optional[str]) -> tuple:
+    """
+    (url trỏ thẳng tới `address`, header Host, extensions của httpx) để request đi tới đúng
+    địa chỉ đã kiểm tra thay vì resolve DNS lần nữa. HTTPS vẫn kiểm tra chứng chỉ theo tên host (SNI).
+    """
+    parts = urlsplit(url)
+    if address is None:
+        return url, {}, {}
+    netloc = f"[{address}]" if ":" in address else address
+    if parts.port:
+        netloc = f"{netloc}:{parts.port}"
+    extensions = {"sni_hostname": parts.hostname} if parts.scheme == "https" else {}
+    return urlunsplit(parts._replace(netloc=netloc)), {"Host": parts.netloc}, extensions
+
+
+# Job running không có heartbeat trong chừng này lần heartbeat interval bị coi là mồ côi
+STALE_HEARTBEATS = 4
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    request TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    callback_url TEXT,
+    webhook_status TEXT,
+    owner TEXT,
+    heartbeat_at REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    expires_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_expires_at ON jobs (expires_at);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+"""
+# Cột thêm sau phiên bản đầu của bảng (file store cũ)
+_ADDED_COLUMNS = (("owner", "TEXT"), ("heartbeat_at", "REAL"))
+
+
+class JobStore:
+    """
+    Bảng job trong sqlite (path trống = chỉ RAM), mở lười ở lần dùng đầu. Một
+    connection dùng chung, khoá bằng threading.Lock - JobManager gọi qua asyncio.to_thread.
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect_locked(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.path:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path or ":memory:", check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            if self.path:
+                conn.execute("PRAGMA journal_mode=WAL")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for name, kind in _ADDED_COLUMNS:
+                if columns and name not in columns:
+                    try:
+                        conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {kind}")
+                    except sqlite3.OperationalError:
+                        pass  # process khác vừa thêm cột
+            conn.executescript(_SCHEMA)
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            conn = self._connect_locked()
+            cursor = conn.execute(sql, params)
+            conn.commit()
+            return cursor
+
+    def _fetch(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self._connect_locked().execute(sql, params).fetchall()
+
+    def create(self, job_id: str, kind: str, request: str, callback_url: Optional[str]):
+        self._execute(
+            "INSERT INTO jobs (id, kind, status, stage, request, callback_url, created_at) "
+            "VALUES (?, ?, 'queued', 'queued', ?, ?, ?)",
+            (job_id, kind, request, callback_url, time.time())
+        )
+
+    def get(self, job_id: str) -> Optional[dict]:
+        rows = self._fetch("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        return dict(rows[0]) if rows else None
+
+    def claim(self, job_id: str, owner: str) -> bool:
+        """Nhận job để chạy; False nếu job không còn queued (process khác đã nhận / đã xong)"""
+        now = time.time()
+        return self._execute(
+            "UPDATE jobs SET status = 'running', stage = 'preparing', owner = ?, started_at = ?, heartbeat_at = ? "
+            "WHERE id = ? AND status = 'queued'",
+            (owner, now, now, job_id)
+        ).rowcount == 1
+
+    def set_stage(self, job_id: str, owner: str, stage: str):
+        self._execute("UPDATE jobs SET stage = ?, heartbeat_at = ? WHERE id = ? AND status = 'running' AND owner = ?",
+                      (stage, time.time(), job_id, owner))
+
+    def finish(self, job_id: str, owner: str, status: str, result: Optional[str], error: Optional[str],
+               ttl_seconds: float) -> bool:
+        """Ghi kết quả; False nếu job đã bị đưa lại hàng đợi cho process khác (kết quả bị bỏ)"""
+        now = time.time()
+        return self._execute(
+            "UPDATE jobs SET status = ?, stage = ?, result = ?, error = ?, finished_at = ?, expires_at = ? "
+            "WHERE id = ? AND status = 'running' AND owner = ?",
+            (status, status, result, error, now, now + ttl_seconds, job_id, owner)
+        ).rowcount == 1
+
+    def release(self, job_id: str, owner: str) -> bool:
+        """Trả job đang chạy về hàng đợi (không chạy được lúc này); False nếu không còn thuộc owner"""
+        return self._execute(
+            "UPDATE jobs SET status = 'queued', stage = 'queued', owner = NULL, started_at = NULL "
+            "WHERE id = ? AND status = 'running' AND owner = ?",
+            (job_id, owner)
+        ).rowcount == 1
+
+    def heartbeat(self, owner: str):
+        self._execute("UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status = 'running'",
+                      (time.time(), owner))
+
+    def set_webhook_status(self, job_id: str, webhook_status: str):
+        self._execute("UPDATE jobs SET webhook_status = ? WHERE id = ?", (webhook_status, job_id))
+
+    def queued(self) -> list:
+        """Các job đang chờ, theo thứ tự tạo"""
+        rows = self._fetch("SELECT id, kind, request FROM jobs WHERE status = 'queued' ORDER BY created_at")
+        return [dict(row) for row in rows]
+
+    def requeue_stale(self, stale_before: float) -> int:
+        """Đưa các job running mất heartbeat (process chạy nó đã chết) về hàng đợi"""
+        return self._execute(
+            "UPDATE jobs SET status = 'queued', stage = 'queued', owner = NULL, started_at = NULL "
+            "WHERE status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+            (stale_before,)
+        ).rowcount
+
+    def delete_expired(self) -> int:
+        return self._execute("DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                             (time.time(),)).rowcount
+
+    def counts(self) -> dict:
+        return {status: count for status, count in self._fetch("SELECT status, COUNT(*) FROM jobs GROUP BY status")}
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# runner(request_json, set_stage) -> nội dung response (dict JSON-serializable, có "success")
+JobRunner = Callable[[str, Callable[[str], Awaitable[None]]], Awaitable[dict]]
+
+
+class JobManager:
+    """
+    Hàng đợi + pool worker asyncio chạy job trong process.
+
+    Mỗi loại job (kind) đăng ký một runner; runner nhận request đã lưu (JSON) và
+    hàm set_stage để báo tiến độ, trả về nội dung response giống endpoint đồng bộ.
+    """
+
+    def __init__(self, store: JobStore, workers: int, max_queue: int, ttl_seconds: float,
+                 cleanup_interval: float, webhook_secret: str = "", resume_on_start: bool = True,
+                 heartbeat_interval: float = 15.0, callback_allowed_hosts: Iterable[str] = ()):
+        self.store = store
+        self.resume_on_start = resume_on_start
+        self.heartbeat_interval = heartbeat_interval
+        self.callback_allowed_hosts = tuple(callback_allowed_hosts)
+        # Định danh process này trong cột owner
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.workers = max(1, workers)
+        self.max_queue = max(1, max_queue)
+        self.ttl_seconds = ttl_seconds
+        self.cleanup_interval = cleanup_interval
+        self.webhook_secret = webhook_secret
+        self._runners: dict = {}
+        self._queue: Optional[asyncio.Queue] = None
+        # job_id -> số thứ tự lúc vào hàng đợi; hàng đợi FIFO nên vị trí = số thứ tự - số job đã lấy ra
+        self._enqueued: dict = {}
+        self._enqueue_seq = 0
+        self._dequeued = 0
+        # Job đang chờ Retry-After trước khi vào lại hàng đợi
+        self._deferred: set = set()
+        self._avg_run: Optional[float] = None
+        self._tasks: list = []
+        self._webhooks: set = set()
+        self._requeues: set = set()
+        self.completed = 0
+        self.failed = 0
+        self.webhooks_delivered = 0
+        self.webhooks_failed = 0
+        self.webhooks_rejected = 0
+        self.expired = 0
+        self.resumed = 0
+        self.skipped = 0
+        self.requeued = 0
+
+    def register(self, kind: str, runner: JobRunner):
+        self._runners[kind] = runner
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self):
+        """Khởi động worker, heartbeat và dọn dẹp TTL (gọi trong lifespan)"""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._enqueued, self._enqueue_seq, self._dequeued = {}, 0, 0
+        self._deferred = set()
+        if self.resume_on_start:
+            await self._resume()
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.ensure_future(self._cleanup_loop()))
+        self._tasks.append(asyncio.ensure_future(self._heartbeat_loop()))
+
+    def _enqueue(self, job_id: str, kind: str, request: str):
+        if job_id not in self._enqueued and job_id not in self._deferred:
+            self._enqueued[job_id] = self._enqueue_seq
+            self._enqueue_seq += 1
+            self._queue.put_nowait((job_id, kind, request))
+
+    async def _requeue_later(self, job_id: str, kind: str, request: str, delay: float):
+        self._deferred.add(job_id)
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self._deferred.discard(job_id)
+        self._enqueue(job_id, kind, request)
+
+    def retry_after(self) -> int:
+        """Số giây gợi ý khi hàng đợi đầy: thời gian ước lượng để các worker chạy hết hàng đợi"""
+        per_job = self._avg_run if self._avg_run is not None else DEFAULT_JOB_SECONDS
+        queued = self._queue.qsize() if self._queue is not None else 0
+        return max(1, math.ceil(per_job * math.ceil(queued / self.workers)))
+
+    async def _resume(self):
+        """
+        Nhận lại job mồ côi: job running mất heartbeat về queued, rồi xếp các job queued
+        (kể cả job đang nằm trong hàng đợi của process khác - claim đảm bảo chỉ chạy một lần)
+        """
+        stale_before = time.time() - STALE_HEARTBEATS * self.heartbeat_interval
+        self.resumed += await asyncio.to_thread(self.store.requeue_stale, stale_before)
+        for job in await asyncio.to_thread(self.store.queued):
+            self._enqueue(job["id"], job["kind"], job["request"])
+
+    async def stop(self):
+        """Dừng worker; job đang chạy được process khác (hoặc lần start sau) nhận lại khi hết heartbeat"""
+        tasks, self._tasks = self._tasks + list(self._webhooks) + list(self._requeues), []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def check_callback_url(self, url: str) -> str:
+        """validate_callback_url với danh sách host của manager (resolve DNS ngoài event loop)"""
+        return await asyncio.to_thread(validate_callback_url, url, self.callback_allowed_hosts)
+
+    async def submit(self, kind: str, request: str, callback_url: Optional[str] = None) -> dict:
+        """
+        Lưu job và đưa vào hàng đợi; raise AdmissionRejected (429) nếu hàng đợi đầy,
+        CallbackRejected nếu callback_url không được phép
+        """
+        if kind not in self._runners:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if callback_url:
+            await self.check_callback_url(callback_url)
+        if self._queue is None:
+            raise RuntimeError("Job workers are not running")
+        if self._queue.qsize() >= self.max_queue:
+            raise AdmissionRejected(f"jobs: too many jobs queued ({self._queue.qsize()})", 429,
+                                    retry_after=self.retry_after())
+        job_id = uuid.uuid4().hex
+        await asyncio.to_thread(self.store.create, job_id, kind, request, callback_url)
+        self._enqueue(job_id, kind, request)
+        return await self.get(job_id)
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        """Trạng thái job cho API, None nếu không có hoặc đã hết hạn"""
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is None or (job["expires_at"] is not None and job["expires_at"] <= time.time()):
+            return None
+        return self._public(job)
+
+    def _public(self, job: dict) -> dict:
+        return {
+            "job_id": job["id"],
+            "kind": job["kind"],
+            "status": job["status"],
+            "stage": job["stage"],
+            "progress": STAGE_PROGRESS.get(job["stage"], 0.0),
+            "queue_position": self._queue_position(job["id"]) if job["status"] == "queued" else None,
+            "created_at": _iso(job["created_at"]),
+            "started_at": _iso(job["started_at"]),
+            "finished_at": _iso(job["finished_at"]),
+            "expires_at": _iso(job["expires_at"]),
+            "result": json.loads(job["result"]) if job["result"] else None,
+            "error": job["error"],
+            "webhook": {"url": job["callback_url"], "status": job["webhook_status"]} if job["callback_url"] else None,
+        }
+
+    def _queue_position(self, job_id: str) -> Optional[int]:
+        seq = self._enqueued.get(job_id)
+        return seq - self._dequeued if seq is not None else None
+
+    async def _worker(self):
+        while True:
+            job_id, kind, request = await self._queue.get()
+            self._enqueued.pop(job_id, None)
+            self._dequeued += 1
+            try:
+                if await asyncio.to_thread(self.store.claim, job_id, self.owner):
+                    await self._run(job_id, kind, request)
+                else:
+                    self.skipped += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Job {job_id} crashed: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str, kind: str, request: str):
+        """Chạy một job đã claim"""
+        async def set_stage(stage: str):
+            await asyncio.to_thread(self.store.set_stage, job_id, self.owner, stage)
+
+        started = time.monotonic()
+        try:
+            content = await self._runners[kind](request, set_stage)
+            status = "succeeded" if content.get("success") else "failed"
+            error = content.get("error")
+        except AdmissionRejected as e:
+            # Quá tải khi chạy job: job không lỗi, trả về hàng đợi và thử lại sau Retry-After
+            if await asyncio.to_thread(self.store.release, job_id, self.owner):
+                self.requeued += 1
+                task = asyncio.ensure_future(self._requeue_later(job_id, kind, request, e.retry_after))
+                self._requeues.add(task)
+                task.add_done_callback(self._requeues.discard)
+            return
+        except Exception as e:
+            print(f"Error in job {job_id}: {e}")
+            content, status, error = None, "failed", f"Internal server error: {str(e)}"
+
+        elapsed = time.monotonic() - started
+        self._avg_run = elapsed if self._avg_run is None else 0.8 * self._avg_run + 0.2 * elapsed
+        result = json.dumps(content, ensure_ascii=False, default=str) if content is not None else None
+        finished = await asyncio.to_thread(self.store.finish, job_id, self.owner, status, result, error,
+                                           self.ttl_seconds)
+        if not finished:
+            # Job đã bị coi là mồ côi và giao cho process khác: không ghi đè, không gửi webhook
+            print(f"Job {job_id} was reassigned, result discarded")
+            return
+        if status == "succeeded":
+            self.completed += 1
+        else:
+            self.failed += 1
+
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job and job["callback_url"]:
+            # Webhook gửi nền để worker nhận job tiếp theo ngay
+            task = asyncio.ensure_future(self._deliver_webhook(self._public(job)))
+            self._webhooks.add(task)
+            task.add_done_callback(self._webhooks.discard)
+
+    async def _deliver_webhook(self, job: dict):
+        url = job["webhook"]["url"]
+        body = json.dumps(job, ensure_ascii=False, default=str).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if self.webhook_secret:
+            signature = hmac.new(self.webhook_secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+            headers["X-Signature"] = f"sha256={signature}"
+        try:
+            # Kiểm tra lại lúc gửi (DNS của host có thể đã đổi sang địa chỉ nội bộ) và gửi
+            # thẳng tới địa chỉ vừa kiểm tra, không để httpx resolve lại
+            address = await asyncio.to_thread(resolve_callback_url, url, self.callback_allowed_hosts)
+        except CallbackRejected as e:
+            print(f"Webhook for job {job['job_id']} not sent: {e}")
+            self.webhooks_rejected += 1
+            await asyncio.to_thread(self.store.set_webhook_status, job["job_id"], "rejected")
+            return
+        target, host_header, extensions = pin_callback_url(url, address)
+        headers.update(host_header)
+        status = "failed"
+        async with httpx.AsyncClient(timeout=WEBHOOK_TIMEOUT, follow_redirects=False) as client:
+            for attempt in range(WEBHOOK_ATTEMPTS):
+                try:
+                    response = await client.post(target, content=body, headers=headers, extensions=extensions)
+                    if response.status_code < 300:
+                        status = "delivered"
+                        break
+                    print(f"Webhook for job {job['job_id']} returned {response.status_code}")
+                except httpx.HTTPError as e:
+                    print(f"Webhook for job {job['job_id']} failed: {e}")
+                if attempt + 1 < WEBHOOK_ATTEMPTS:
+                    await asyncio.sleep(2 ** attempt)
+        if status == "delivered":
+            self.webhooks_delivered += 1
+        else:
+            self.webhooks_failed += 1
+        await asyncio.to_thread(self.store.set_webhook_status, job["job_id"], status)
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await asyncio.to_thread(self.store.heartbeat, self.owner)
+                if self.resume_on_start:
+                    await self._resume()
+            except sqlite3.Error as e:
+                print(f"Job heartbeat failed: {e}")
+
+    async def _cleanup_loop(self):
+        while True:
+            try:
+                self.expired += await asyncio.to_thread(self.store.delete_expired)
+            except sqlite3.Error as e:
+                print(f"Job cleanup failed: {e}")
+            await asyncio.sleep(self.cleanup_interval)
+
+    async def stats(self) -> dict:
+        """Số liệu cho /health; đếm theo status chạy trong thread vì là truy vấn sqlite"""
+        try:
+            by_status = await asyncio.to_thread(self.store.counts)
+        except sqlite3.Error as e:
+            by_status = {"error": str(e)}
+        return {
+            "running": self.running,
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "failed": self.failed,
+            "webhooks_delivered": self.webhooks_delivered,
+            "webhooks_failed": self.webhooks_failed,
+            "webhooks_rejected": self.webhooks_rejected,
+            "expired": self.expired,
+            "resumed": self.resumed,
+            "requeued_overloaded": self.requeued,
+            "avg_run_ms": round(self._avg_run * 1000, 1) if self._avg_run is not None else None,
+            "skipped_claimed_elsewhere": self.skipped,
+            "by_status": by_status,
+        }
+
+
+def _iso(timestamp: Optional[float]) -> Optional[str]:
+    if timestamp is None:
+        return None
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(timestamp))
+
+
+job_manager = JobManager(
+    JobStore(settings.JOB_STORE_PATH or None),
+    workers=settings.JOB_WORKERS,
+    max_queue=settings.JOB_MAX_QUEUE,
+    ttl_seconds=settings.JOB_TTL,
+    cleanup_interval=settings.JOB_CLEANUP_INTERVAL,
+    webhook_secret=settings.JOB_WEBHOOK_SECRET,
+    resume_on_start=settings.JOB_RESUME_ON_STARTUP,
+    heartbeat_interval=settings.JOB_HEARTBEAT_INTERVAL,
+    callback_allowed_hosts=settings.JOB_CALLBACK_ALLOWED_HOSTS.split(",")
+)
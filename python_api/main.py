@@ -3,63 +3,98 @@ FastAPI application for Smart Travel Recommendation API
 """
 from fastapi import FastAPI, HTTPException, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from contextlib import asynccontextmanager
 from typing import Optional
-from datetime import datetime
+from datetime import date, datetime
+import asyncio
+import hashlib
+import time
+import amadeus_client
 import flight
+import warmup
+from airlines import airline_store
+from catalog import CatalogConflict, place_catalog
+from jobs import CallbackRejected, job_manager
+from concurrency import AdmissionRejected
 from config import settings
+from ingest import ingest_places
+import responses
+from responses import FastJSONResponse
 from models import (
     TravelPreferencesRequest,
     TravelRecommendationResponse,
+    BatchRecommendationRequest,
+    BatchRecommendationResponse,
+    RecommendationJobRequest,
     HealthCheckResponse,
     CitySearchRequest,
+    CatalogPlaces,
+    CatalogDeltaRequest,
     PlaceData,
     PlaceName,
     FlightSearchRequest
 )
-from services import create_user_tour_info_simple, build_final_tour_json
-
-
-def serialize_place_data(place: PlaceData) -> dict:
-    """
-    Serialize PlaceData to dictionary, handling name that can be string or PlaceName object
-    """
-    place_dict = place.model_dump()
-    
-    # Handle name field - convert PlaceName object to dict if needed
-    if isinstance(place_dict.get("name"), dict):
-        # Already a dict, convert keys from snake_case to camelCase for API compatibility
-        name_obj = place_dict["name"]
-        if "language_code" in name_obj:
-            name_obj["languageCode"] = name_obj.pop("language_code")
-    
-    return place_dict
+from services import (
+    create_user_tour_info_simple,
+    build_final_tour_json_async,
+    stream_final_tour_json,
+    itinerary_cache,
+    itinerary_flights,
+    generation_admission
+)
 
 
 def serialize_user_preferences(user_prefs: dict) -> dict:
     """
-    Serialize all PlaceData objects in user preferences to dictionaries
+    Serialize user preferences: PlaceData lists go through the same single-pass
+    ingestion as places_data, other values (transport modes) are kept as-is
     """
     serialized = {}
     for key, value in user_prefs.items():
-        if isinstance(value, list):
-            # Serialize list of PlaceData objects
-            serialized[key] = [
-                serialize_place_data(item) if isinstance(item, PlaceData) else item
-                for item in value
-            ]
+        if isinstance(value, list) and any(isinstance(item, (PlaceData, dict)) for item in value):
+            serialized[key] = ingest_places(value)
         else:
             serialized[key] = value
     return serialized
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Application lifespan - warm up heavy modules/tables and upstream connections
+    in the background on startup, release pooled connections on shutdown
+    """
+    warmup_task = warmup.start_warm_up()
+    await job_manager.start()
+    # Dọn tầng đĩa của itinerary cache định kỳ (file hết hạn, giới hạn số file/dung lượng)
+    cache_sweeper = None
+    if itinerary_cache.disk_dir:
+        cache_sweeper = asyncio.ensure_future(itinerary_cache.run_sweeper(settings.ITINERARY_CACHE_SWEEP_INTERVAL))
+    yield
+    if cache_sweeper is not None:
+        cache_sweeper.cancel()
+        await asyncio.gather(cache_sweeper, return_exceptions=True)
+    await job_manager.stop()
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+        try:
+            await warmup_task
+        except asyncio.CancelledError:
+            pass
+    await amadeus_client.close_client()
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title=settings.API_TITLE,
     version=settings.API_VERSION,
     description=settings.API_DESCRIPTION,
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
 
 # CORS middleware
@@ -71,6 +106,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Nén gzip/br cho response lớn (SSE không bị nén)
+responses.install(app)
+
 
 # Security dependency (API Key authentication)
 async def verify_api_key(x_api_key: Optional[str] = Header(None)):
@@ -95,18 +133,135 @@ async def root():
 
 @app.get("/health", tags=["Health"])
 async def health_check():
-    """Health check endpoint - no database required"""
+    """
+    Health check endpoint - no database required
+    
+    `ready` turns true once the startup warm-up (airport tables, city CSV,
+    Gemini model, Amadeus connection) has finished; details are in `warmup`.
+    """
     gemini_status = {"configured": bool(settings.GEMINI_API_KEY)}
+    warmup_status = warmup.warmup_status()
     
     return {
         "status": "healthy" if settings.GEMINI_API_KEY else "unhealthy",
+        "ready": warmup_status["ready"],
         "version": settings.API_VERSION,
         "timestamp": datetime.now().isoformat(),
         "gemini_ai": gemini_status,
+        "cache": {
+            "itinerary": itinerary_cache.stats(),
+            "flight_offers": flight.flight_offers_cache.stats(),
+            "resolved_codes": flight.resolved_code_cache.stats(),
+            "airlines": airline_store.stats()
+        },
+        "warmup": warmup_status,
+        "admission": {"generation": generation_admission.stats()},
+        "singleflight": {
+            "itinerary": itinerary_flights.stats(),
+            "flight_search": flight.flight_searches.stats()
+        },
+        "jobs": await job_manager.stats(),
+        "catalog": place_catalog.stats(),
         "message": "API is running. Database not required - all data provided by Laravel."
     }
 
 
+def ingest_catalogue(activities, restaurants, hotels) -> Optional[dict]:
+    """places_data đã chuẩn hoá từ các list place của request, None nếu cả ba đều rỗng"""
+    if not (activities or restaurants or hotels):
+        return None
+    return {
+        'activities': ingest_places(activities),
+        'restaurants': ingest_places(restaurants),
+        'hotels': ingest_places(hotels)
+    }
+
+
+def prepare_generation_inputs(request: TravelPreferencesRequest, places_data: Optional[dict] = None):
+    """
+    Chuẩn bị input cho build_final_tour_json từ request
+    
+    Args:
+        places_data: catalogue đã ingest sẵn (batch dùng chung giữa các item);
+            None thì ingest activities/restaurants/hotels của request
+    
+    Returns:
+        (user_input, serialized user_prefs, places_data, destination_city)
+    """
+    # Generate user ID if not provided
+    if not request.user_id:
+        request.user_id = f"web_user_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    
+    # Determine destination city (support both old and new format)
+    destination_city = request.city_name or request.destination_city_id or "Unknown"
+    
+    # Create user preferences dict
+    user_prefs = {
+        "liked_activities": request.liked_activities or [],
+        "disliked_activities": request.disliked_activities or [],
+        "liked_restaurants": request.liked_restaurants or [],
+        "disliked_restaurants": request.disliked_restaurants or [],
+        "liked_hotels": request.liked_hotels or [],
+        "disliked_hotels": request.disliked_hotels or [],
+        "liked_transport": request.liked_transport or [],
+        "disliked_transport": request.disliked_transport or []
+    }
+    
+    # Create user tour info
+    user_input = create_user_tour_info_simple(
+        user_id=request.user_id,
+        start_city_id=destination_city,
+        destination_city_id=destination_city,
+        guest_count=request.guest_count,
+        duration_days=request.duration_days,
+        target_budget=request.target_budget
+    )
+    
+    # Prepare places data if provided
+    if places_data is None:
+        places_data = ingest_catalogue(request.activities, request.restaurants, request.hotels)
+    
+    # Print places data info
+    print(f"\n📦 PLACES DATA:")
+    print(f"   🎯 Activities: {len((places_data or {}).get('activities') or [])} provided")
+    print(f"   🍽️  Restaurants: {len((places_data or {}).get('restaurants') or [])} provided")
+    print(f"   🏨 Hotels: {len((places_data or {}).get('hotels') or [])} provided")
+    print("="*80 + "\n")
+    
+    return user_input, serialize_user_preferences(user_prefs), places_data, destination_city
+
+
+def build_response_data(result: dict, current_day: int = 1) -> dict:
+    """Format kết quả build_final_tour_json thành `data` của TravelRecommendationResponse"""
+    return {
+        "tour_info": {
+            "tour_id": result["tour_id"],
+            "user_id": result["user_id"],
+            "start_city": result["start_city"],
+            "destination_city": result["destination_city"],
+            "duration_days": int(result["duration_days"]),
+            "guest_count": int(result["guest_count"]),
+            "current_day": current_day,
+            "budget": float(result["budget"]),
+            "total_estimated_cost": float(result["total_estimated_cost"]),
+            "generated_by": result["generated_by"],
+            "created_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        },
+        "itinerary": result["schedule"],
+        "summary": {
+            "total_days": int(result["duration_days"]),
+            "total_activities": sum(len(day.get("activities", [])) for day in result["schedule"]),
+            "cost_per_person": float(result["total_estimated_cost"]) / int(result["guest_count"]) if int(result["guest_count"]) > 0 else 0,
+            "budget_utilized": (float(result["total_estimated_cost"]) / float(result["budget"]) * 100) if float(result["budget"]) > 0 else 0
+        }
+    }
+
+
+def _sse_event(event: str, data: dict) -> str:
+    """Format một Server-Sent Event"""
+    return f"event: {event}\ndata: {responses.dumps_text(data)}\n\n"
+
+
 @app.post("/api/recommendations", response_model=TravelRecommendationResponse, tags=["Recommendations"])
 async def get_travel_recommendations(
     request: TravelPreferencesRequest,
@@ -119,105 +274,420 @@ async def get_travel_recommendations(
     based on user preferences, budget, and destination.
     """
     try:
-        # Generate user ID if not provided
-        if not request.user_id:
-            request.user_id = f"web_user_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        
-        # Determine destination city (support both old and new format)
-        destination_city = request.city_name or request.destination_city_id or "Unknown"
-        
-        # Create user preferences dict
-        user_prefs = {
-            "liked_activities": request.liked_activities or [],
-            "disliked_activities": request.disliked_activities or [],
-            "liked_restaurants": request.liked_restaurants or [],
-            "disliked_restaurants": request.disliked_restaurants or [],
-            "liked_hotels": request.liked_hotels or [],
-            "disliked_hotels": request.disliked_hotels or [],
-            "liked_transport": request.liked_transport or [],
-            "disliked_transport": request.disliked_transport or []
-        }
-        
-        # Print places data info
-        print(f"\n📦 PLACES DATA:")
-        print(f"   🎯 Activities: {len(request.activities)} provided")
-        print(f"   🍽️  Restaurants: {len(request.restaurants)} provided")
-        print(f"   🏨 Hotels: {len(request.hotels)} provided")
-        print("="*80 + "\n")
-        
-        # Create user tour info
-        user_input = create_user_tour_info_simple(
-            user_id=request.user_id,
-            start_city_id=destination_city,
-            destination_city_id=destination_city,
-            guest_count=request.guest_count,
-            duration_days=request.duration_days,
-            target_budget=request.target_budget
-        )
-        
-        # Prepare places data if provided
-        places_data = None
-        if request.activities or request.restaurants or request.hotels:
-            places_data = {
-                'activities': [serialize_place_data(place) for place in request.activities],
-                'restaurants': [serialize_place_data(place) for place in request.restaurants],
-                'hotels': [serialize_place_data(place) for place in request.hotels]
-            }
-        # Generate itinerary with provided places data
+        user_input, user_prefs, places_data, destination_city = prepare_generation_inputs(request)
 
-        result = build_final_tour_json(
-            user_input, 
-            serialize_user_preferences(user_prefs),
+        # Generate itinerary with provided places data
+        result = await build_final_tour_json_async(
+            user_input,
+            user_prefs,
             destination_name=destination_city,
-            places_data=places_data
+            places_data=places_data,
+            planner=request.planner
         )
         
-        # Check for errors
+        # Trả thẳng dict đã build (response_model chỉ dùng cho docs): bỏ lượt
+        # validate/serialize lại qua TravelRecommendationResponse
         if "error" in result:
-            return TravelRecommendationResponse(
-                success=False,
-                error=result["error"],
-                data=None
-            )
+            return FastJSONResponse({"success": False, "error": result["error"], "data": None})
+
+        return FastJSONResponse({
+            "success": True,
+            "error": None,
+            "data": build_response_data(result, request.current_day)
+        })
         
-        # Format successful response
-        response_data = {
-            "tour_info": {
-                "tour_id": result["tour_id"],
-                "user_id": result["user_id"],
-                "start_city": result["start_city"],
-                "destination_city": result["destination_city"],
-                "duration_days": int(result["duration_days"]),
-                "guest_count": int(result["guest_count"]),
-                "current_day": request.current_day,
-                "budget": float(result["budget"]),
-                "total_estimated_cost": float(result["total_estimated_cost"]),
-                "generated_by": result["generated_by"],
-                "created_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            },
-            "itinerary": result["schedule"],
-            "summary": {
-                "total_days": int(result["duration_days"]),
-                "total_activities": sum(len(day.get("activities", [])) for day in result["schedule"]),
-                "cost_per_person": float(result["total_estimated_cost"]) / int(result["guest_count"]) if int(result["guest_count"]) > 0 else 0,
-                "budget_utilized": (float(result["total_estimated_cost"]) / float(result["budget"]) * 100) if float(result["budget"]) > 0 else 0
-            }
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        print(f"Error in get_travel_recommendations: {e}")
+        import traceback
+        traceback.print_exc()
+        return FastJSONResponse({
+            "success": False,
+            "error": f"Internal server error: {str(e)}",
+            "data": None
+        })
+
+
+def catalogue_fingerprint(request: TravelPreferencesRequest) -> Optional[str]:
+    """Hash nội dung activities/restaurants/hotels của request, None nếu request không gửi catalogue"""
+    if not (request.activities or request.restaurants or request.hotels):
+        return None
+    digest = hashlib.sha1()
+    for key in ('activities', 'restaurants', 'hotels'):
+        digest.update(key.encode())
+        for place in getattr(request, key) or []:
+            digest.update(place.model_dump_json().encode())
+    return digest.hexdigest()
+
+
+def batch_jobs(request: BatchRecommendationRequest) -> list:
+    """(index, item, places_data) cho từng item của batch; catalogue giống hệt nhau chỉ ingest một lần"""
+    shared_places = ingest_catalogue(request.activities, request.restaurants, request.hotels)
+    catalogues = {}
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    jobs = []
+    for index, item in enumerate(request.items):
+        fingerprint = catalogue_fingerprint(item)
+        if fingerprint is None:
+            places_data = shared_places
+        else:
+            if fingerprint not in catalogues:
+                catalogues[fingerprint] = ingest_catalogue(item.activities, item.restaurants, item.hotels)
+            places_data = catalogues[fingerprint]
+        if not item.user_id:
+            # user_id mặc định theo giây sẽ trùng giữa các item: thêm index
+            item.user_id = f"web_user_{stamp}_{index}"
+        jobs.append((index, item, places_data))
+    return jobs
+
+
+@app.post("/api/recommendations/batch", response_model=BatchRecommendationResponse, tags=["Recommendations"])
+async def batch_travel_recommendations(
+    request: BatchRecommendationRequest,
+    authenticated: bool = Depends(verify_api_key)
+):
+    """
+    Generate itineraries for many requests at once
+    
+    Items run concurrently (at most BATCH_MAX_CONCURRENCY at a time, still subject to
+    admission control and the Gemini concurrency limit). Identical place catalogues are
+    ingested once and shared; items without their own catalogue use the batch-level one.
+    Each item gets its own result or error, one failing item does not fail the batch.
+    """
+    if len(request.items) > settings.BATCH_MAX_ITEMS:
+        return FastJSONResponse(status_code=400, content={
+            "success": False,
+            "error": f"Too many items in batch ({len(request.items)} > {settings.BATCH_MAX_ITEMS})",
+            "results": [],
+            "summary": None
+        })
+
+    start = time.monotonic()
+    # Hash/ingest catalogue của từng item là CPU (model_dump_json mọi place): chạy ngoài event loop
+    jobs = await asyncio.to_thread(batch_jobs, request)
+
+    slots = asyncio.Semaphore(max(1, settings.BATCH_MAX_CONCURRENCY))
+
+    async def run_item(index: int, item: TravelPreferencesRequest, places_data: Optional[dict]) -> dict:
+        async with slots:
+            try:
+                user_input, user_prefs, places_data, destination_city = prepare_generation_inputs(item, places_data)
+                result = await build_final_tour_json_async(
+                    user_input,
+                    user_prefs,
+                    destination_name=destination_city,
+                    places_data=places_data,
+                    planner=item.planner
+                )
+                if "error" in result:
+                    return {"index": index, "success": False, "error": result["error"], "status_code": 200, "data": None}
+                return {"index": index, "success": True, "error": None, "status_code": 200,
+                        "data": build_response_data(result, item.current_day)}
+            except AdmissionRejected as e:
+                return {"index": index, "success": False, "error": str(e), "status_code": e.status_code,
+                        "retry_after": e.retry_after, "data": None}
+            except Exception as e:
+                print(f"Error in batch item {index}: {e}")
+                return {"index": index, "success": False, "error": f"Internal server error: {str(e)}",
+                        "status_code": 500, "data": None}
+
+    results = await asyncio.gather(*(run_item(*job) for job in jobs))
+    succeeded = sum(1 for result in results if result["success"])
+    return FastJSONResponse({
+        "success": True,
+        "error": None,
+        "results": results,
+        "summary": {
+            "total": len(results),
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "catalogues": len(catalogues) + (shared_places is not None),
+            "concurrency": max(1, settings.BATCH_MAX_CONCURRENCY),
+            "elapsed_ms": round((time.monotonic() - start) * 1000, 1)
         }
-        return TravelRecommendationResponse(
-            success=True,
-            error=None,
-            data=response_data
+    })
+
+
+@app.post("/api/recommendations/by-city-name", response_model=TravelRecommendationResponse, tags=["Recommendations"])
+async def get_recommendations_by_city_name(
+    request: CitySearchRequest,
+    authenticated: bool = Depends(verify_api_key)
+):
+    """
+    Generate an itinerary from the server-side place catalogue
+    
+    Only the city name and preferences are sent; activities, restaurants and hotels
+    come from the catalogue uploaded via PUT /api/catalog/{city_name}.
+    """
+    snapshot = await asyncio.to_thread(place_catalog.snapshot, request.city_name)
+    if snapshot is None:
+        return FastJSONResponse(status_code=404, content={
+            "success": False,
+            "error": f"No place catalogue for city '{request.city_name}'. Upload it via PUT /api/catalog/{{city_name}}",
+            "data": None
+        })
+    meta, catalog_places = snapshot
+    if request.catalog_hash and request.catalog_hash != meta["content_hash"]:
+        return FastJSONResponse(status_code=409, content={
+            "success": False,
+            "error": "Place catalogue version mismatch",
+            "data": {"content_hash": meta["content_hash"], "version": meta["version"]}
+        })
+
+    preferences = TravelPreferencesRequest(**{
+        name: getattr(request, name) for name in CitySearchRequest.model_fields if name != "catalog_hash"
+    })
+    try:
+        user_input, user_prefs, places_data, destination_city = prepare_generation_inputs(
+            preferences, catalog_places
         )
-        
+        result = await build_final_tour_json_async(
+            user_input,
+            user_prefs,
+            destination_name=destination_city,
+            places_data=places_data,
+            planner=preferences.planner
+        )
+        if "error" in result:
+            return FastJSONResponse({"success": False, "error": result["error"], "data": None})
+
+        return FastJSONResponse({
+            "success": True,
+            "error": None,
+            "data": build_response_data(result, preferences.current_day)
+        })
+
+    except AdmissionRejected:
+        raise
     except Exception as e:
-        print(f"Error in get_travel_recommendations: {e}")
+        print(f"Error in get_recommendations_by_city_name: {e}")
         import traceback
         traceback.print_exc()
-        return TravelRecommendationResponse(
-            success=False,
-            error=f"Internal server error: {str(e)}",
-            data=None
+        return FastJSONResponse({
+            "success": False,
+            "error": f"Internal server error: {str(e)}",
+            "data": None
+        })
+
+
+@app.get("/api/catalog", tags=["Catalog"])
+async def list_catalogs(authenticated: bool = Depends(verify_api_key)):
+    """Place catalogues currently loaded (city, version, content_hash, counts)"""
+    return {"success": True, "error": None, "data": await asyncio.to_thread(place_catalog.cities)}
+
+
+@app.get("/api/catalog/{city_name}", tags=["Catalog"])
+async def get_catalog(city_name: str, authenticated: bool = Depends(verify_api_key)):
+    """Version and content_hash of a city's catalogue (to decide whether to upload)"""
+    meta = await asyncio.to_thread(place_catalog.meta, city_name)
+    if meta is None:
+        return FastJSONResponse(status_code=404, content={"success": False, "error": "Catalogue not found", "data": None})
+    return {"success": True, "error": None, "data": meta}
+
+
+@app.put("/api/catalog/{city_name}", tags=["Catalog"])
+async def upload_catalog(city_name: str, places: CatalogPlaces, authenticated: bool = Depends(verify_api_key)):
+    """
+    Upload (replace) a city's activities, restaurants and hotels
+    
+    Uploading the same content again keeps the version (`changed: false`).
+    """
+    try:
+        meta, changed = await asyncio.to_thread(place_catalog.replace, city_name, {
+            "activities": places.activities,
+            "restaurants": places.restaurants,
+            "hotels": places.hotels
+        })
+    except ValueError as e:
+        return FastJSONResponse(status_code=400, content={"success": False, "error": str(e), "data": None})
+    return {"success": True, "error": None, "data": {**meta, "changed": changed}}
+
+
+@app.patch("/api/catalog/{city_name}", tags=["Catalog"])
+async def update_catalog(city_name: str, delta: CatalogDeltaRequest, authenticated: bool = Depends(verify_api_key)):
+    """
+    Delta update: upsert places (matched by id, place_id or name) and remove keys
+    
+    base_hash must be the current content_hash, otherwise 409 and the client
+    re-uploads the full catalogue.
+    """
+    try:
+        meta = await asyncio.to_thread(
+            place_catalog.apply_delta, city_name, delta.base_hash,
+            {category: getattr(delta.upsert, category) for category in ("activities", "restaurants", "hotels")},
+            {category: getattr(delta.remove, category) for category in ("activities", "restaurants", "hotels")}
+        )
+    except KeyError:
+        return FastJSONResponse(status_code=404, content={"success": False, "error": "Catalogue not found", "data": None})
+    except CatalogConflict as e:
+        return FastJSONResponse(status_code=409, content={
+            "success": False, "error": str(e), "data": {"content_hash": e.current_hash}
+        })
+    return {"success": True, "error": None, "data": meta}
+
+
+@app.post("/api/recommendations/stream", tags=["Recommendations"])
+async def stream_travel_recommendations(
+    request: TravelPreferencesRequest,
+    authenticated: bool = Depends(verify_api_key)
+):
+    """
+    Streaming variant of /api/recommendations (Server-Sent Events)
+    
+    Emits a `day` event with each DaySchedule as soon as Gemini has produced it,
+    then a final `summary` event with `tour_info` and `summary`
+    (or an `error` event if generation failed or exceeded STREAM_TIMEOUT).
+    A `: connected` comment is sent as soon as the request is admitted.
+    """
+    user_input, user_prefs, places_data, destination_city = prepare_generation_inputs(request)
+    # Slot admission lấy ở đây: quá tải thì trả 429/503 trước khi gửi header. Slot được trả
+    # đúng một lần khi stream kết thúc, lỗi, quá hạn hoặc client ngắt kết nối.
+    await generation_admission.acquire()
+    started = time.monotonic()
+    deadline = started + settings.STREAM_TIMEOUT
+    released = False
+    events = stream_final_tour_json(
+        user_input,
+        user_prefs,
+        destination_name=destination_city,
+        places_data=places_data,
+        planner=request.planner,
+        admitted=True
+    )
+
+    async def finish():
+        nonlocal released
+        await events.aclose()
+        if not released:
+            released = True
+            generation_admission.release(time.monotonic() - started)
+
+    async def event_stream():
+        try:
+            # Header và comment keep-alive đi ngay, không chờ Gemini sinh xong ngày đầu tiên
+            yield ": connected\n\n"
+            while True:
+                try:
+                    kind, payload = await asyncio.wait_for(events.__anext__(),
+                                                           timeout=max(deadline - time.monotonic(), 0))
+                except StopAsyncIteration:
+                    break
+                if kind == "day":
+                    yield _sse_event("day", payload)
+                elif "error" in payload:
+                    yield _sse_event("error", {"success": False, "error": payload["error"]})
+                else:
+                    data = build_response_data(payload, request.current_day)
+                    yield _sse_event("summary", {
+                        "success": True,
+                        "tour_info": data["tour_info"],
+                        "summary": data["summary"]
+                    })
+        except asyncio.TimeoutError:
+            yield _sse_event("error", {
+                "success": False, "error": f"Stream timed out after {settings.STREAM_TIMEOUT:g}s"
+            })
+        except Exception as e:
+            print(f"Error in stream_travel_recommendations: {e}")
+            yield _sse_event("error", {"success": False, "error": f"Internal server error: {str(e)}"})
+        finally:
+            await finish()
+
+    stream = event_stream()
+
+    async def close_stream():
+        # Chạy cả khi client ngắt kết nối giữa chừng hoặc trước khi stream bắt đầu
+        await stream.aclose()
+        await finish()
+
+    return StreamingResponse(
+        stream,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(close_stream)
+    )
+
+async def run_recommendation_job(request_json: str, set_stage) -> dict:
+    """Runner của job "recommendations": như /api/recommendations, báo stage qua set_stage"""
+    request = TravelPreferencesRequest.model_validate_json(request_json)
+    user_input, user_prefs, places_data, destination_city = prepare_generation_inputs(request)
+    await set_stage("generating")
+    result = await build_final_tour_json_async(
+        user_input,
+        user_prefs,
+        destination_name=destination_city,
+        places_data=places_data,
+        planner=request.planner
+    )
+    if "error" in result:
+        return {"success": False, "error": result["error"], "data": None}
+    await set_stage("formatting")
+    return {"success": True, "error": None, "data": build_response_data(result, request.current_day)}
+
+
+job_manager.register("recommendations", run_recommendation_job)
+
+
+@app.post("/api/jobs/recommendations", status_code=202, tags=["Jobs"])
+async def submit_recommendation_job(
+    request: RecommendationJobRequest,
+    authenticated: bool = Depends(verify_api_key)
+):
+    """
+    Submit an itinerary generation job
+    
+    Returns a job id immediately; poll GET /api/jobs/{job_id} or pass callback_url
+    to receive the finished job (same body as the GET) as a webhook.
+    """
+    try:
+        job = await job_manager.submit(
+            "recommendations",
+            request.model_dump_json(exclude={"callback_url"}),
+            callback_url=request.callback_url
         )
+    except CallbackRejected as e:
+        return FastJSONResponse(status_code=400, content={"success": False, "error": str(e), "data": None})
+    job["status_url"] = f"/api/jobs/{job['job_id']}"
+    return FastJSONResponse(status_code=202, content={"success": True, "error": None, "data": job})
+
+
+@app.get("/api/jobs/{job_id}", tags=["Jobs"])
+async def get_job(job_id: str, authenticated: bool = Depends(verify_api_key)):
+    """
+    Job status: queued / running (stage, progress) / succeeded / failed
+    
+    `result` holds the same body as the synchronous endpoint once the job is finished.
+    """
+    job = await job_manager.get(job_id)
+    if job is None:
+        return FastJSONResponse(status_code=404, content={"success": False, "error": "Job not found", "data": None})
+    return {"success": True, "error": None, "data": job}
+
+
+def flight_ranking(request: FlightSearchRequest) -> Optional[dict]:
+    """Tham số sắp xếp/top-N/phân trang cho flight.rank_flights, None nếu client không yêu cầu"""
+    ranking = {
+        "sort_by": request.sort_by,
+        "top_per_airline": request.top_per_airline,
+        "limit": request.limit,
+        "cursor": request.cursor,
+    }
+    if all(value is None for value in ranking.values()):
+        return None
+    # Cursor chỉ dùng được cho đúng lượt tìm đã tạo ra nó (tuyến, ngày đi/về, số khách)
+    ranking["search"] = flight.cursor_search(request.departure_city, request.arrival_city,
+                                             request.departure_date, request.return_date, request.adults)
+    return ranking
+
+
+def _parse_flight_date(value: str, field: str) -> date:
+    """Ngày YYYY-MM-DD của request tìm chuyến bay; ValueError (-> 400) nếu sai định dạng"""
+    try:
+        return datetime.strptime(value.strip(), "%Y-%m-%d").date()
+    except (AttributeError, ValueError):
+        raise ValueError(f"{field} must be a date in YYYY-MM-DD format, got {value!r}")
+
 
 @app.post("/api/flight-search", tags=["Flight Search"])
 async def flight_search(request: FlightSearchRequest, authenticated: bool = Depends(verify_api_key)):
@@ -225,25 +695,81 @@ async def flight_search(request: FlightSearchRequest, authenticated: bool = Depe
     Search for flights
     """
     try:
-        data = flight.information_flight(request.departure_city, request.arrival_city, request.departure_date)
-        return JSONResponse(
-            status_code=200,
-            content={"success": True, "data": data}
+        departure_day = _parse_flight_date(request.departure_date, "departure_date")
+        return_day = _parse_flight_date(request.return_date, "return_date") if request.return_date else None
+    except ValueError as e:
+        return FastJSONResponse(status_code=400, content={"success": False, "error": str(e), "data": None})
+    if return_day is not None and return_day < departure_day:
+        return FastJSONResponse(
+            status_code=400,
+            content={"success": False, "error": "return_date must not be before departure_date", "data": None}
         )
+    # Dạng chuẩn YYYY-MM-DD cho các bước sau (khoá cache/coalescing so sánh theo chuỗi)
+    request.departure_date = departure_day.isoformat()
+    request.return_date = return_day.isoformat() if return_day else None
+
+    try:
+
+        content = {"success": True}
+        ranking = flight_ranking(request)
+        round_trip = None
+        if request.return_date:
+            # Khứ hồi: chiều về (và chiều đi) tìm song song với lượt tìm chính
+            round_trip = asyncio.ensure_future(flight.round_trip_search_async(
+                request.departure_city, request.arrival_city, request.departure_date,
+                request.return_date, request.adults
+            ))
+        try:
+            if request.flex_days:
+                # Tìm linh hoạt: data vẫn là chuyến bay của ngày được chọn, kèm lịch giá từng ngày
+                result = await flight.flexible_date_search_async(
+                    request.departure_city, request.arrival_city, request.departure_date,
+                    min(request.flex_days, settings.FLIGHT_FLEX_MAX_DAYS), request.adults, ranking
+                )
+                content.update(data=result["flights"], calendar=result["calendar"],
+                               cheapest_date=result["cheapest_date"])
+            else:
+                # Khứ hồi: chiều đi dùng chung lời gọi Amadeus với round_trip (cache/coalescing)
+                result = await flight.information_flight_async(
+                    request.departure_city, request.arrival_city, request.departure_date, request.adults, ranking
+                )
+                content["data"] = result["flights"]
+            if result["pagination"] is not None:
+                content["pagination"] = result["pagination"]
+            if round_trip is not None:
+                trip = await round_trip
+                # data là chiều đi (như tìm một chiều), round_trip chứa chiều về và các cặp đi/về
+                content["round_trip"] = {"return_date": request.return_date, **trip}
+        finally:
+            if round_trip is not None and not round_trip.done():
+                round_trip.cancel()
+        return FastJSONResponse(status_code=200, content=content)
+    except flight.InvalidCursor as e:
+        return FastJSONResponse(status_code=400, content={"success": False, "error": str(e), "data": None})
     except Exception as e:
         print(f"Error in flight_search: {e}")
         import traceback
         traceback.print_exc()
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=500,
             content={"success": False, "error": f"Internal server error: {str(e)}", "data": None}
         )
 
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request, exc: AdmissionRejected):
+    """Quá tải: 429 (hàng đợi đầy) / 503 (không kịp deadline) kèm Retry-After"""
+    return FastJSONResponse(
+        status_code=exc.status_code,
+        content={"success": False, "error": str(exc), "data": None},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
 # Exception handler
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
     """Global exception handler"""
-    return JSONResponse(
+    return FastJSONResponse(
         status_code=500,
         content={
             "success": False,
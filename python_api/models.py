@@ -2,7 +2,7 @@
 Data models and schemas for the Travel API
 """
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional, Dict, Any, Union
+from typing import List, Optional, Dict, Any, Literal, Union
 from datetime import datetime
 
 class UserTourInfo:
@@ -71,6 +71,41 @@ class TravelPreferencesRequest(BaseModel):
     disliked_hotels: Optional[List[PlaceData]] = Field(default=[], description="Disliked hotel IDs")
     liked_transport: Optional[List[str]] = Field(default=[], description="Liked transport modes")
     disliked_transport: Optional[List[str]] = Field(default=[], description="Disliked transport modes")
+    
+    # "gemini" (AI) hoặc "local" (deterministic planner, trả về ngay); None = DEFAULT_PLANNER
+    planner: Optional[str] = Field(default=None, description="Itinerary planner: gemini or local")
+
+
+class RecommendationJobRequest(TravelPreferencesRequest):
+    """Request for an asynchronous itinerary job (/api/jobs/recommendations)"""
+    callback_url: Optional[str] = Field(default=None, description="Webhook URL receiving the finished job (POST, JSON)")
+
+class BatchRecommendationRequest(BaseModel):
+    """Request for many itineraries at once (/api/recommendations/batch)"""
+    items: List[TravelPreferencesRequest] = Field(..., min_length=1, description="Itinerary requests, processed concurrently")
+    
+    # Catalogue dùng chung: item không tự gửi activities/restaurants/hotels sẽ dùng bộ này
+    activities: Optional[List[PlaceData]] = Field(default=[], description="Shared activities for items without their own")
+    restaurants: Optional[List[PlaceData]] = Field(default=[], description="Shared restaurants for items without their own")
+    hotels: Optional[List[PlaceData]] = Field(default=[], description="Shared hotels for items without their own")
+
+
+class BatchItemResult(BaseModel):
+    """Result of one batch item: same shape as TravelRecommendationResponse plus its index"""
+    index: int
+    success: bool
+    error: Optional[str] = None
+    status_code: int = 200
+    retry_after: Optional[int] = None
+    data: Optional[Dict[str, Any]] = None
+
+
+class BatchRecommendationResponse(BaseModel):
+    """Response model for batch recommendations"""
+    success: bool
+    error: Optional[str] = None
+    results: List[BatchItemResult] = []
+    summary: Optional[Dict[str, Any]] = None
 
 
 class Activity(BaseModel):
@@ -132,12 +167,16 @@ class HealthCheckResponse(BaseModel):
 
 
 class CitySearchRequest(BaseModel):
-    """Request for city search by name"""
+    """Request for city search by name (places come from the server-side catalogue)"""
+    model_config = ConfigDict(populate_by_name=True)
+    
     city_name: str = Field(..., description="City name to search")
     guest_count: int = Field(default=1, ge=1, le=20)
     duration_days: int = Field(default=3, ge=1, le=30)
     target_budget: float = Field(default=1000.0, ge=0)
     user_id: Optional[str] = None
+    current_day: int = Field(default=1, ge=1, le=30)
+    catalog_hash: Optional[str] = Field(default=None, description="Expected catalogue content_hash; 409 if the server has another version")
     
     # User preferences - added to support full preferences
     liked_activities: Optional[List[PlaceData]] = Field(default=[], description="Liked activity IDs")
@@ -146,8 +185,31 @@ class CitySearchRequest(BaseModel):
     disliked_restaurants: Optional[List[PlaceData]] = Field(default=[], description="Disliked restaurant IDs")
     liked_hotels: Optional[List[PlaceData]] = Field(default=[], description="Liked hotel IDs")
     disliked_hotels: Optional[List[PlaceData]] = Field(default=[], description="Disliked hotel IDs")
-    liked_transport: Optional[List[str]] = Field(default=[], description="Liked transport modes")
-    disliked_transport: Optional[List[str]] = Field(default=[], description="Disliked transport modes")
+    liked_transport: Optional[List[str]] = Field(default=[], description="Liked transport modes", alias="liked_transport_modes")
+    disliked_transport: Optional[List[str]] = Field(default=[], description="Disliked transport modes", alias="disliked_transport_modes")
+    
+    planner: Optional[str] = Field(default=None, description="Itinerary planner: gemini or local")
+
+
+class CatalogPlaces(BaseModel):
+    """Places of one city for the catalogue (full upload, or the upsert part of a delta)"""
+    activities: Optional[List[PlaceData]] = Field(default=[], description="Activities")
+    restaurants: Optional[List[PlaceData]] = Field(default=[], description="Restaurants")
+    hotels: Optional[List[PlaceData]] = Field(default=[], description="Hotels")
+
+
+class CatalogRemovals(BaseModel):
+    """Place keys (id, place_id or name) to remove from the catalogue"""
+    activities: Optional[List[str]] = Field(default=[])
+    restaurants: Optional[List[str]] = Field(default=[])
+    hotels: Optional[List[str]] = Field(default=[])
+
+
+class CatalogDeltaRequest(BaseModel):
+    """Partial catalogue update against a known version"""
+    base_hash: str = Field(..., description="content_hash the delta was computed against")
+    upsert: CatalogPlaces = Field(default_factory=CatalogPlaces)
+    remove: CatalogRemovals = Field(default_factory=CatalogRemovals)
 
 class FlightSearchRequest(BaseModel):
     """Request for flight search"""
@@ -155,3 +217,9 @@ class FlightSearchRequest(BaseModel):
     arrival_city: str = Field(..., description="Arrival city")
     departure_date: str = Field(..., description="Departure date")
     return_date: Optional[str] = Field(default=None, description="Return date")
+    adults: int = Field(default=1, ge=1, le=9, description="Number of adult passengers")
+    flex_days: int = Field(default=0, ge=0, description="Flexible dates: also search ±N days around departure_date")
+    sort_by: Optional[Literal["price", "departure", "duration", "stops"]] = Field(default=None, description="Server-side sort key")
+    top_per_airline: Optional[int] = Field(default=None, ge=1, description="Keep only the first N flights of each airline")
+    limit: Optional[int] = Field(default=None, ge=1, le=100, description="Page size")
+    cursor: Optional[str] = Field(default=None, description="next_cursor from the previous page")
@@ -0,0 +1,308 @@
+"""
+Deterministic local itinerary planner (no LLM)
+
+Builds a real day-by-day schedule straight from places_data in a few
+milliseconds. Used when the request asks for planner="local" and as the
+fallback when Gemini fails or times out.
+"""
+import math
+from typing import Optional
+
+import numpy as np
+
+from ingest import PLACE_CATEGORIES, ingest_places
+from models import UserTourInfo
+from spatial import SpatialIndex
+from services import (
+    cluster_center,
+    place_key,
+    place_name_text,
+    score_places,
+    tour_params,
+    PRERANK_BUDGET_SHARE,
+)
+from utils import (
+    haversine_distances,
+    calculate_travel_time,
+    calculate_transport_cost,
+    apply_fallback_distance_and_time,
+)
+
+# Khung giờ mỗi ngày: (loại, nhãn, giờ sớm nhất, giờ muộn nhất để bắt đầu, thời lượng phút)
+DAY_TEMPLATE = [
+    ('meal', 'Breakfast', '07:00', '08:30', 60),
+    ('activity', None, '09:00', '10:30', 90),
+    ('activity', None, '10:30', '11:15', 60),
+    ('meal', 'Lunch', '12:00', '13:00', 60),
+    ('activity', None, '13:30', '15:00', 90),
+    ('rest', 'Rest break', '15:00', '16:30', 30),
+    ('activity', None, '15:30', '17:00', 90),
+    ('meal', 'Dinner', '18:30', '19:30', 60),
+]
+
+# Khoảng cách ước lượng (km) khi chưa biết toạ độ, dùng để chọn place gần
+UNKNOWN_DISTANCE_KM = 3.0
+# Chi phí di chuyển không đáng kể dưới ngưỡng này (cùng địa điểm)
+SAME_PLACE_KM = 0.05
+# Số place gần nhất (qua SpatialIndex) được chấm điểm cho mỗi slot, cộng thêm place liked
+NEAREST_CANDIDATES = 32
+# Điểm trừ cho mỗi km từ vị trí hiện tại
+DISTANCE_PENALTY_PER_KM = 0.05
+
+
+def _minutes(hhmm: str) -> int:
+    hours, minutes = hhmm.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def _hhmm(minutes: int) -> str:
+    minutes = max(0, min(int(minutes), 23 * 60 + 59))
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+class _Candidates:
+    """Một loại place (activities/restaurants) dưới dạng mảng để chọn nhanh"""
+
+    def __init__(self, places: list, scores: np.ndarray, liked: set):
+        self.places = places
+        self.lats = np.array([p.get('latitude') if isinstance(p.get('latitude'), (int, float)) else np.nan
+                              for p in places], dtype=np.float64)
+        self.lons = np.array([p.get('longitude') if isinstance(p.get('longitude'), (int, float)) else np.nan
+                              for p in places], dtype=np.float64)
+        self.prices = np.array([float(p.get('avg_price') or 0) for p in places], dtype=np.float64)
+        self.liked = np.array([place_key(p) in liked for p in places], dtype=bool)
+        self.scores = scores + self.liked
+        self.used = np.zeros(len(places), dtype=bool)
+        self.index = SpatialIndex(self.lats, self.lons, places)
+
+    def pick(self, location: Optional[tuple], max_cost_per_person: float,
+             required: bool = False) -> Optional[int]:
+        """
+        Chọn place tốt nhất còn lại: điểm cao, gần vị trí hiện tại, trong ngân sách.
+        Chỉ chấm điểm NEAREST_CANDIDATES place gần nhất (SpatialIndex), place liked
+        và place thiếu toạ độ. Slot bắt buộc (bữa ăn) được phép lặp lại place đã dùng
+        và chọn place rẻ nhất khi không có gì vừa ngân sách; slot không bắt buộc thì bỏ qua.
+        """
+        if not self.places:
+            return None
+        available = ~self.used
+        if not available.any():
+            if not required:
+                return None
+            available = np.ones(len(self.places), dtype=bool)
+
+        pool = available & (self.prices <= max_cost_per_person)
+        if not pool.any():
+            if not required:
+                return None
+            # Không có gì vừa ngân sách: chọn rẻ nhất thay vì điểm cao nhất
+            index = int(np.argmin(np.where(available, self.prices, np.inf)))
+            self.used[index] = True
+            return index
+
+        if location is None:
+            ids = np.flatnonzero(pool)
+            value = self.scores[ids]
+        else:
+            nearest = self.index.nearest(location[0], location[1], k=NEAREST_CANDIDATES, mask=pool)
+            near_ids = np.array([i for i, _ in nearest], dtype=np.int64)
+            chosen = np.zeros(len(self.places), dtype=bool)
+            chosen[near_ids] = True
+            extra = np.flatnonzero(pool & (self.liked | ~self.index.located) & ~chosen)
+            distances = np.full(len(extra), UNKNOWN_DISTANCE_KM)
+            located = self.index.located[extra]
+            if located.any():
+                distances[located] = haversine_distances(location[0], location[1],
+                                                         self.lats[extra[located]], self.lons[extra[located]])
+            ids = np.concatenate([near_ids, extra])
+            distances = np.concatenate([[d for _, d in nearest], distances])
+            value = self.scores[ids] - DISTANCE_PENALTY_PER_KM * distances
+        index = int(ids[int(np.argmax(value))])
+        self.used[index] = True
+        return index
+
+    def location(self, index: int) -> Optional[tuple]:
+        if np.isnan(self.lats[index]) or np.isnan(self.lons[index]):
+            return None
+        return float(self.lats[index]), float(self.lons[index])
+
+
+def _transport_mode(distance_km: float, user_prefs: dict) -> str:
+    """Chọn phương tiện: ưu tiên liked, không bao giờ dùng disliked, mặc định taxi"""
+    liked = [m.lower() for m in user_prefs.get('liked_transport') or [] if isinstance(m, str) and m]
+    disliked = {m.lower() for m in user_prefs.get('disliked_transport') or [] if isinstance(m, str) and m}
+    if liked:
+        return liked[0]
+    preferred = ['walk'] if distance_km < 0.8 else []
+    for mode in preferred + ['taxi', 'grab', 'bus', 'metro', 'walk']:
+        if mode not in disliked:
+            return mode
+    return 'taxi'
+
+
+def _transfer(start: int, origin, destination, user_prefs: dict) -> dict:
+    known = origin is not None and destination is not None
+    distance = float(haversine_distances(origin[0], origin[1], [destination[0]], [destination[1]])[0]) \
+        if known else UNKNOWN_DISTANCE_KM
+    mode = _transport_mode(distance, user_prefs)
+    transfer = {
+        "start_time": _hhmm(start),
+        "type": "transfer",
+        "place_id": None,
+        "place_name": f"Transfer by {mode.title()}",
+        "description": "Moving to next location",
+        "transport_mode": mode,
+    }
+    if known:
+        transfer["distance_km"] = round(distance, 2)
+        transfer["travel_time_min"] = calculate_travel_time(distance, mode, is_rush_hour=7 * 60 <= start < 9 * 60)
+        transfer["cost"] = calculate_transport_cost(distance, mode)
+    else:
+        apply_fallback_distance_and_time(transfer, user_prefs)
+    transfer["end_time"] = _hhmm(start + transfer["travel_time_min"])
+    return transfer
+
+
+def _place_item(kind: str, start: int, duration: int, place: dict, label: Optional[str], cost: float) -> dict:
+    name = place_name_text(place.get('name')) or 'Unnamed place'
+    return {
+        "start_time": _hhmm(start),
+        "end_time": _hhmm(start + duration),
+        "type": kind,
+        "place_id": place_key(place) or None,
+        "place_name": name,
+        "description": f"{label} at {name}" if label else (place.get('category') or 'Sightseeing'),
+        "transport_mode": None,
+        "distance_km": None,
+        "travel_time_min": None,
+        "cost": round(cost, 2)
+    }
+
+
+def build_local_tour(user_input: UserTourInfo, destination_name: str,
+                     user_prefs: dict = None, places_data: dict = None) -> dict:
+    """
+    Tạo lịch trình hoàn chỉnh bằng thuật toán cục bộ (không gọi Gemini).
+
+    Tôn trọng các rule trong prompt: khung giờ bữa ăn, nghỉ giữa ngày, ngân sách,
+    luôn bỏ place bị dislike, ưu tiên place được like, không lặp place; transfer
+    được tính bằng utils.calculate_travel_time/calculate_transport_cost.
+    """
+    user_prefs = user_prefs or {}
+    places_data = places_data or {}
+    duration, budget, guests = tour_params(user_input)
+    rooms = max(1, math.ceil(guests / 2))
+
+    pools = {}
+    for key in PLACE_CATEGORIES:
+        disliked = {place_key(p) for p in user_prefs.get(f'disliked_{key}') or []} - {''}
+        pools[key] = [p for p in ingest_places(places_data.get(key)) if place_key(p) not in disliked]
+
+    # Hotel: liked trước, sau đó theo điểm với giá mục tiêu mỗi đêm
+    daily_budget = budget / max(duration, 1)
+    hotel = None
+    if pools['hotels']:
+        hotel_scores = score_places(pools['hotels'], daily_budget * PRERANK_BUDGET_SHARE['hotels'] / rooms,
+                                    cluster_center(pools['activities']))
+        liked_hotels = {place_key(p) for p in user_prefs.get('liked_hotels') or []}
+        hotel_scores += np.array([1.0 if place_key(p) in liked_hotels else 0.0 for p in pools['hotels']])
+        hotel = pools['hotels'][int(np.argmax(hotel_scores))]
+    hotel_location = None
+    if hotel and isinstance(hotel.get('latitude'), (int, float)) and isinstance(hotel.get('longitude'), (int, float)):
+        hotel_location = (float(hotel['latitude']), float(hotel['longitude']))
+    center = hotel_location or cluster_center(pools['activities'])
+
+    candidates = {}
+    for key, share in (('activities', 'activities'), ('restaurants', 'restaurants')):
+        liked = {place_key(p) for p in user_prefs.get(f'liked_{key}') or []} - {''}
+        target = daily_budget * PRERANK_BUDGET_SHARE[share] / guests
+        candidates[key] = _Candidates(pools[key], score_places(pools[key], target, center), liked)
+
+    nights = max(1, duration - 1)
+    hotel_night_cost = float(hotel.get('avg_price') or 0) * rooms if hotel else 0.0
+    remaining_budget = budget - hotel_night_cost * nights
+
+    schedule = []
+    total_cost = hotel_night_cost * nights
+    for day_number in range(1, duration + 1):
+        day_allowance = max(remaining_budget, 0) / (duration - day_number + 1)
+        day_spent = 0.0
+        items = []
+        clock = _minutes('07:00')
+        location = hotel_location
+        current_key = place_key(hotel) if hotel else None
+
+        for slot, (kind, label, earliest, latest, length) in enumerate(DAY_TEMPLATE):
+            earliest, latest = _minutes(earliest), _minutes(latest)
+            if kind == 'rest':
+                start = max(clock, earliest)
+                if start <= latest:
+                    items.append({
+                        "start_time": _hhmm(start), "end_time": _hhmm(start + length), "type": "rest",
+                        "place_id": None, "place_name": label, "description": "Free time to rest",
+                        "transport_mode": None, "distance_km": None, "travel_time_min": None, "cost": 0.0
+                    })
+                    clock = start + length
+                continue
+
+            pool = candidates['restaurants' if kind == 'meal' else 'activities']
+            # Ngân sách còn lại của ngày chia đều cho các slot có phí còn lại (theo người)
+            paid_slots_left = sum(1 for k, *_ in DAY_TEMPLATE[slot:] if k != 'rest')
+            per_person_cap = max(day_allowance - day_spent, 0) / paid_slots_left / guests
+            index = pool.pick(location, per_person_cap, required=kind == 'meal')
+            if index is None:
+                continue
+            place = pool.places[index]
+            place_location = pool.location(index)
+
+            transfer = None
+            if items or location is not None:
+                same_place = place_key(place) == current_key or (
+                    location is not None and place_location is not None and
+                    float(haversine_distances(location[0], location[1],
+                                              [place_location[0]], [place_location[1]])[0]) < SAME_PLACE_KM)
+                if not same_place:
+                    transfer = _transfer(clock, location, place_location, user_prefs)
+            arrival = clock + (transfer['travel_time_min'] if transfer else 0)
+            start = max(arrival, earliest)
+            if start > latest and kind == 'activity':
+                # Không kịp trước bữa kế tiếp: trả lại place cho ngày sau
+                pool.used[index] = False
+                continue
+
+            cost = pool.prices[index] * guests
+            if transfer:
+                items.append(transfer)
+                day_spent += transfer['cost']
+            items.append(_place_item(kind, start, length, place, label, cost))
+            day_spent += cost
+            clock = start + length
+            location = place_location
+            current_key = place_key(place)
+
+        if hotel and (day_number < duration or duration == 1):
+            if location is not None or hotel_location is not None:
+                transfer = _transfer(max(clock, _minutes('19:30')), location, hotel_location, user_prefs)
+                items.append(transfer)
+                day_spent += transfer['cost']
+                clock = _minutes(transfer['end_time'])
+            items.append(_place_item('hotel', max(clock, _minutes('20:00')), 30, hotel,
+                                     'Overnight stay', hotel_night_cost))
+
+        remaining_budget -= day_spent
+        total_cost += day_spent
+        schedule.append({"day": day_number, "activities": items})
+
+    return {
+        "tour_id": f"local_{user_input.user_id}_{destination_name}_{duration}days",
+        "user_id": user_input.user_id,
+        "start_city": destination_name,
+        "destination_city": destination_name,
+        "duration_days": duration,
+        "guest_count": guests,
+        "budget": budget,
+        "total_estimated_cost": round(total_cost, 2),
+        "schedule": schedule,
+        "generated_by": "local_planner",
+        "within_budget": total_cost <= budget
+    }
@@ -0,0 +1,153 @@
+"""
+Fast JSON responses and negotiated response compression
+
+- FastJSONResponse: encode bằng orjson nếu đã cài (nhanh hơn nhiều lần json chuẩn với
+  payload lịch trình/chuyến bay lớn), nếu không thì json chuẩn dạng gọn. Kiểu không
+  chuẩn (datetime, numpy, set...) được chuyển thành dạng JSON tương ứng.
+- CompressionMiddleware: nén br (nếu cài brotli) hoặc gzip theo Accept-Encoding cho
+  response một khối lớn hơn ngưỡng; response streaming (SSE) đi thẳng không nén.
+"""
+import gzip
+import json
+from datetime import date, datetime
+from typing import Any
+
+import numpy as np
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson là tuỳ chọn
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from config import settings
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+
+
+def _default(value: Any):
+    """Chuyển các kiểu json không tự encode được"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    return str(value)
+
+
+def dumps(content: Any) -> bytes:
+    """Encode JSON (UTF-8, không escape ký tự tiếng Việt, không khoảng trắng thừa)"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default,
+                            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, ensure_ascii=False, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+def dumps_text(content: Any) -> str:
+    return dumps(content).decode('utf-8')
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse dùng `dumps` ở trên (orjson nếu có)"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def _pick_encoding(accept_encoding: str) -> str | None:
+    accepted = {}
+    for part in accept_encoding.split(','):
+        token, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[token.strip().lower()] = quality
+    if brotli is not None and accepted.get('br', 0) > 0:
+        return 'br'
+    if accepted.get('gzip', 0) > 0:
+        return 'gzip'
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware nén response theo Accept-Encoding (br > gzip).
+
+    Chỉ nén response gửi trong một khối (mọi response JSON), có kích thước
+    >= minimum_size và chưa có Content-Encoding; response streaming như
+    text/event-stream được chuyển tiếp nguyên vẹn để client nhận từng event ngay.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        encoding = _pick_encoding(Headers(scope=scope).get('accept-encoding', ''))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message['type'] == 'http.response.start':
+                headers = Headers(raw=message['headers'])
+                if 'content-encoding' in headers or headers.get('content-type', '').startswith('text/event-stream'):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start_message = message
+                return
+            if message['type'] == 'http.response.body':
+                body = message.get('body', b'')
+                if message.get('more_body', False) or len(body) < self.minimum_size:
+                    # Streaming hoặc quá nhỏ: gửi nguyên vẹn
+                    passthrough = True
+                    await send(start_message)
+                    await send(message)
+                    return
+                compressed = compress(body, encoding)
+                headers = MutableHeaders(raw=start_message['headers'])
+                headers['Content-Encoding'] = encoding
+                headers['Content-Length'] = str(len(compressed))
+                headers.add_vary_header('Accept-Encoding')
+                await send(start_message)
+                await send({'type': 'http.response.body', 'body': compressed})
+                return
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+def install(app):
+    """Gắn CompressionMiddleware theo cấu hình (gọi sau khi tạo app)"""
+    if settings.COMPRESSION_ENABLED:
+        app.add_middleware(CompressionMiddleware, minimum_size=settings.COMPRESSION_MIN_SIZE)
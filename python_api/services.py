@@ -1,19 +1,86 @@
 """
 Business logic and AI services for travel recommendations
 """
+import asyncio
+import contextlib
+import copy
 import json
 import math
-import pandas as pd
+import random
+import re
+import threading
 from datetime import datetime
 from typing import Dict, Any, Optional
-import google.generativeai as genai
+import numpy as np
 
+from cache import TTLCache, canonical_hash
+from concurrency import AdmissionController, AdmissionRejected, SingleFlight
 from config import settings
+from ingest import PLACE_CATEGORIES, ingest_places
 from models import UserTourInfo
+from utils import (
+    haversine_distances,
+    haversine_paired,
+    calculate_travel_times,
+    calculate_transport_costs,
+    apply_fallback_distance_and_time,
+    is_rush_hour,
+)
 
-# Configure Gemini AI
-genai.configure(api_key=settings.GEMINI_API_KEY)
-gemini_model = genai.GenerativeModel(settings.GEMINI_MODEL)
+# Gemini model được tạo khi cần lần đầu (import google.generativeai mất ~1s)
+gemini_model = None
+_gemini_model_lock = threading.Lock()
+
+
+def get_gemini_model():
+    """Configure Gemini AI và trả về GenerativeModel dùng chung (lazy, thread-safe)"""
+    global gemini_model
+    if gemini_model is None:
+        with _gemini_model_lock:
+            if gemini_model is None:
+                import google.generativeai as genai
+                genai.configure(api_key=settings.GEMINI_API_KEY)
+                gemini_model = genai.GenerativeModel(settings.GEMINI_MODEL)
+    return gemini_model
+
+# Admission control: giới hạn số request sinh lịch trình đang chạy/đang chờ trên mỗi
+# worker, quá tải thì từ chối nhanh (429/503) thay vì để mọi request cùng timeout
+generation_admission = AdmissionController(
+    "generation",
+    max_in_flight=settings.ADMISSION_MAX_IN_FLIGHT,
+    max_queue=settings.ADMISSION_MAX_QUEUE,
+    max_wait_seconds=settings.ADMISSION_MAX_WAIT
+)
+
+# Gộp các request sinh lịch trình giống hệt nhau đang chạy đồng thời (cùng cache key)
+itinerary_flights = SingleFlight("itinerary")
+
+# Giới hạn số lời gọi Gemini đồng thời trên mỗi worker; semaphore tạo lười trong event loop
+# đang chạy (như AmadeusAsyncClient._get_http) để không gắn với loop lúc import
+_gemini_slots: Optional[asyncio.Semaphore] = None
+_gemini_slots_loop = None
+
+
+def _get_gemini_slots() -> asyncio.Semaphore:
+    global _gemini_slots, _gemini_slots_loop
+    loop = asyncio.get_running_loop()
+    if _gemini_slots is None or _gemini_slots_loop is not loop:
+        _gemini_slots = asyncio.Semaphore(settings.GEMINI_MAX_CONCURRENCY)
+        _gemini_slots_loop = loop
+    return _gemini_slots
+
+# Cache lịch trình theo hash của input đã chuẩn hoá
+itinerary_cache = TTLCache(
+    "itinerary",
+    ttl_seconds=settings.ITINERARY_CACHE_TTL,
+    max_entries=settings.ITINERARY_CACHE_MAX_ENTRIES,
+    disk_dir=settings.ITINERARY_CACHE_DIR or None,
+    max_disk_entries=settings.ITINERARY_CACHE_DISK_MAX_ENTRIES,
+    max_disk_bytes=settings.ITINERARY_CACHE_DISK_MAX_MB * 1024 * 1024
+)
+
+# Chỉ cache kết quả thật sự do AI tạo ra (không cache fallback)
+CACHEABLE_GENERATORS = {"gemini_ai"}
 
 
 def create_user_tour_info_simple(user_id, start_city_id, destination_city_id, 
@@ -36,6 +103,687 @@ def create_user_tour_info_simple(user_id, start_city_id, destination_city_id,
     })
 
 
+def tour_params(user_input: UserTourInfo):
+    """Chuẩn hoá số ngày, ngân sách, số khách từ UserTourInfo"""
+    duration = int(float(user_input.duration_days)) if user_input.duration_days else 3
+    budget = float(user_input.target_budget) if user_input.target_budget else 1000.0
+    guests = int(float(user_input.guest_count)) if user_input.guest_count else 1
+    return duration, budget, guests
+
+
+def _json_places_section(travel_data: dict, user_prefs: dict) -> str:
+    """Phần AVAILABLE DATA + USER PREFERENCES dạng JSON đầy đủ (encoding cũ)"""
+    return f"""AVAILABLE DATA (Use ONLY these places - all data provided):
+    
+    Activities ({len(travel_data['activities'])} available):
+    {json.dumps(travel_data['activities'], ensure_ascii=False, indent=2)}
+    
+    Restaurants ({len(travel_data['restaurants'])} available):
+    {json.dumps(travel_data['restaurants'], ensure_ascii=False, indent=2)}
+    
+    Hotels ({len(travel_data['hotels'])} available):
+    {json.dumps(travel_data['hotels'], ensure_ascii=False, indent=2)}
+    
+    DATA STRUCTURE NOTES:
+    - Each place may have: id, place_id, name, category, rating, reviews, price, info/description
+    - Use 'id' or 'place_id' as the place identifier in your output
+    - 'price' is already normalized to float (USD)
+    - 'info' contains additional information about the place
+
+    USER PREFERENCES:
+    ✅ LIKED (prioritize these):
+    - Activities: {json.dumps(user_prefs.get("liked_activities", []), ensure_ascii=False)}
+    - Restaurants: {json.dumps(user_prefs.get("liked_restaurants", []), ensure_ascii=False)}
+    - Hotels: {json.dumps(user_prefs.get("liked_hotels", []), ensure_ascii=False)}
+    - Transport Modes: {json.dumps(user_prefs.get("liked_transport_modes", []), ensure_ascii=False)}
+    
+    ❌ DISLIKED (avoid these completely):
+    - Activities: {json.dumps(user_prefs.get("disliked_activities", []), ensure_ascii=False)}
+    - Restaurants: {json.dumps(user_prefs.get("disliked_restaurants", []), ensure_ascii=False)}
+    - Hotels: {json.dumps(user_prefs.get("disliked_hotels", []), ensure_ascii=False)}
+    - Transport Modes: {json.dumps(user_prefs.get("disliked_transport_modes", []), ensure_ascii=False)}
+    """
+
+
+def _json_preference_rules(user_prefs: dict) -> str:
+    return f"""- MUST prioritize liked items: activities{user_prefs.get("liked_activities", [])}, restaurants{user_prefs.get("liked_restaurants", [])}, hotels{user_prefs.get("liked_hotels", [])}, transport{user_prefs.get("liked_transport_modes", [])}
+    - MUST avoid disliked items: activities{user_prefs.get("disliked_activities", [])}, restaurants{user_prefs.get("disliked_restaurants", [])}, hotels{user_prefs.get("disliked_hotels", [])}, transport{user_prefs.get("disliked_transport_modes", [])}
+    """
+
+
+def estimate_prompt_tokens(text: str) -> int:
+    """Ước lượng số token của prompt (~4 ký tự/token), dùng để log và benchmark"""
+    return max(1, len(text) // 4)
+
+
+def place_name_text(name) -> str:
+    if isinstance(name, dict):
+        return str(name.get('text') or '')
+    return str(name or '')
+
+
+def _is_blank(value) -> bool:
+    return value is None or value == '' or (isinstance(value, float) and math.isnan(value))
+
+
+def _cell(value) -> str:
+    """Giá trị một ô trong bảng compact: bỏ ký tự phân cách, số gọn"""
+    if _is_blank(value):
+        return ''
+    if isinstance(value, float):
+        return f"{value:.5f}".rstrip('0').rstrip('.')
+    return str(value).replace('|', '/').replace('\n', ' ').strip()
+
+
+# Cột được đưa vào bảng compact (tên cột trong prompt, key trong place dict)
+COMPACT_COLUMNS = [
+    ('name', 'name'),
+    ('category', 'category'),
+    ('rating', 'rating'),
+    ('reviews', 'reviews'),
+    ('price', 'avg_price'),
+    ('lat', 'latitude'),
+    ('lon', 'longitude'),
+]
+
+
+def encode_places_compact(travel_data: dict, user_prefs: dict) -> dict:
+    """
+    Encode places dạng bảng header + rows với id ngắn (A1, R1, H1...).
+
+    Chỉ giữ các cột có ít nhất một giá trị, bỏ field null; liked/disliked chỉ
+    tham chiếu bằng id ngắn. Trả về dict gồm places_section, preference_rules
+    và id_map (id ngắn -> id gốc) để map lại place_id trong output của Gemini.
+    """
+    id_map = {}
+    lookup = {}
+    sections = []
+    categories = [('activities', 'A', 'Activities'), ('restaurants', 'R', 'Restaurants'), ('hotels', 'H', 'Hotels')]
+    for key, prefix, title in categories:
+        places = list(travel_data.get(key) or [])
+        # Place được like nhưng không có trong danh sách vẫn cần id để tham chiếu
+        known = {str(p.get('id') or p.get('place_id')) for p in places if isinstance(p, dict)}
+        for pref in user_prefs.get(f'liked_{key}') or []:
+            if isinstance(pref, dict) and str(pref.get('id') or pref.get('place_id')) not in known:
+                places.append(pref)
+                known.add(str(pref.get('id') or pref.get('place_id')))
+
+        columns = [(label, field) for label, field in COMPACT_COLUMNS
+                   if any(isinstance(p, dict) and not _is_blank(p.get(field)) for p in places)]
+        rows = []
+        for index, place in enumerate(places, start=1):
+            if not isinstance(place, dict):
+                continue
+            short_id = f"{prefix}{index}"
+            original_id = place.get('id') or place.get('place_id') or short_id
+            id_map[short_id] = original_id
+            lookup[(key, str(original_id))] = short_id
+            values = [place_name_text(place.get(field)) if field == 'name' else place.get(field)
+                      for _, field in columns]
+            rows.append('|'.join([short_id] + [_cell(v) for v in values]))
+
+        header = '|'.join(['id'] + [label for label, _ in columns])
+        sections.append(f"{title} ({len(rows)} available):\n{header}\n" + '\n'.join(rows))
+
+    def _refs(key: str, pref_key: str) -> str:
+        refs = []
+        for pref in user_prefs.get(pref_key) or []:
+            if isinstance(pref, dict):
+                short_id = lookup.get((key, str(pref.get('id') or pref.get('place_id') or '')))
+                if short_id:
+                    refs.append(short_id)
+            elif pref:
+                refs.append(str(pref))
+        return ','.join(refs) or 'none'
+
+    liked_transport = user_prefs.get('liked_transport') or user_prefs.get('liked_transport_modes') or []
+    disliked_transport = user_prefs.get('disliked_transport') or user_prefs.get('disliked_transport_modes') or []
+    places_section = "AVAILABLE DATA (Use ONLY these places; one row per place, columns separated by '|', price in USD):\n\n"
+    places_section += '\n\n'.join(sections)
+    preference_rules = (
+        f"- MUST prioritize liked items: activities[{_refs('activities', 'liked_activities')}], "
+        f"restaurants[{_refs('restaurants', 'liked_restaurants')}], hotels[{_refs('hotels', 'liked_hotels')}], "
+        f"transport[{','.join(map(str, liked_transport)) or 'none'}]\n"
+        f"- MUST avoid disliked items: activities[{_refs('activities', 'disliked_activities')}], "
+        f"restaurants[{_refs('restaurants', 'disliked_restaurants')}], hotels[{_refs('hotels', 'disliked_hotels')}], "
+        f"transport[{','.join(map(str, disliked_transport)) or 'none'}]"
+    )
+    return {
+        "places_section": places_section,
+        "preference_rules": preference_rules,
+        "id_map": id_map
+    }
+
+
+# Tỷ lệ ngân sách mỗi ngày dành cho một place của từng loại (để chấm điểm giá)
+PRERANK_BUDGET_SHARE = {'activities': 0.12, 'restaurants': 0.08, 'hotels': 0.4}
+PRERANK_WEIGHTS = {'rating': 0.4, 'reviews': 0.2, 'price': 0.25, 'distance': 0.15}
+
+
+def place_key(place) -> str:
+    if isinstance(place, dict):
+        return str(place.get('id') or place.get('place_id') or '')
+    return str(place or '')
+
+
+def _column(places: list, field: str) -> np.ndarray:
+    """Lấy một field của list place thành mảng float (None/không hợp lệ -> NaN)"""
+    values = np.full(len(places), np.nan, dtype=np.float64)
+    for index, place in enumerate(places):
+        value = place.get(field)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[index] = value
+    return values
+
+
+def cluster_center(places: list):
+    """Tâm (median) của các place có toạ độ, hoặc None"""
+    lats, lons = _column(places, 'latitude'), _column(places, 'longitude')
+    mask = ~np.isnan(lats) & ~np.isnan(lons)
+    if not mask.any():
+        return None
+    return float(np.median(lats[mask])), float(np.median(lons[mask]))
+
+
+def score_places(places: list, price_target: float, center=None) -> np.ndarray:
+    """
+    Chấm điểm toàn bộ places trong một lượt vectorized: rating, số review,
+    độ phù hợp của avg_price với ngân sách, và khoảng cách tới `center`.
+    """
+    if not places:
+        return np.zeros(0)
+    rating = np.nan_to_num(_column(places, 'rating'), nan=0.0)
+    reviews = np.nan_to_num(_column(places, 'reviews'), nan=0.0).clip(min=0)
+    price = np.nan_to_num(_column(places, 'avg_price'), nan=0.0).clip(min=0)
+
+    rating_score = (rating / 5.0).clip(0, 1)
+    max_reviews = reviews.max()
+    review_score = np.log1p(reviews) / np.log1p(max_reviews) if max_reviews > 0 else np.zeros_like(reviews)
+    if price_target > 0:
+        # Trong ngân sách -> 1, vượt ngân sách -> giảm dần theo mức vượt
+        price_score = np.exp(-np.maximum(price - price_target, 0) / price_target)
+    else:
+        price_score = np.where(price > 0, 0.0, 1.0)
+
+    distance_score = np.full(len(places), 0.5)
+    if center is not None:
+        lats, lons = _column(places, 'latitude'), _column(places, 'longitude')
+        mask = ~np.isnan(lats) & ~np.isnan(lons)
+        if mask.any():
+            distances = haversine_distances(center[0], center[1], lats[mask], lons[mask])
+            distance_score[mask] = 1.0 / (1.0 + distances / 5.0)
+
+    return (PRERANK_WEIGHTS['rating'] * rating_score +
+            PRERANK_WEIGHTS['reviews'] * review_score +
+            PRERANK_WEIGHTS['price'] * price_score +
+            PRERANK_WEIGHTS['distance'] * distance_score)
+
+
+def _top_k(places: list, scores: np.ndarray, k: int, pinned: set) -> list:
+    """Giữ k place điểm cao nhất (place được like luôn được giữ), sắp theo điểm giảm dần"""
+    k = min(int(k), len(places))
+    if k <= 0:
+        return []
+    boosted = scores.copy()
+    for index, place in enumerate(places):
+        if place_key(place) in pinned:
+            boosted[index] = np.inf
+    if k == len(places):
+        order = np.argsort(-boosted, kind='stable')
+        return [places[i] for i in order]
+    top = np.argpartition(-boosted, k - 1)[:k]
+    top = top[np.argsort(-boosted[top], kind='stable')]
+    return [places[i] for i in top]
+
+
+def prerank_places(travel_data: dict, user_prefs: dict, duration: int, budget: float, guests: int) -> dict:
+    """
+    Lọc trước các place trước khi đưa vào prompt: bỏ place bị dislike, chấm điểm
+    vectorized rồi chỉ giữ top-K mỗi loại (K tỉ lệ theo số ngày).
+    """
+    duration = max(1, duration)
+    guests = max(1, guests)
+    rooms = max(1, (guests + 1) // 2)
+    daily_budget = budget / duration
+    limits = {
+        'activities': settings.PRERANK_ACTIVITIES_PER_DAY * duration,
+        'restaurants': settings.PRERANK_RESTAURANTS_PER_DAY * duration,
+        'hotels': settings.PRERANK_MAX_HOTELS,
+    }
+    price_targets = {
+        'activities': daily_budget * PRERANK_BUDGET_SHARE['activities'] / guests,
+        'restaurants': daily_budget * PRERANK_BUDGET_SHARE['restaurants'] / guests,
+        'hotels': daily_budget * PRERANK_BUDGET_SHARE['hotels'] / rooms,
+    }
+
+    # Hotels được chấm theo khoảng cách tới cụm activities, còn lại theo cụm hotels
+    hotel_center = cluster_center(travel_data.get('hotels') or [])
+    activity_center = cluster_center(travel_data.get('activities') or [])
+    centers = {'activities': hotel_center, 'restaurants': hotel_center, 'hotels': activity_center}
+
+    ranked = {}
+    for key in ('activities', 'restaurants', 'hotels'):
+        disliked = {place_key(p) for p in user_prefs.get(f'disliked_{key}') or []} - {''}
+        liked = {place_key(p) for p in user_prefs.get(f'liked_{key}') or []} - {''}
+        places = [p for p in travel_data.get(key) or []
+                  if isinstance(p, dict) and place_key(p) not in disliked]
+        scores = score_places(places, price_targets[key], centers[key])
+        ranked[key] = _top_k(places, scores, limits[key], liked)
+
+    print(f"🎯 Pre-ranked places: " + ", ".join(
+        f"{key} {len(travel_data.get(key) or [])}→{len(ranked[key])}" for key in ranked))
+    return ranked
+
+
+def _prepare_itinerary_context(user_input: UserTourInfo, destination_name: str,
+                               user_prefs: dict, places_data: dict) -> dict:
+    """
+    Chuẩn bị dữ liệu và prompt cho Gemini (dùng chung cho đường sync và async)
+
+    Returns:
+        Dict chứa prompt và các thông số tour, hoặc {"error": ...} nếu thiếu places_data
+    """
+    # Sử dụng dữ liệu được truyền vào (không query database)
+    if not places_data or not all(k in places_data for k in ['activities', 'restaurants', 'hotels']):
+        return {
+            "error": "Missing required places_data. Please provide activities, restaurants, and hotels."
+        }
+
+    # Chuẩn hoá một lượt (gần như no-op nếu places_data đã qua ingest ở main.py)
+    travel_data = {key: ingest_places(places_data[key]) for key in PLACE_CATEGORIES}
+
+    # Xử lý user preferences
+    if user_prefs is None:
+        user_prefs = {}
+    
+    # Chuẩn bị thông số
+    duration, budget, guests = tour_params(user_input)
+
+    # Chỉ đưa top-K place mỗi loại vào prompt để kích thước prompt không phụ thuộc số place
+    if settings.PRERANK_ENABLED:
+        travel_data = prerank_places(travel_data, user_prefs, duration, budget, guests)
+    
+    # Chuẩn bị phần dữ liệu places + preferences theo kiểu encoding đã cấu hình
+    id_map = None
+    if settings.PROMPT_ENCODING == "compact":
+        encoded = encode_places_compact(travel_data, user_prefs)
+        places_section = encoded["places_section"]
+        preference_rules = encoded["preference_rules"]
+        place_id_rule = "For place_id: use the short id from the first column of the tables (e.g. A1, R2, H1)"
+        id_map = encoded["id_map"]
+    else:
+        places_section = _json_places_section(travel_data, user_prefs)
+        preference_rules = _json_preference_rules(user_prefs)
+        place_id_rule = "For place_id: use the 'id' or 'place_id' field from the provided places data"
+
+    # Tạo prompt chi tiết cho Gemini với tất cả available data và preferences
+    prompt = f"""
+    You are an expert AI travel planner. Create a detailed, personalized {duration}-day itinerary for {destination_name}.
+
+    {places_section}
+
+    BUDGET BREAKDOWN:
+    💰 Total Budget: ${budget} USD for {guests} guests for {duration} days
+    💰 Daily Budget: ${budget/duration:.2f} USD per day
+
+    PLANNING RULES & CONSTRAINTS:
+    
+    1) BUDGET CONSTRAINTS:
+    - TOTAL budget is ${budget} USD for {guests} guests for {duration} days
+    - Stay WITHIN budget - do not exceed ${budget/duration:.2f} USD per day
+    - Consider cost per person: ${budget/guests:.2f} USD per person total
+    - Hotels: Calculate cost as (price_per_night × nights × rooms_needed)
+    - Activities/Restaurants: Calculate as (price × guests)
+    - Transport: Calculate based on actual distance and mode
+    
+    2) GROUP SIZE CONSIDERATIONS:
+    - Planning for {guests} people total
+    - Hotel rooms needed: {max(1, (guests + 1) // 2)} rooms (assuming 2 people per room max)
+    - Restaurant reservations: for {guests} people
+    - Activity bookings: for {guests} people
+    
+    3) DURATION PLANNING:
+    - Trip length: {duration} days
+    - Plan activities for each day from day 1 to day {duration}
+    - Each day should have 6-10 activities including meals, transfers, and rest
+    - Balance busy and relaxed periods
+    
+    4) USER PREFERENCES PRIORITY:
+    {preference_rules}
+    
+    5) MEALS & REST:
+    - Breakfast 07:00–08:30, Lunch 12:00–13:00, Dinner 18:30–19:30
+    - At least one 15–30 min rest period per day
+    - Respect restaurant opening hours if available
+    
+    6) LOCATION CONTEXT:
+    - Destination: {destination_name} (City ID: {user_input.destination_city_id})
+    - Use activities, restaurants, and hotels from the provided data
+    - Consider local culture, weather, and typical tourist patterns
+    
+    7) TRANSPORT & MOVEMENT:
+    - Transport mode selection rules (PRIORITY ORDER):
+        1) FIRST: Check user preferences - ALWAYS use liked_transport_modes when possible
+        2) NEVER use any transport modes in disliked_transport_modes  
+        3) Default fallback: "Taxi" if no preferences specified
+    - If user has liked_transport_modes{user_prefs.get("liked_transport", [])}, use ONLY those modes for all transfers
+    - If user has disliked_transport_modes{user_prefs.get("disliked_transport", [])}, NEVER use those modes under any circumstances
+    - Insert explicit "transfer" items between consecutive non-transfer activities
+    - For transfer items: set distance_km and travel_time_min to null (or reasonable estimates if you want)
+    - Estimate reasonable time duration for transfer activities (10-30 minutes typically)
+    - Use simple transport modes: "taxi", "bus", "walk", "bike", "metro", etc.
+    - Set transfer cost to 0 or a small estimated amount (will be adjusted if needed)
+
+    8) COST CALCULATION RULES:
+    - Activities/Restaurants: price_per_person × guests, or use price_total if available
+    - Hotels: price_per_night × rooms_needed × nights (rooms_needed = ceil(guests / 2))
+    - Transport: Will be calculated in post-processing based on real distance
+    - Stay within the total budget of ${budget} USD for all {guests} guests
+    - Track cumulative costs to avoid budget overrun
+
+    9) SELECTION PRIORITY RULES:
+    - HARD RULES: Completely exclude all disliked items (activities, restaurants, hotels, transport modes)
+    - PREFERENCE RULES: Prioritize liked items when feasible within budget
+    - FALLBACK RULES: If no preferences, select by: highest rating → lowest cost → best location
+    - QUALITY CONTROL: Ensure variety in activities, avoid repeating same restaurants/activities
+    - Min rating threshold: 3.5 (relax to 3.0 if limited options)
+    - No duplicate places within the same day
+    - If impossible to meet budget, still output plan with "within_budget": false and "reason"
+
+    10) OUTPUT REQUIREMENTS:
+    - Activities sorted by start_time for each day
+    - Insert transfer between consecutive non-transfer items  
+    - Each day should be realistic and achievable
+    - Provide clear time allocations for all activities
+    - Times in HH:MM (24h format)
+    - No time overlaps between activities
+    - Ensure logical flow and realistic timing
+    - {place_id_rule}
+
+    Return ONLY valid JSON in this EXACT format:
+    {{
+        "destination": "{destination_name}",
+        "guests": {guests},
+        "duration_days": {duration},
+        "within_budget": true,
+        "total_cost": 0,
+        "cost_breakdown": {{"hotels": 0, "activities": 0, "meals": 0, "transport_estimate": 0}},
+        "days": [
+            {{
+                "day": 1,
+                "activities": [
+                    {{
+                        "start_time": "09:00",
+                        "end_time": "10:30",
+                        "type": "activity",
+                        "place_id": "activity_123",
+                        "place_name": "Example Activity Name",
+                        "description": "Activity description or info",
+                        "transport_mode": null,
+                        "distance_km": null,
+                        "travel_time_min": null,
+                        "cost": 15.00
+                    }},
+                    {{
+                        "start_time": "10:30",
+                        "end_time": "10:50",
+                        "type": "transfer",
+                        "place_id": null,
+                        "place_name": "Transfer by Taxi",
+                        "description": "Moving to next location",
+                        "transport_mode": "taxi",
+                        "distance_km": 2.5,
+                        "travel_time_min": 20,
+                        "cost": 5.00
+                    }},
+                    {{
+                        "start_time": "12:00",
+                        "end_time": "13:00",
+                        "type": "meal",
+                        "place_id": "restaurant_456",
+                        "place_name": "Example Restaurant",
+                        "description": "Lunch at local restaurant",
+                        "transport_mode": null,
+                        "distance_km": null,
+                        "travel_time_min": null,
+                        "cost": 25.00
+                    }}
+                ]
+            }}
+        ]
+    }}
+    
+    IMPORTANT: Use ONLY the places provided in the AVAILABLE DATA above. Do not invent new places.
+    """
+
+    return {
+        "prompt": prompt,
+        "prompt_tokens_estimate": estimate_prompt_tokens(prompt),
+        "id_map": id_map,
+        "user_input": user_input,
+        "places_data": places_data,
+        "coordinates": place_coordinates(places_data),
+        "destination_name": destination_name,
+        "user_prefs": user_prefs,
+        "duration": duration,
+        "budget": budget,
+        "guests": guests
+    }
+
+
+def _restore_place_id(activity: dict, id_map: dict):
+    """Thay place_id dạng id ngắn trong output của Gemini bằng id gốc"""
+    place_id = activity.get('place_id')
+    if isinstance(place_id, str) and place_id.strip().upper() in id_map:
+        activity['place_id'] = str(id_map[place_id.strip().upper()])
+
+
+def _log_prompt_usage(response, context: dict):
+    """In số token prompt ước lượng và số token thực tế Gemini báo về"""
+    usage = getattr(response, 'usage_metadata', None)
+    actual = getattr(usage, 'prompt_token_count', None) if usage else None
+    print(f"🧮 Prompt tokens ({settings.PROMPT_ENCODING}): ~{context['prompt_tokens_estimate']} estimated, {actual} actual")
+
+
+def _load_itinerary_json(result_text: str) -> dict:
+    """Bỏ markdown formatting quanh JSON của Gemini rồi parse (raise JSONDecodeError nếu lỗi)"""
+    result_text = result_text.strip()
+    # Loại bỏ markdown formatting
+    if result_text.startswith('```json'):
+        result_text = result_text[7:]
+    if result_text.endswith('```'):
+        result_text = result_text[:-3]
+    return json.loads(result_text.strip())
+
+
+def _postprocess_day(day_data: dict, context: dict) -> dict:
+    """
+    Hậu xử lý một ngày do Gemini sinh ra: map id ngắn về id gốc, áp dụng
+    transport preferences; trả về dict theo format DaySchedule của API
+    """
+    user_prefs = context["user_prefs"]
+    id_map = context.get("id_map")
+    # Post-process transport preferences
+    # Lọc chỉ các chuỗi hợp lệ trước khi lower
+    liked_modes = [m.lower() for m in user_prefs.get('liked_transport', []) if isinstance(m, str) and m]
+    disliked_modes = [m.lower() for m in user_prefs.get('disliked_transport', []) if isinstance(m, str) and m]
+
+    activities = day_data.get('activities', [])
+    for activity in activities:
+        # Map id ngắn của compact encoding (A1, R2...) về id gốc
+        if id_map:
+            _restore_place_id(activity, id_map)
+
+        if activity.get('type') == 'transfer':
+            # Lấy mode hiện tại an toàn (None -> 'taxi')
+            raw_mode = activity.get('transport_mode')
+            current_mode = (raw_mode if isinstance(raw_mode, str) and raw_mode else 'taxi').lower()
+            
+            if liked_modes:
+                activity['transport_mode'] = random.choice(liked_modes)
+            elif current_mode in disliked_modes:
+                activity['transport_mode'] = 'taxi'
+            elif not current_mode:
+                activity['transport_mode'] = 'taxi'
+
+    return {
+        "day": day_data.get('day', 1),
+        "activities": activities
+    }
+
+
+def place_coordinates(places_data: dict) -> dict:
+    """Map id của place (cả 'id' và 'place_id') -> (lat, lon) cho các place có toạ độ hợp lệ"""
+    coordinates = {}
+    for key in ('activities', 'restaurants', 'hotels'):
+        for place in (places_data or {}).get(key) or []:
+            if not isinstance(place, dict):
+                continue
+            try:
+                lat, lon = float(place.get('latitude')), float(place.get('longitude'))
+            except (TypeError, ValueError):
+                continue
+            if not (math.isfinite(lat) and math.isfinite(lon)):
+                continue
+            for field in ('id', 'place_id'):
+                if place.get(field) not in (None, ''):
+                    coordinates[str(place[field])] = (lat, lon)
+    return coordinates
+
+
+def first_hotel_id(schedule: list) -> Optional[str]:
+    for day in schedule:
+        for item in day.get('activities', []):
+            if item.get('type') == 'hotel' and item.get('place_id'):
+                return str(item['place_id'])
+    return None
+
+
+def _transfer_endpoint(items: list, index: int, step: int, hotel_id: Optional[str]) -> Optional[str]:
+    """
+    place_id của item gần nhất trước (step=-1) / sau (step=1) transfer, bỏ qua transfer và rest.
+    Chỉ khi không còn item nào ở phía đó (đầu/cuối ngày) mới dùng khách sạn; item có nhưng
+    thiếu place_id thì trả None để transfer dùng khoảng cách ước lượng.
+    """
+    index += step
+    while 0 <= index < len(items):
+        item = items[index]
+        if item.get('type') not in ('transfer', 'rest'):
+            return str(item['place_id']) if item.get('place_id') else None
+        index += step
+    return hotel_id
+
+
+def _clock_minutes(value) -> Optional[int]:
+    try:
+        hours, minutes = str(value).strip().split(':')[:2]
+        return int(hours) * 60 + int(minutes)
+    except (TypeError, ValueError):
+        return None
+
+
+def compute_transfers(schedule: list, coordinates: dict, user_prefs: dict = None,
+                      hotel_id: Optional[str] = None) -> int:
+    """
+    Tính distance_km / travel_time_min / cost thật cho mọi transfer của lịch trình từ
+    toạ độ của item liền trước và liền sau (đầu/cuối ngày: khách sạn), trong một lượt
+    vectorized. Transfer không xác định được toạ độ dùng apply_fallback_distance_and_time.
+
+    Returns:
+        Số transfer được tính từ toạ độ thật
+    """
+    user_prefs = user_prefs or {}
+    hotel_id = hotel_id or first_hotel_id(schedule)
+    pending = []
+    for day in schedule:
+        items = day.get('activities', [])
+        for index, item in enumerate(items):
+            if item.get('type') != 'transfer':
+                continue
+            mode = item.get('transport_mode')
+            item['transport_mode'] = mode.lower() if isinstance(mode, str) and mode else 'taxi'
+            origin = coordinates.get(_transfer_endpoint(items, index, -1, hotel_id))
+            destination = coordinates.get(_transfer_endpoint(items, index, 1, hotel_id))
+            if origin and destination:
+                pending.append((items, index, origin, destination))
+            else:
+                apply_fallback_distance_and_time(item, user_prefs)
+
+    if pending:
+        origins = np.array([p[2] for p in pending])
+        destinations = np.array([p[3] for p in pending])
+        distances = haversine_paired(origins[:, 0], origins[:, 1], destinations[:, 0], destinations[:, 1])
+        modes = [items[index]['transport_mode'] for items, index, _, _ in pending]
+        rush = [is_rush_hour(items[index].get('start_time')) for items, index, _, _ in pending]
+        times = calculate_travel_times(distances, modes, rush)
+        costs = calculate_transport_costs(distances, modes)
+        for (items, index, _, _), distance, minutes, cost in zip(pending, distances, times, costs):
+            item = items[index]
+            item['distance_km'] = round(float(distance), 2)
+            item['travel_time_min'] = int(minutes)
+            item['cost'] = float(cost)
+            # Cập nhật end_time nếu không chồng lên item kế tiếp
+            start = _clock_minutes(item.get('start_time'))
+            following = _clock_minutes(items[index + 1].get('start_time')) if index + 1 < len(items) else None
+            if start is not None and (following is None or start + int(minutes) <= following):
+                end = min(start + int(minutes), 23 * 60 + 59)
+                item['end_time'] = f"{end // 60:02d}:{end % 60:02d}"
+    return len(pending)
+
+
+def schedule_total_cost(schedule: list) -> float:
+    """Tổng cost của mọi item trong lịch trình"""
+    total = 0.0
+    for day in schedule:
+        for item in day.get('activities', []):
+            try:
+                total += float(item.get('cost') or 0)
+            except (TypeError, ValueError):
+                continue
+    return round(total, 2)
+
+
+def _build_tour_result(context: dict, schedule: list, total_cost: float, within_budget: bool = True) -> dict:
+    """Gói schedule đã hậu xử lý thành kết quả tour theo format API"""
+    user_input = context["user_input"]
+    destination_name = context["destination_name"]
+    return {
+        "tour_id": f"gemini_{user_input.user_id}_{destination_name}_{context['duration']}days",
+        "user_id": user_input.user_id,
+        "start_city": destination_name,
+        "destination_city": destination_name,
+        "duration_days": context["duration"],
+        "guest_count": context["guests"],
+        "budget": context["budget"],
+        "total_estimated_cost": total_cost,
+        "schedule": schedule,
+        "generated_by": "gemini_ai",
+        "within_budget": within_budget
+    }
+
+
+def _parse_gemini_itinerary(result_text: str, context: dict) -> dict:
+    """Parse JSON trả về từ Gemini và chuyển sang format API"""
+    # Parse JSON response
+    try:
+        itinerary_data = _load_itinerary_json(result_text)
+        print(itinerary_data)
+
+        schedule = [_postprocess_day(day_data, context) for day_data in itinerary_data.get('days', [])]
+        
+        # Transfer và tổng chi phí tính lại từ toạ độ thật thay vì tin số Gemini ước lượng
+        computed = compute_transfers(schedule, context["coordinates"], context["user_prefs"])
+        print(f"\n📏 Transfers computed from coordinates: {computed}")
+        total_cost = schedule_total_cost(schedule)
+        
+        return _build_tour_result(context, schedule, total_cost, total_cost <= context["budget"])
+        
+    except json.JSONDecodeError as e:
+        print(f"Error parsing Gemini response: {e}")
+        return fallback_tour(context["user_input"], context["destination_name"], context["user_prefs"],
+                             context["places_data"], reason=f"Unparsable Gemini response: {e}")
+
+
 def get_gemini_travel_recommendations(user_input: UserTourInfo, destination_name: str = "Unknown", 
                                      user_prefs: dict = None, places_data: dict = None):
     """
@@ -47,294 +795,322 @@ def get_gemini_travel_recommendations(user_input: UserTourInfo, destination_name
         user_prefs: User preferences (liked/disliked)
         places_data: Dict chứa activities, restaurants, hotels (REQUIRED)
     """
+    duration, budget, guests = tour_params(user_input)
     try:
-        # Sử dụng dữ liệu được truyền vào (không query database)
-        if not places_data or not all(k in places_data for k in ['activities', 'restaurants', 'hotels']):
-            return {
-                "error": "Missing required places_data. Please provide activities, restaurants, and hotels."
-            }
-        activities = places_data['activities']
-        restaurants = places_data['restaurants']
-        hotels = places_data['hotels']
-        
-        # Print places info
-        data_source = "PROVIDED DATA" if places_data else "DATABASE"
-
-        # Convert price to float if it's a string
-        def normalize_price(place):
-            if isinstance(place, dict) and 'avg_price' in place:
-                price_val = place.get('avg_price', '0')
-                if isinstance(price_val, str):
-                    # Remove $ and any non-numeric characters except . and -
-                    price_str = price_val.replace('$', '').replace(',', '').strip()
-                    try:
-                        place['avg_price'] = float(price_str) if price_str and price_str != '-' else 0.0
-                    except ValueError:
-                        place['avg_price'] = 0.0
-                elif price_val is None:
-                    place['avg_price'] = 0.0
-            return place
-        
-        # Normalize prices in all places
-        activities = [normalize_price(a) for a in activities]
-        restaurants = [normalize_price(r) for r in restaurants]
-        hotels = [normalize_price(h) for h in hotels]
-        
-        # Chuyển đổi dữ liệu thành DataFrame
-        activities_df = pd.DataFrame(activities) if activities else pd.DataFrame()
-        restaurants_df = pd.DataFrame(restaurants) if restaurants else pd.DataFrame()
-        hotels_df = pd.DataFrame(hotels) if hotels else pd.DataFrame()
-        
-        # Tạo travel_data tổng hợp
-        travel_data = {
-            "activities": activities_df.to_dict('records') if not activities_df.empty else [],
-            "restaurants": restaurants_df.to_dict('records') if not restaurants_df.empty else [],
-            "hotels": hotels_df.to_dict('records') if not hotels_df.empty else []
+        context = _prepare_itinerary_context(user_input, destination_name, user_prefs, places_data)
+        if "error" in context:
+            return context
+
+        # Gọi Gemini API
+        response = get_gemini_model().generate_content(
+            context["prompt"], request_options={"timeout": settings.GEMINI_TIMEOUT}
+        )
+        _log_prompt_usage(response, context)
+        return _parse_gemini_itinerary(response.text, context)
+    
+    except Exception as e:
+        print(f"Error in get_gemini_travel_recommendations: {e}")
+        return fallback_tour(user_input, destination_name, user_prefs, places_data, reason=str(e))
+
+
+async def get_gemini_travel_recommendations_async(user_input: UserTourInfo, destination_name: str = "Unknown",
+                                                  user_prefs: dict = None, places_data: dict = None):
+    """
+    Phiên bản async của get_gemini_travel_recommendations
+
+    Dùng client async của Gemini nên không chặn event loop trong lúc chờ phản hồi.
+    Số lời gọi Gemini đồng thời trên mỗi worker bị giới hạn bởi GEMINI_MAX_CONCURRENCY.
+    """
+    duration, budget, guests = tour_params(user_input)
+    try:
+        # Pre-rank + dựng prompt tốn CPU với catalogue lớn: chạy trong thread
+        context = await asyncio.to_thread(_prepare_itinerary_context, user_input, destination_name,
+                                          user_prefs, places_data)
+        if "error" in context:
+            return context
+
+        # Gọi Gemini API (async), chờ slot nếu đã đủ số lời gọi đồng thời
+        async with _get_gemini_slots():
+            response = await asyncio.wait_for(
+                get_gemini_model().generate_content_async(context["prompt"]),
+                timeout=settings.GEMINI_TIMEOUT
+            )
+        _log_prompt_usage(response, context)
+        return await asyncio.to_thread(_parse_gemini_itinerary, response.text, context)
+
+    except asyncio.TimeoutError:
+        print(f"Gemini timed out after {settings.GEMINI_TIMEOUT}s, using local planner")
+        return await asyncio.to_thread(fallback_tour, user_input, destination_name, user_prefs, places_data,
+                                       reason=f"Gemini timed out after {settings.GEMINI_TIMEOUT}s")
+    except Exception as e:
+        print(f"Error in get_gemini_travel_recommendations_async: {e}")
+        return await asyncio.to_thread(fallback_tour, user_input, destination_name, user_prefs, places_data,
+                                       reason=str(e))
+
+
+
+
+def _split_by_bearing(places: list, sizes: list, center) -> list:
+    """
+    Chia places thành len(sizes) nhóm liên tiếp theo hướng (bearing) quanh `center`,
+    để mỗi nhóm ngày tập trung vào một khu vực; place không có toạ độ chia đều cuối cùng.
+    """
+    located, unlocated = [], []
+    lats, lons = _column(places, 'latitude'), _column(places, 'longitude')
+    if center is not None:
+        bearings = np.arctan2((lons - center[1]) * math.cos(math.radians(center[0])), lats - center[0])
+        for index in np.argsort(bearings, kind='stable'):
+            (unlocated if np.isnan(bearings[index]) else located).append(places[index])
+    else:
+        unlocated = list(places)
+
+    total = sum(sizes)
+    groups, start = [], 0
+    for part, size in enumerate(sizes):
+        end = start + round(len(located) * size / total) if part < len(sizes) - 1 else len(located)
+        groups.append(located[start:end] + unlocated[part::len(sizes)])
+        start = end
+    return groups
+
+
+def _unranked_places(travel_data: dict, user_prefs: dict) -> dict:
+    """Như prerank_places nhưng không chấm điểm/cắt top-K: bỏ place bị dislike, đưa place được like lên đầu"""
+    ranked = {}
+    for key in PLACE_CATEGORIES:
+        disliked = {place_key(p) for p in user_prefs.get(f'disliked_{key}') or []} - {''}
+        liked = {place_key(p) for p in user_prefs.get(f'liked_{key}') or []} - {''}
+        places = [p for p in travel_data.get(key) or []
+                  if isinstance(p, dict) and place_key(p) not in disliked]
+        ranked[key] = sorted(places, key=lambda p: place_key(p) not in liked)
+    return ranked
+
+
+def plan_day_chunks(user_input: UserTourInfo, user_prefs: dict, places_data: dict) -> list:
+    """
+    Bước lập kế hoạch rẻ (không gọi LLM) cho chế độ fan-out: chọn một hotel cho cả
+    chuyến, chia activities/restaurants và ngân sách cho từng nhóm ngày.
+
+    Returns:
+        List các chunk: day_offset, user_input, user_prefs, places_data riêng của nhóm ngày
+    """
+    duration, budget, guests = tour_params(user_input)
+    travel_data = {key: ingest_places(places_data.get(key)) for key in PLACE_CATEGORIES}
+    if settings.PRERANK_ENABLED:
+        ranked = prerank_places(travel_data, user_prefs, duration, budget, guests)
+    else:
+        ranked = _unranked_places(travel_data, user_prefs)
+
+    # Cả chuyến ở một hotel: hotel được like hoặc điểm cao nhất (tắt pre-rank: hotel đầu tiên)
+    hotels = ranked['hotels'][:1]
+    center = cluster_center(hotels) or cluster_center(ranked['activities'])
+
+    per_chunk = max(1, settings.FANOUT_DAYS_PER_CHUNK)
+    sizes = [min(per_chunk, duration - offset) for offset in range(0, duration, per_chunk)]
+    activity_groups = _split_by_bearing(ranked['activities'], sizes, center)
+    restaurant_groups = _split_by_bearing(ranked['restaurants'], sizes, center)
+
+    chunks = []
+    day_offset = 0
+    for index, days in enumerate(sizes):
+        chunk_places = {
+            'activities': activity_groups[index],
+            'restaurants': restaurant_groups[index],
+            'hotels': hotels
         }
+        chunk_keys = {key: {place_key(p) for p in chunk_places[key]} for key in chunk_places}
+        chunk_prefs = dict(user_prefs)
+        for key in ('activities', 'restaurants', 'hotels'):
+            # Chỉ giữ liked place thuộc nhóm này để không bị lặp sang các nhóm khác
+            chunk_prefs[f'liked_{key}'] = [p for p in user_prefs.get(f'liked_{key}') or []
+                                           if place_key(p) in chunk_keys[key]]
+        chunks.append({
+            "day_offset": day_offset,
+            "days": days,
+            "user_input": create_user_tour_info_simple(
+                user_input.user_id, user_input.start_city_id, user_input.destination_city_id,
+                guest_count=guests, duration_days=days, target_budget=budget * days / duration
+            ),
+            "user_prefs": chunk_prefs,
+            "places_data": chunk_places
+        })
+        day_offset += days
+    return chunks
 
-        # Xử lý user preferences
-        if user_prefs is None:
-            user_prefs = {}
-        
-        # Chuẩn bị thông số
-        duration = int(float(user_input.duration_days)) if user_input.duration_days else 3
-        budget = float(user_input.target_budget) if user_input.target_budget else 1000.0
-        guests = int(float(user_input.guest_count)) if user_input.guest_count else 1
-        
-        # Tạo prompt chi tiết cho Gemini với tất cả available data và preferences
-        prompt = f"""
-        You are an expert AI travel planner. Create a detailed, personalized {duration}-day itinerary for {destination_name}.
 
-        AVAILABLE DATA (Use ONLY these places - all data provided):
-        
-        Activities ({len(travel_data['activities'])} available):
-        {json.dumps(travel_data['activities'], ensure_ascii=False, indent=2)}
-        
-        Restaurants ({len(travel_data['restaurants'])} available):
-        {json.dumps(travel_data['restaurants'], ensure_ascii=False, indent=2)}
-        
-        Hotels ({len(travel_data['hotels'])} available):
-        {json.dumps(travel_data['hotels'], ensure_ascii=False, indent=2)}
-        
-        DATA STRUCTURE NOTES:
-        - Each place may have: id, place_id, name, category, rating, reviews, price, info/description
-        - Use 'id' or 'place_id' as the place identifier in your output
-        - 'price' is already normalized to float (USD)
-        - 'info' contains additional information about the place
-
-        USER PREFERENCES:
-        ✅ LIKED (prioritize these):
-        - Activities: {json.dumps(user_prefs.get("liked_activities", []), ensure_ascii=False)}
-        - Restaurants: {json.dumps(user_prefs.get("liked_restaurants", []), ensure_ascii=False)}
-        - Hotels: {json.dumps(user_prefs.get("liked_hotels", []), ensure_ascii=False)}
-        - Transport Modes: {json.dumps(user_prefs.get("liked_transport_modes", []), ensure_ascii=False)}
-        
-        ❌ DISLIKED (avoid these completely):
-        - Activities: {json.dumps(user_prefs.get("disliked_activities", []), ensure_ascii=False)}
-        - Restaurants: {json.dumps(user_prefs.get("disliked_restaurants", []), ensure_ascii=False)}
-        - Hotels: {json.dumps(user_prefs.get("disliked_hotels", []), ensure_ascii=False)}
-        - Transport Modes: {json.dumps(user_prefs.get("disliked_transport_modes", []), ensure_ascii=False)}
+def _remove_cross_day_duplicates(schedule: list) -> list:
+    """
+    Bỏ các place (activity/meal) đã xuất hiện ở ngày trước đó hoặc trước đó trong ngày,
+    gộp các transfer liền nhau sau khi bỏ. Transfer cuối ngày chỉ bị bỏ khi nó dẫn tới
+    một place vừa bị bỏ (transfer về khách sạn được giữ). Trả về list item đã bỏ.
+    """
+    seen = set()
+    removed = []
+    for day in schedule:
+        kept = []
+        # Transfer cuối cùng trong kept đang dẫn tới một place đã bị bỏ
+        target_removed = False
+        for item in day.get('activities', []):
+            place_id = item.get('place_id')
+            if place_id and item.get('type') not in ('transfer', 'hotel'):
+                if str(place_id) in seen:
+                    removed.append(item)
+                    if kept and kept[-1].get('type') == 'transfer':
+                        target_removed = True
+                    continue
+                seen.add(str(place_id))
+            if item.get('type') == 'transfer' and kept and kept[-1].get('type') == 'transfer':
+                # Transfer giữ lại thay cho transfer này, dẫn tới đích của transfer này
+                removed.append(item)
+                target_removed = False
+                continue
+            kept.append(item)
+            target_removed = False
+        if target_removed:
+            removed.append(kept.pop())
+        day['activities'] = kept
+    return removed
 
-        BUDGET BREAKDOWN:
-        💰 Total Budget: ${budget} USD for {guests} guests for {duration} days
-        💰 Daily Budget: ${budget/duration:.2f} USD per day
 
-        PLANNING RULES & CONSTRAINTS:
-        
-        1) BUDGET CONSTRAINTS:
-        - TOTAL budget is ${budget} USD for {guests} guests for {duration} days
-        - Stay WITHIN budget - do not exceed ${budget/duration:.2f} USD per day
-        - Consider cost per person: ${budget/guests:.2f} USD per person total
-        - Hotels: Calculate cost as (price_per_night × nights × rooms_needed)
-        - Activities/Restaurants: Calculate as (price × guests)
-        - Transport: Calculate based on actual distance and mode
-        
-        2) GROUP SIZE CONSIDERATIONS:
-        - Planning for {guests} people total
-        - Hotel rooms needed: {max(1, (guests + 1) // 2)} rooms (assuming 2 people per room max)
-        - Restaurant reservations: for {guests} people
-        - Activity bookings: for {guests} people
-        
-        3) DURATION PLANNING:
-        - Trip length: {duration} days
-        - Plan activities for each day from day 1 to day {duration}
-        - Each day should have 6-10 activities including meals, transfers, and rest
-        - Balance busy and relaxed periods
-        
-        4) USER PREFERENCES PRIORITY:
-        - MUST prioritize liked items: activities{user_prefs.get("liked_activities", [])}, restaurants{user_prefs.get("liked_restaurants", [])}, hotels{user_prefs.get("liked_hotels", [])}, transport{user_prefs.get("liked_transport_modes", [])}
-        - MUST avoid disliked items: activities{user_prefs.get("disliked_activities", [])}, restaurants{user_prefs.get("disliked_restaurants", [])}, hotels{user_prefs.get("disliked_hotels", [])}, transport{user_prefs.get("disliked_transport_modes", [])}
-        
-        5) MEALS & REST:
-        - Breakfast 07:00–08:30, Lunch 12:00–13:00, Dinner 18:30–19:30
-        - At least one 15–30 min rest period per day
-        - Respect restaurant opening hours if available
-        
-        6) LOCATION CONTEXT:
-        - Destination: {destination_name} (City ID: {user_input.destination_city_id})
-        - Use activities, restaurants, and hotels from the provided data
-        - Consider local culture, weather, and typical tourist patterns
-        
-        7) TRANSPORT & MOVEMENT:
-        - Transport mode selection rules (PRIORITY ORDER):
-            1) FIRST: Check user preferences - ALWAYS use liked_transport_modes when possible
-            2) NEVER use any transport modes in disliked_transport_modes  
-            3) Default fallback: "Taxi" if no preferences specified
-        - If user has liked_transport_modes{user_prefs.get("liked_transport", [])}, use ONLY those modes for all transfers
-        - If user has disliked_transport_modes{user_prefs.get("disliked_transport", [])}, NEVER use those modes under any circumstances
-        - Insert explicit "transfer" items between consecutive non-transfer activities
-        - For transfer items: set distance_km and travel_time_min to null (or reasonable estimates if you want)
-        - Estimate reasonable time duration for transfer activities (10-30 minutes typically)
-        - Use simple transport modes: "taxi", "bus", "walk", "bike", "metro", etc.
-        - Set transfer cost to 0 or a small estimated amount (will be adjusted if needed)
-
-        8) COST CALCULATION RULES:
-        - Activities/Restaurants: price_per_person × guests, or use price_total if available
-        - Hotels: price_per_night × rooms_needed × nights (rooms_needed = ceil(guests / 2))
-        - Transport: Will be calculated in post-processing based on real distance
-        - Stay within the total budget of ${budget} USD for all {guests} guests
-        - Track cumulative costs to avoid budget overrun
-
-        9) SELECTION PRIORITY RULES:
-        - HARD RULES: Completely exclude all disliked items (activities, restaurants, hotels, transport modes)
-        - PREFERENCE RULES: Prioritize liked items when feasible within budget
-        - FALLBACK RULES: If no preferences, select by: highest rating → lowest cost → best location
-        - QUALITY CONTROL: Ensure variety in activities, avoid repeating same restaurants/activities
-        - Min rating threshold: 3.5 (relax to 3.0 if limited options)
-        - No duplicate places within the same day
-        - If impossible to meet budget, still output plan with "within_budget": false and "reason"
-
-        10) OUTPUT REQUIREMENTS:
-        - Activities sorted by start_time for each day
-        - Insert transfer between consecutive non-transfer items  
-        - Each day should be realistic and achievable
-        - Provide clear time allocations for all activities
-        - Times in HH:MM (24h format)
-        - No time overlaps between activities
-        - Ensure logical flow and realistic timing
-        - For place_id: use the 'id' or 'place_id' field from the provided places data
-
-        Return ONLY valid JSON in this EXACT format:
-        {{
-            "destination": "{destination_name}",
-            "guests": {guests},
-            "duration_days": {duration},
-            "within_budget": true,
-            "total_cost": 0,
-            "cost_breakdown": {{"hotels": 0, "activities": 0, "meals": 0, "transport_estimate": 0}},
-            "days": [
-                {{
-                    "day": 1,
-                    "activities": [
-                        {{
-                            "start_time": "09:00",
-                            "end_time": "10:30",
-                            "type": "activity",
-                            "place_id": "activity_123",
-                            "place_name": "Example Activity Name",
-                            "description": "Activity description or info",
-                            "transport_mode": null,
-                            "distance_km": null,
-                            "travel_time_min": null,
-                            "cost": 15.00
-                        }},
-                        {{
-                            "start_time": "10:30",
-                            "end_time": "10:50",
-                            "type": "transfer",
-                            "place_id": null,
-                            "place_name": "Transfer by Taxi",
-                            "description": "Moving to next location",
-                            "transport_mode": "taxi",
-                            "distance_km": 2.5,
-                            "travel_time_min": 20,
-                            "cost": 5.00
-                        }},
-                        {{
-                            "start_time": "12:00",
-                            "end_time": "13:00",
-                            "type": "meal",
-                            "place_id": "restaurant_456",
-                            "place_name": "Example Restaurant",
-                            "description": "Lunch at local restaurant",
-                            "transport_mode": null,
-                            "distance_km": null,
-                            "travel_time_min": null,
-                            "cost": 25.00
-                        }}
-                    ]
-                }}
-            ]
-        }}
-        
-        IMPORTANT: Use ONLY the places provided in the AVAILABLE DATA above. Do not invent new places.
-        """
-        
-        # Gọi Gemini API
-        response = gemini_model.generate_content(prompt)
-        result_text = response.text.strip()
-        # Parse JSON response
+async def generate_fanout_tour(user_input: UserTourInfo, destination_name: str,
+                               user_prefs: dict = None, places_data: dict = None) -> dict:
+    """
+    Chế độ fan-out cho chuyến dài: lập kế hoạch cục bộ, gọi Gemini song song cho
+    từng nhóm FANOUT_DAYS_PER_CHUNK ngày rồi ghép lại thành một schedule.
+    Một nhóm lỗi chỉ làm hỏng các ngày của nhóm đó.
+    """
+    user_prefs = user_prefs or {}
+    duration, budget, guests = tour_params(user_input)
+    chunks = await asyncio.to_thread(plan_day_chunks, user_input, user_prefs, places_data)
+    print(f"🔀 Fan-out: {duration} days -> {len(chunks)} parallel Gemini calls")
+
+    results = await asyncio.gather(*(
+        get_gemini_travel_recommendations_async(chunk["user_input"], destination_name,
+                                                chunk["user_prefs"], chunk["places_data"])
+        for chunk in chunks
+    ))
+
+    schedule = []
+    failed = 0
+    for chunk, result in zip(chunks, results):
+        if result.get("generated_by") != "gemini_ai":
+            failed += 1
+        days = sorted(result.get("schedule", []), key=lambda d: d.get("day", 0))[:chunk["days"]]
+        for local_day, day in enumerate(days, start=1):
+            day["day"] = chunk["day_offset"] + local_day
+            schedule.append(day)
+
+    if failed == len(chunks):
+        return await asyncio.to_thread(fallback_tour, user_input, destination_name, user_prefs, places_data,
+                                       reason="All fan-out Gemini calls failed")
+
+    removed = _remove_cross_day_duplicates(schedule)
+    if removed:
+        print(f"🧹 Removed {len(removed)} cross-day duplicate item(s)")
+    # Ghép nhóm/bỏ trùng làm đổi điểm đầu-cuối của transfer: tính lại trên cả lịch trình
+    compute_transfers(schedule, place_coordinates(places_data), user_prefs)
+    total_cost = schedule_total_cost(schedule)
+
+    return {
+        "tour_id": f"gemini_{user_input.user_id}_{destination_name}_{duration}days",
+        "user_id": user_input.user_id,
+        "start_city": destination_name,
+        "destination_city": destination_name,
+        "duration_days": duration,
+        "guest_count": guests,
+        "budget": budget,
+        "total_estimated_cost": total_cost,
+        "schedule": schedule,
+        "generated_by": "gemini_ai" if not failed else "gemini_ai_partial",
+        "within_budget": total_cost <= budget
+    }
+
+
+class IncrementalDaysParser:
+    """
+    Parser tăng dần cho JSON Gemini đang stream: trả về từng object trong
+    mảng "days" ngay khi object đó được đóng ngoặc, không chờ hết response.
+    """
+
+    _DAYS_KEY = re.compile(r'"days"\s*:\s*\[')
+
+    def __init__(self):
+        self._buffer = ''
+        self._pos = 0
+        self._in_days = False
+        self._done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._day_start = None
+
+    def feed(self, chunk: str) -> list:
+        """Nạp thêm text, trả về list các day dict vừa hoàn chỉnh"""
+        self._buffer += chunk
+        completed = []
+        if self._done:
+            return completed
+        if not self._in_days:
+            match = self._DAYS_KEY.search(self._buffer)
+            if not match:
+                return completed
+            self._in_days = True
+            self._pos = match.end()
+
+        buffer = self._buffer
+        for index in range(self._pos, len(buffer)):
+            char = buffer[index]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+            if char == '"':
+                self._in_string = True
+            elif char in '{[':
+                if self._depth == 0 and char == '{':
+                    self._day_start = index
+                self._depth += 1
+            elif char in '}]':
+                if self._depth == 0 and char == ']':
+                    # Hết mảng days
+                    self._done = True
+                    self._pos = index + 1
+                    return completed
+                self._depth -= 1
+                if self._depth == 0 and self._day_start is not None:
+                    try:
+                        completed.append(json.loads(buffer[self._day_start:index + 1]))
+                    except json.JSONDecodeError as e:
+                        print(f"Skipping unparsable streamed day: {e}")
+                    self._day_start = None
+        self._pos = len(buffer)
+        return completed
+
+
+def fallback_tour(user_input: UserTourInfo, destination_name: str, user_prefs: dict = None,
+                  places_data: dict = None, reason: str = None) -> dict:
+    """
+    Lịch trình thay thế khi Gemini lỗi hoặc timeout: dùng local planner nếu có
+    places_data, nếu không thì fallback tối giản (create_fallback_tour)
+    """
+    duration, budget, guests = tour_params(user_input)
+    if places_data and any(places_data.get(key) for key in ('activities', 'restaurants', 'hotels')):
         try:
-            # Loại bỏ markdown formatting
-            if result_text.startswith('```json'):
-                result_text = result_text[7:]
-            if result_text.endswith('```'):
-                result_text = result_text[:-3]
-            
-            itinerary_data = json.loads(result_text.strip())
-            print(itinerary_data)
-            # Post-process transport preferences
-            # Lọc chỉ các chuỗi hợp lệ trước khi lower
-            liked_modes = [m.lower() for m in user_prefs.get('liked_transport', []) if isinstance(m, str) and m]
-            disliked_modes = [m.lower() for m in user_prefs.get('disliked_transport', []) if isinstance(m, str) and m]
-
-            for day in itinerary_data.get('days', []):
-                for activity in day.get('activities', []):
-                    if activity.get('type') == 'transfer':
-                        # Lấy mode hiện tại an toàn (None -> 'taxi')
-                        raw_mode = activity.get('transport_mode')
-                        current_mode = (raw_mode if isinstance(raw_mode, str) and raw_mode else 'taxi').lower()
-                        
-                        if liked_modes:
-                            import random
-                            activity['transport_mode'] = random.choice(liked_modes)
-                        elif current_mode in disliked_modes:
-                            activity['transport_mode'] = 'taxi'
-                        elif not current_mode:
-                            activity['transport_mode'] = 'taxi'
-            
-            # No database processing - using provided data directly
-            print("\n✨ Using simple tour from provided data (no distance/time calculation)")
-            
-            # Convert to API format
-            schedule = []
-            for day_data in itinerary_data.get('days', []):
-                schedule.append({
-                    "day": day_data.get('day', 1),
-                    "activities": day_data.get('activities', [])
-                })
-            
-            return {
-                "tour_id": f"gemini_{user_input.user_id}_{destination_name}_{duration}days",
-                "user_id": user_input.user_id,
-                "start_city": destination_name,
-                "destination_city": destination_name,
-                "duration_days": duration,
-                "guest_count": guests,
-                "budget": budget,
-                "total_estimated_cost": itinerary_data.get('total_cost', 0.0),
-                "schedule": schedule,
-                "generated_by": "gemini_ai",
-                "within_budget": itinerary_data.get('within_budget', True)
-            }
-            
-        except json.JSONDecodeError as e:
-            print(f"Error parsing Gemini response: {e}")
-            return create_fallback_tour(user_input, destination_name, duration, guests, budget)
-    
-    except Exception as e:
-        print(f"Error in get_gemini_travel_recommendations: {e}")
-        return create_fallback_tour(user_input, destination_name, duration, guests, budget)
+            from planner import build_local_tour
+            result = build_local_tour(user_input, destination_name, user_prefs, places_data)
+            result["fallback_reason"] = reason
+            return result
+        except Exception as e:
+            print(f"Error in local planner fallback: {e}")
+    return create_fallback_tour(user_input, destination_name, duration, guests, budget)
+
+
+def use_local_planner(planner: Optional[str] = None) -> bool:
+    """Request chọn planner="local" (hoặc mặc định cấu hình là local)"""
+    return (planner or settings.DEFAULT_PLANNER).lower() == "local"
 
 
 def create_fallback_tour(user_input, destination_name, duration, guests, budget):
@@ -374,8 +1150,72 @@ def create_fallback_tour(user_input, destination_name, duration, guests, budget)
     }
 
 
+def itinerary_cache_key(user_input: UserTourInfo, user_prefs: dict,
+                        destination_name: str, places_data: dict) -> str:
+    """
+    Hash nội dung của input đã chuẩn hoá (places, prefs, guests, days, budget).
+    Thứ tự các place trong list không ảnh hưởng tới key; user_id không nằm trong key.
+    places_data lấy từ catalogue (có catalog_hash) dùng luôn hash đó thay vì băm từng place.
+    """
+    def _canonical_list(items):
+        return sorted(
+            json.dumps(item, sort_keys=True, ensure_ascii=False, default=str) for item in (items or [])
+        )
+
+    duration, budget, guests = tour_params(user_input)
+    return canonical_hash({
+        "destination": (destination_name or "").strip().lower(),
+        "duration": duration,
+        "guests": guests,
+        "budget": round(budget, 2),
+        "places": (places_data or {}).get("catalog_hash") or {
+            key: _canonical_list((places_data or {}).get(key)) for key in ('activities', 'restaurants', 'hotels')
+        },
+        "prefs": {key: _canonical_list(value) for key, value in sorted((user_prefs or {}).items())}
+    })
+
+
+def _get_cached_tour(cache_key: str, user_input: UserTourInfo):
+    """Lấy lịch trình từ cache và gắn lại user_id/tour_id của request hiện tại"""
+    cached = itinerary_cache.get(cache_key)
+    if cached is None:
+        return None
+    print(f"⚡ Itinerary cache hit ({cache_key[:12]})")
+    return _restamp_tour(cached, user_input)
+
+
+async def _get_cached_tour_async(cache_key: str, user_input: UserTourInfo):
+    """Như _get_cached_tour, đọc tầng đĩa trong thread"""
+    cached = await itinerary_cache.get_async(cache_key)
+    if cached is None:
+        return None
+    print(f"⚡ Itinerary cache hit ({cache_key[:12]})")
+    return _restamp_tour(cached, user_input)
+
+
+def _restamp_tour(tour: dict, user_input: UserTourInfo) -> dict:
+    """Gắn user_id/tour_id của request hiện tại vào lịch trình sinh cho request khác (sửa tại chỗ)"""
+    old_user_id = str(tour.get("user_id"))
+    new_user_id = str(user_input.user_id)
+    tour["user_id"] = user_input.user_id
+    tour["tour_id"] = str(tour.get("tour_id", "")).replace(f"_{old_user_id}_", f"_{new_user_id}_", 1)
+    return tour
+
+
+def _store_cached_tour(cache_key: str, result: dict):
+    if "error" not in result and result.get("generated_by") in CACHEABLE_GENERATORS:
+        itinerary_cache.set(cache_key, result)
+
+
+async def _store_cached_tour_async(cache_key: str, result: dict):
+    """Như _store_cached_tour, ghi tầng đĩa trong thread"""
+    if "error" not in result and result.get("generated_by") in CACHEABLE_GENERATORS:
+        await itinerary_cache.set_async(cache_key, result)
+
+
 def build_final_tour_json(user_input: UserTourInfo, user_prefs: dict = None, 
-                          destination_name: str = None, places_data: dict = None):
+                          destination_name: str = None, places_data: dict = None,
+                          planner: str = None):
     """
     Tạo lịch trình du lịch hoàn chỉnh sử dụng Gemini AI (no database required)
     
@@ -384,6 +1224,7 @@ def build_final_tour_json(user_input: UserTourInfo, user_prefs: dict = None,
         user_prefs: User preferences
         destination_name: Tên thành phố đích (REQUIRED)
         places_data: Dict chứa activities, restaurants, hotels (REQUIRED)
+        planner: "gemini" hoặc "local" (mặc định theo DEFAULT_PLANNER)
     """
     try:
         if not destination_name:
@@ -392,6 +1233,17 @@ def build_final_tour_json(user_input: UserTourInfo, user_prefs: dict = None,
         if not places_data:
             return {"error": "places_data is required"}
         
+        if use_local_planner(planner):
+            from planner import build_local_tour
+            return build_local_tour(user_input, destination_name, user_prefs, places_data)
+        
+        cache_key = None
+        if settings.ITINERARY_CACHE_ENABLED:
+            cache_key = itinerary_cache_key(user_input, user_prefs, destination_name, places_data)
+            cached = _get_cached_tour(cache_key, user_input)
+            if cached is not None:
+                return cached
+        
         # Sử dụng Gemini để tạo lịch trình với places_data
         result = get_gemini_travel_recommendations(
             user_input, 
@@ -400,8 +1252,152 @@ def build_final_tour_json(user_input: UserTourInfo, user_prefs: dict = None,
             places_data
         )
         
+        if cache_key:
+            _store_cached_tour(cache_key, result)
         return result
         
     except Exception as e:
         return {"error": f"An error occurred: {str(e)}"}
 
+
+
+async def build_final_tour_json_async(user_input: UserTourInfo, user_prefs: dict = None,
+                                      destination_name: str = None, places_data: dict = None,
+                                      planner: str = None):
+    """
+    Phiên bản async của build_final_tour_json, dùng trong các endpoint FastAPI
+    để lời gọi Gemini không chặn event loop của worker
+    """
+    try:
+        if not destination_name:
+            return {"error": "destination_name is required"}
+
+        if not places_data:
+            return {"error": "places_data is required"}
+
+        if use_local_planner(planner):
+            from planner import build_local_tour
+            # Local planner thuần CPU: chạy trong thread để không chặn event loop
+            return await asyncio.to_thread(build_local_tour, user_input, destination_name, user_prefs, places_data)
+
+        # Băm toàn bộ place (khi không có catalog_hash) tốn CPU với catalogue lớn: chạy trong thread
+        request_key = await asyncio.to_thread(itinerary_cache_key, user_input, user_prefs, destination_name,
+                                              places_data)
+        if settings.ITINERARY_CACHE_ENABLED:
+            cached = await _get_cached_tour_async(request_key, user_input)
+            if cached is not None:
+                return cached
+
+        async def generate():
+            duration = tour_params(user_input)[0]
+            async with generation_admission.slot():
+                if settings.FANOUT_ENABLED and duration >= settings.FANOUT_MIN_DAYS:
+                    # Chuyến dài: sinh song song từng nhóm ngày
+                    result = await generate_fanout_tour(user_input, destination_name, user_prefs, places_data)
+                else:
+                    result = await get_gemini_travel_recommendations_async(
+                        user_input,
+                        destination_name,
+                        user_prefs,
+                        places_data
+                    )
+            if settings.ITINERARY_CACHE_ENABLED:
+                await _store_cached_tour_async(request_key, result)
+            return result
+
+        if not settings.SINGLEFLIGHT_ENABLED:
+            return await generate()
+        # Request giống hệt đang chạy: chờ chung một lời gọi Gemini, mỗi caller nhận bản sao riêng
+        result = await itinerary_flights.do(request_key, generate)
+        return _restamp_tour(copy.deepcopy(result), user_input)
+
+    except AdmissionRejected:
+        # Quá tải: để endpoint trả 429/503 kèm Retry-After
+        raise
+    except Exception as e:
+        return {"error": f"An error occurred: {str(e)}"}
+
+
+async def stream_final_tour_json(user_input: UserTourInfo, user_prefs: dict = None,
+                                 destination_name: str = None, places_data: dict = None,
+                                 planner: str = None, admitted: bool = False):
+    """
+    Phiên bản streaming của build_final_tour_json (async generator).
+
+    Yield ("day", day_schedule) cho từng ngày ngay khi Gemini sinh xong, cuối cùng
+    yield ("result", result) với lịch trình hoàn chỉnh - cùng format với
+    build_final_tour_json (có key "error" nếu thất bại).
+    admitted=True: caller đã giữ slot generation_admission cho cả stream.
+    """
+    if not destination_name:
+        yield "result", {"error": "destination_name is required"}
+        return
+    if not places_data:
+        yield "result", {"error": "places_data is required"}
+        return
+    if use_local_planner(planner):
+        from planner import build_local_tour
+        result = await asyncio.to_thread(build_local_tour, user_input, destination_name, user_prefs, places_data)
+        for day in result["schedule"]:
+            yield "day", day
+        yield "result", result
+        return
+
+    cache_key = None
+    if settings.ITINERARY_CACHE_ENABLED:
+        cache_key = await asyncio.to_thread(itinerary_cache_key, user_input, user_prefs, destination_name,
+                                            places_data)
+        cached = await _get_cached_tour_async(cache_key, user_input)
+        if cached is not None:
+            for day in cached.get("schedule", []):
+                yield "day", day
+            yield "result", cached
+            return
+
+    # Giữ một slot admission suốt quá trình stream (trả lại khi generator kết thúc/bị đóng)
+    async with (contextlib.nullcontext() if admitted else generation_admission.slot()):
+        streamed = []
+        try:
+            context = await asyncio.to_thread(_prepare_itinerary_context, user_input, destination_name,
+                                              user_prefs, places_data)
+            if "error" in context:
+                yield "result", context
+                return
+
+            parser = IncrementalDaysParser()
+            async with _get_gemini_slots():
+                response = await get_gemini_model().generate_content_async(
+                    context["prompt"], stream=True, request_options={"timeout": settings.GEMINI_TIMEOUT}
+                )
+                async for chunk in response:
+                    for day_data in parser.feed(chunk.text):
+                        day = _postprocess_day(day_data, context)
+                        # Transfer của ngày tính ngay khi ngày về; đầu/cuối ngày dùng khách sạn đã thấy
+                        context["hotel_id"] = context.get("hotel_id") or first_hotel_id([day])
+                        compute_transfers([day], context["coordinates"], context["user_prefs"],
+                                          hotel_id=context["hotel_id"])
+                        streamed.append(day)
+                        yield "day", day
+            _log_prompt_usage(response, context)
+
+        except Exception as e:
+            print(f"Error in stream_final_tour_json: {e}")
+            if streamed:
+                yield "result", {"error": f"Gemini stream interrupted after {len(streamed)} day(s): {e}"}
+                return
+
+        if not streamed:
+            # Không nhận được ngày nào: dùng fallback như đường non-streaming
+            result = await asyncio.to_thread(fallback_tour, user_input, destination_name, user_prefs,
+                                             places_data, reason="Gemini stream returned no days")
+            for day in result["schedule"]:
+                yield "day", day
+            yield "result", result
+            return
+
+        total_cost = schedule_total_cost(streamed)
+        result = _build_tour_result(context, streamed, total_cost, total_cost <= context["budget"])
+
+        if cache_key:
+            await _store_cached_tour_async(cache_key, result)
+        yield "result", result
@@ -0,0 +1,227 @@
+"""
+Spatial index over place coordinates: k-nearest, radius and bounding-box queries
+"""
+import math
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from utils import haversine_distances
+
+EARTH_RADIUS_KM = 6371.0
+# Số điểm trung bình mỗi ô khi tự chọn kích thước ô
+TARGET_POINTS_PER_CELL = 4
+MIN_CELL_KM = 0.05
+MAX_CELL_KM = 50.0
+# Dưới số điểm này quét vectorized toàn bộ nhanh hơn duyệt các vòng ô
+BRUTE_FORCE_MAX_POINTS = 1024
+
+
+class SpatialIndex:
+    """
+    Lưới đều trên toạ độ chiếu equirectangular (km) quanh tâm các điểm.
+
+    Xây một lần cho mỗi request/thành phố (O(N log N)), sau đó mỗi truy vấn chỉ
+    xét các ô lân cận. Khoảng cách trả về là Haversine thật (km). Điểm thiếu
+    toạ độ (None/NaN) không được index. Chỉ số trả về là vị trí trong danh sách
+    gốc (`items[i]`). Phép chiếu phù hợp ở quy mô thành phố/vùng, không xử lý
+    kinh tuyến 180°.
+    """
+
+    def __init__(self, lats, lons, items: Optional[list] = None, cell_km: Optional[float] = None):
+        self.lats = np.asarray(lats, dtype=np.float64).ravel()
+        self.lons = np.asarray(lons, dtype=np.float64).ravel()
+        self.items = items
+        self.located = np.isfinite(self.lats) & np.isfinite(self.lons)
+        ids = np.flatnonzero(self.located)
+        self.size = len(ids)
+
+        if self.size:
+            self._lat0 = float(self.lats[ids].mean())
+            self._lon0 = float(self.lons[ids].mean())
+        else:
+            self._lat0 = self._lon0 = 0.0
+        self._ky = EARTH_RADIUS_KM * math.pi / 180
+        self._kx = self._ky * max(math.cos(math.radians(self._lat0)), 1e-6)
+
+        x, y = self._project(self.lats[ids], self.lons[ids])
+        if cell_km is None:
+            extent = max(float(np.ptp(x)) if self.size else 0.0, float(np.ptp(y)) if self.size else 0.0)
+            cell_km = extent * math.sqrt(TARGET_POINTS_PER_CELL / max(self.size, 1))
+        self.cell_km = float(min(max(cell_km, MIN_CELL_KM), MAX_CELL_KM))
+
+        # Sắp xếp điểm theo ô để mỗi ô là một lát liên tục của self._ids
+        cx = np.floor(x / self.cell_km).astype(np.int64)
+        cy = np.floor(y / self.cell_km).astype(np.int64)
+        order = np.lexsort((cy, cx))
+        self._ids = ids[order]
+        self._cells = {}
+        if self.size:
+            cx, cy = cx[order], cy[order]
+            boundaries = np.flatnonzero((np.diff(cx) != 0) | (np.diff(cy) != 0)) + 1
+            starts = np.concatenate(([0], boundaries))
+            ends = np.concatenate((boundaries, [self.size]))
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                self._cells[(int(cx[start]), int(cy[start]))] = (start, end)
+            self._bounds = (int(cx.min()), int(cx.max()), int(cy.min()), int(cy.max()))
+        else:
+            self._bounds = (0, -1, 0, -1)
+
+    @classmethod
+    def from_places(cls, places: list, cell_km: Optional[float] = None) -> "SpatialIndex":
+        """Xây index từ list dict PlaceData (latitude/longitude)"""
+        lats = np.full(len(places), np.nan)
+        lons = np.full(len(places), np.nan)
+        for index, place in enumerate(places):
+            try:
+                lats[index] = float(place.get('latitude'))
+                lons[index] = float(place.get('longitude'))
+            except (AttributeError, TypeError, ValueError):
+                lats[index] = lons[index] = np.nan
+        return cls(lats, lons, items=places, cell_km=cell_km)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _project(self, lats, lons):
+        return (np.asarray(lons) - self._lon0) * self._kx, (np.asarray(lats) - self._lat0) * self._ky
+
+    def _cell_of(self, lat: float, lon: float) -> Tuple[int, int]:
+        x, y = self._project(lat, lon)
+        return int(math.floor(x / self.cell_km)), int(math.floor(y / self.cell_km))
+
+    def _gather(self, cells) -> np.ndarray:
+        slices = [self._cells[cell] for cell in cells if cell in self._cells]
+        if not slices:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([self._ids[start:end] for start, end in slices])
+
+    def _filter(self, ids: np.ndarray, predicate: Optional[Callable], mask: Optional[np.ndarray]) -> np.ndarray:
+        if mask is not None and len(ids):
+            ids = ids[np.asarray(mask, dtype=bool)[ids]]
+        if predicate is not None and len(ids):
+            items = self.items if self.items is not None else range(len(self.lats))
+            ids = np.array([i for i in ids.tolist() if predicate(items[i])], dtype=np.int64)
+        return ids
+
+    def _distances(self, lat: float, lon: float, ids: np.ndarray) -> np.ndarray:
+        return haversine_distances(lat, lon, self.lats[ids], self.lons[ids])
+
+    def nearest(self, lat: float, lon: float, k: int = 1, predicate: Optional[Callable] = None,
+                mask: Optional[np.ndarray] = None, max_km: Optional[float] = None) -> List[Tuple[int, float]]:
+        """
+        k điểm gần (lat, lon) nhất thoả điều kiện, sắp theo khoảng cách tăng dần.
+
+        Args:
+            predicate: hàm nhận item (hoặc chỉ số nếu không có items) -> bool
+            mask: mảng bool theo chỉ số gốc, lọc vectorized trước predicate
+            max_km: bỏ các điểm xa hơn
+        Returns:
+            List (chỉ số, khoảng cách km)
+        """
+        if not self.size or k <= 0:
+            return []
+        if self.size <= BRUTE_FORCE_MAX_POINTS:
+            return self._brute_nearest(lat, lon, k, predicate, mask, max_km)
+        qx, qy = self._cell_of(lat, lon)
+        min_x, max_x, min_y, max_y = self._bounds
+        # Số vòng tối đa để phủ hết lưới từ ô truy vấn
+        max_ring = max(abs(qx - min_x), abs(qx - max_x), abs(qy - min_y), abs(qy - max_y))
+        found_ids, found_distances = [], []
+
+        ring = 0
+        visited_cells = 0
+        while ring <= max_ring:
+            if ring == 0:
+                cells = [(qx, qy)]
+            else:
+                cells = [(qx + dx, qy + dy) for dx in range(-ring, ring + 1) for dy in (-ring, ring)]
+                cells += [(qx + dx, qy + dy) for dx in (-ring, ring) for dy in range(-ring + 1, ring)]
+            visited_cells += len(cells)
+            if visited_cells > 4 * len(self._cells) + 64:
+                # Vòng quá thưa (điểm truy vấn ở xa hoặc predicate lọc gần hết): quét toàn bộ
+                return self._brute_nearest(lat, lon, k, predicate, mask, max_km)
+
+            ids = self._filter(self._gather(cells), predicate, mask)
+            if len(ids):
+                found_ids.append(ids)
+                found_distances.append(self._distances(lat, lon, ids))
+
+            # Mọi điểm chưa xét cách điểm truy vấn ít nhất ring * cell_km (trừ sai số phép chiếu)
+            reach = ring * self.cell_km * 0.98
+            if max_km is not None and reach > max_km:
+                break
+            if found_ids:
+                distances = np.concatenate(found_distances)
+                if len(distances) >= k and np.partition(distances, k - 1)[k - 1] <= reach:
+                    break
+            ring += 1
+
+        return self._top(found_ids, found_distances, k, max_km)
+
+    def _brute_nearest(self, lat, lon, k, predicate, mask, max_km):
+        ids = self._filter(self._ids, predicate, mask)
+        if not len(ids):
+            return []
+        return self._top([ids], [self._distances(lat, lon, ids)], k, max_km)
+
+    @staticmethod
+    def _top(found_ids, found_distances, k, max_km) -> List[Tuple[int, float]]:
+        if not found_ids:
+            return []
+        ids = np.concatenate(found_ids)
+        distances = np.concatenate(found_distances)
+        if max_km is not None:
+            keep = distances <= max_km
+            ids, distances = ids[keep], distances[keep]
+        if len(ids) > k:
+            part = np.argpartition(distances, k - 1)[:k]
+            ids, distances = ids[part], distances[part]
+        order = np.argsort(distances, kind='stable')
+        return [(int(ids[i]), float(distances[i])) for i in order]
+
+    def within_radius(self, lat: float, lon: float, radius_km: float, predicate: Optional[Callable] = None,
+                      mask: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """Mọi điểm trong bán kính radius_km quanh (lat, lon), sắp theo khoảng cách"""
+        if not self.size or radius_km < 0:
+            return []
+        x, y = self._project(lat, lon)
+        # Nới 2% để bù sai số phép chiếu; lọc chính xác bằng Haversine bên dưới
+        reach = radius_km * 1.02
+        cells = self._cell_range(x - reach, x + reach, y - reach, y + reach)
+        ids = self._filter(self._gather(cells), predicate, mask)
+        if not len(ids):
+            return []
+        distances = self._distances(lat, lon, ids)
+        keep = distances <= radius_km
+        ids, distances = ids[keep], distances[keep]
+        order = np.argsort(distances, kind='stable')
+        return [(int(ids[i]), float(distances[i])) for i in order]
+
+    def within_bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+                    predicate: Optional[Callable] = None, mask: Optional[np.ndarray] = None) -> List[int]:
+        """Chỉ số các điểm nằm trong khung [min_lat, max_lat] x [min_lon, max_lon] (tăng dần)"""
+        if not self.size:
+            return []
+        x0, y0 = self._project(min_lat, min_lon)
+        x1, y1 = self._project(max_lat, max_lon)
+        cells = self._cell_range(min(x0, x1), max(x0, x1), min(y0, y1), max(y0, y1))
+        ids = self._gather(cells)
+        inside = ((self.lats[ids] >= min_lat) & (self.lats[ids] <= max_lat) &
+                  (self.lons[ids] >= min_lon) & (self.lons[ids] <= max_lon))
+        ids = self._filter(ids[inside], predicate, mask)
+        return sorted(ids.tolist())
+
+    def _cell_range(self, x0: float, x1: float, y0: float, y1: float) -> list:
+        """Các ô có điểm giao với khung chiếu [x0, x1] x [y0, y1] (chặn theo biên lưới)"""
+        min_x, max_x, min_y, max_y = self._bounds
+        cx0 = max(int(math.floor(x0 / self.cell_km)), min_x)
+        cx1 = min(int(math.floor(x1 / self.cell_km)), max_x)
+        cy0 = max(int(math.floor(y0 / self.cell_km)), min_y)
+        cy1 = min(int(math.floor(y1 / self.cell_km)), max_y)
+        if cx0 > cx1 or cy0 > cy1:
+            return []
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self._cells):
+            # Khung lớn hơn số ô có điểm: duyệt các ô có điểm thay vì toàn bộ khung
+            return [cell for cell in self._cells if cx0 <= cell[0] <= cx1 and cy0 <= cell[1] <= cy1]
+        return [(cx, cy) for cx in range(cx0, cx1 + 1) for cy in range(cy0, cy1 + 1)]
@@ -0,0 +1,18 @@
+"""
+Các module của python_api import phẳng (from config import settings): thêm thư mục
+python_api vào sys.path và tắt các kết nối ngoài trước khi import.
+"""
+import os
+import sys
+
+os.environ.setdefault("GEMINI_API_KEY", "")
+os.environ.setdefault("AMADEUS_CLIENT_ID", "")
+os.environ.setdefault("AMADEUS_CLIENT_SECRET", "")
+os.environ.setdefault("WARMUP_ENABLED", "False")
+os.environ.setdefault("ITINERARY_CACHE_DIR", "")
+os.environ.setdefault("AIRLINE_STORE_PATH", "")
+os.environ.setdefault("AIRPORT_INDEX_PATH", "")
+os.environ.setdefault("JOB_STORE_PATH", "")
+os.environ.setdefault("CATALOG_DIR", "")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
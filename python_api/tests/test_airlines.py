@@ -0,0 +1,70 @@
+"""Tra tên hãng bay theo batch qua airline_store (seed CSV, TTL, negative cache, lưu đĩa)"""
+import asyncio
+
+import flight
+from airlines import AirlineReferenceStore
+from amadeus_client import AmadeusAPIError
+
+
+class FakeAmadeus:
+    def __init__(self, known: dict, failing: set = frozenset()):
+        self.known = known
+        self.failing = failing
+        self.calls = []
+
+    async def airlines(self, codes: str):
+        batch = codes.split(",")
+        self.calls.append(batch)
+        if self.failing & set(batch):
+            raise AmadeusAPIError("upstream unavailable", 500)
+        return [{"iataCode": code, "businessName": self.known[code]} for code in batch if code in self.known]
+
+
+def test_store_seeds_persists_and_expires(tmp_path):
+    seed = tmp_path / "seed.csv"
+    seed.write_text("code,name\nVN,Vietnam Airlines\n,\n", encoding="utf-8")
+    path = str(tmp_path / "airlines.json")
+    store = AirlineReferenceStore(path, ttl_seconds=60, negative_ttl_seconds=60, seed_path=str(seed))
+
+    store.update({"VJ": "VietJet Air"}, not_found=["ZZ"])
+    assert store.lookup(["VN", "VJ", "ZZ", "QH"]) == ({"VN": "Vietnam Airlines", "VJ": "VietJet Air", "ZZ": "ZZ"},
+                                                      ["QH"])
+    assert (store.hits, store.negative_hits, store.misses) == (2, 1, 1)
+
+    # Restart: entry đã tra còn hạn được nạp lại từ đĩa, seed đọc lại từ CSV
+    restarted = AirlineReferenceStore(path, ttl_seconds=60, negative_ttl_seconds=60, seed_path=str(seed))
+    assert restarted.lookup(["VJ", "ZZ", "VN"]) == ({"VJ": "VietJet Air", "ZZ": "ZZ", "VN": "Vietnam Airlines"}, [])
+    assert restarted.stats()["seeded"] == 1
+
+    expiring = AirlineReferenceStore(None, ttl_seconds=-1, negative_ttl_seconds=-1)
+    expiring.update({"VJ": "VietJet Air"}, not_found=["ZZ"])
+    assert expiring.lookup(["VJ", "ZZ"]) == ({}, ["VJ", "ZZ"])
+
+
+def test_missing_codes_are_fetched_in_batches_once(monkeypatch):
+    codes = [f"A{index:02d}" for index in range(25)]
+    amadeus = FakeAmadeus({code: f"Airline {code}" for code in codes[:-1]})
+    store = AirlineReferenceStore(None, ttl_seconds=60, negative_ttl_seconds=60)
+    monkeypatch.setattr(flight, "airline_store", store)
+    monkeypatch.setattr(flight, "get_amadeus_async", lambda: amadeus)
+
+    names = asyncio.run(flight.get_airline_names_async([code.lower() for code in codes] + [" a00 ", ""]))
+    assert sorted(len(batch) for batch in amadeus.calls) == [5, flight.AIRLINE_BATCH_SIZE]
+    assert names["A00"] == "Airline A00" and names["A24"] == "A24" and len(names) == 25
+
+    # Lượt sau (kể cả mã không tồn tại) không hỏi Amadeus nữa
+    again = asyncio.run(flight.get_airline_names_async(codes))
+    assert again == names and len(amadeus.calls) == 2
+    assert store.negative_hits == 1
+
+
+def test_failed_batch_is_not_negative_cached(monkeypatch):
+    amadeus = FakeAmadeus({"VJ": "VietJet Air"}, failing={"VJ"})
+    store = AirlineReferenceStore(None, ttl_seconds=60, negative_ttl_seconds=60)
+    monkeypatch.setattr(flight, "airline_store", store)
+    monkeypatch.setattr(flight, "get_amadeus_async", lambda: amadeus)
+
+    assert asyncio.run(flight.get_airline_names_async(["VJ"])) == {"VJ": "VJ"}
+    amadeus.failing = set()
+    assert asyncio.run(flight.get_airline_names_async(["VJ"])) == {"VJ": "VietJet Air"}
+    assert len(amadeus.calls) == 2
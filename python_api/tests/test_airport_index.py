@@ -0,0 +1,64 @@
+"""Index sân bay offline: chuẩn hoá tên, khớp chính xác / tiền tố / gần đúng, cache pickle"""
+import airport_index
+from airport_index import AirportIndex, edit_distance, load_airport_index, normalize_place_name
+
+
+def small_index() -> AirportIndex:
+    names = [("HO CHI MINH", "SGN"), ("HA NOI", "HAN"), ("HAI PHONG", "HPH"), ("HOI AN", "DAD"),
+             ("PANAMA CITY", "PTY"), ("PANAMA", "PAC"), ("HANOVER", "HAJ"), ("DANANG", "DAD")]
+    return AirportIndex([(normalize_place_name(name, strip_affixes=False), code) for name, code in names])
+
+
+def test_normalize_place_name():
+    assert normalize_place_name("Thành phố Hồ Chí Minh") == "HO CHI MINH"
+    assert normalize_place_name("TP. Đà Nẵng") == "DA NANG"
+    assert normalize_place_name("Noi Bai International Airport") == "NOI BAI"
+    assert normalize_place_name("Panama City", strip_affixes=False) == "PANAMA CITY"
+    # Không bỏ affix nếu không còn lại gì
+    assert normalize_place_name("City") == "CITY"
+
+
+def test_edit_distance_stops_past_the_limit():
+    assert edit_distance("HANOI", "HANOI", 2) == 0
+    assert edit_distance("HNAOI", "HANOI", 2) == 1  # đổi chỗ hai ký tự
+    assert edit_distance("HANOVER", "HANOI", 1) == 2
+    assert edit_distance("A", "ABCDEF", 2) == 3
+
+
+def test_exact_prefix_and_fuzzy_lookup():
+    index = small_index()
+    assert index.lookup("Hà Nội") == ("HAN", "HA NOI", "exact", 0)
+    assert index.lookup("HANOI").code == "HAN"  # chỉ khác khoảng trắng
+    assert index.lookup("Panama City").code == "PTY"
+    assert index.lookup("Panama").code == "PAC"
+
+    assert index.lookup("Ho Chi").kind == "prefix" and index.resolve("Ho Chi") == "SGN"
+    # Tiền tố quá ngắn không được đoán
+    assert index.prefix("HO", limit=5) == []
+    assert index.prefix("HAI ", limit=5) == ["HAI PHONG"]
+
+    assert index.lookup("Hai Phnog") == ("HPH", "HAI PHONG", "fuzzy", 1)
+    assert index.lookup("Ho Chi Mnh City") == ("SGN", "HO CHI MINH", "fuzzy", 1)
+    assert index.lookup("Da Nag") == ("DAD", "DANANG", "fuzzy", 1)
+    # Tên ngắn chỉ khớp chính xác
+    assert index.resolve("Hoi") is None and index.resolve("Hoi Anx") == "DAD"
+    assert index.resolve("Reykjavik") is None and index.resolve("") is None
+
+
+def test_real_csv_index_and_pickle_cache(tmp_path, monkeypatch):
+    path = str(tmp_path / "airport_index.pkl")
+    built = load_airport_index(path)
+    assert built.resolve("Hà Nội") == "HAN" and built.resolve("TP Hồ Chí Minh") == "SGN"
+    assert built.resolve("Thành phố Đà Nẵng") == "DAD" and built.resolve("Nha Trng") == "CXR"
+
+    def no_rebuild(*args, **kwargs):
+        raise AssertionError("index should come from the pickle cache")
+
+    monkeypatch.setattr(AirportIndex, "from_csv", no_rebuild)
+    cached = load_airport_index(path)
+    assert len(cached) == len(built) and cached.resolve("Ha Noi") == "HAN"
+
+    # Đổi INDEX_VERSION (hoặc file CSV) thì build lại
+    monkeypatch.setattr(airport_index, "INDEX_VERSION", airport_index.INDEX_VERSION + 1)
+    monkeypatch.setattr(AirportIndex, "from_csv", classmethod(lambda cls: small_index()))
+    assert len(load_airport_index(path)) == len(small_index())
@@ -0,0 +1,20 @@
+import main
+from models import BatchRecommendationRequest
+
+
+def test_batch_jobs_share_identical_catalogues():
+    place = {"id": "a1", "name": "Hoan Kiem Lake", "latitude": 21.03, "longitude": 105.85}
+    request = BatchRecommendationRequest.model_validate({
+        "activities": [place],
+        "items": [
+            {"destination_city_name": "Hanoi"},
+            {"destination_city_name": "Hanoi", "activities": [{**place, "id": "a2"}]},
+            {"destination_city_name": "Hanoi", "activities": [{**place, "id": "a2"}]},
+        ],
+    })
+    jobs = main.batch_jobs(request)
+
+    assert [index for index, _, _ in jobs] == [0, 1, 2]
+    assert jobs[0][2]["activities"][0]["id"] == "a1"
+    assert jobs[1][2] is jobs[2][2] and jobs[1][2]["activities"][0]["id"] == "a2"
+    assert len({item.user_id for _, item, _ in jobs}) == 3
@@ -0,0 +1,51 @@
+import asyncio
+import os
+import time
+
+from cache import TTLCache
+
+
+def test_disk_tier_survives_restart_and_reads_async(tmp_path):
+    cache = TTLCache("t", ttl_seconds=60, disk_dir=str(tmp_path))
+    asyncio.run(cache.set_async("k1", {"days": [1, 2]}))
+
+    path = tmp_path / "k1.json"
+    # mtime của file là thời điểm hết hạn
+    assert abs(os.stat(path).st_mtime - (time.time() + 60)) < 5
+
+    restarted = TTLCache("t", ttl_seconds=60, disk_dir=str(tmp_path))
+    value = asyncio.run(restarted.get_async("k1"))
+    assert value == {"days": [1, 2]}
+    assert restarted.disk_hits == 1
+    value["days"].append(3)
+    assert restarted.get("k1") == {"days": [1, 2]}
+    assert asyncio.run(restarted.get_async("missing")) is None and restarted.misses == 1
+
+
+def test_sweep_removes_expired_and_enforces_limits(tmp_path):
+    cache = TTLCache("t", ttl_seconds=60, disk_dir=str(tmp_path), max_disk_entries=3)
+    cache.set("expired", "x", ttl_seconds=-1)
+    for index in range(3):
+        cache.set(f"k{index}", "x" * 10, ttl_seconds=100 + index)
+    leftover = tmp_path / "k9.json.tmp"
+    leftover.write_text("{")
+    os.utime(leftover, (time.time() - 3600, time.time() - 3600))
+
+    cache.sweep_disk()
+    assert sorted(os.listdir(tmp_path)) == ["k0.json", "k1.json", "k2.json"]
+    assert cache.disk_expired == 1 and cache.disk_entries == 3
+
+    # Vượt giới hạn: file sắp hết hạn nhất bị xoá trước
+    cache.set("k3", "x" * 10, ttl_seconds=200)
+    cache.sweep_disk()
+    assert sorted(name for name in os.listdir(tmp_path) if name.endswith(".json")) == ["k1.json", "k2.json", "k3.json"]
+    assert cache.disk_evictions >= 1
+
+
+def test_sweep_enforces_byte_limit(tmp_path):
+    cache = TTLCache("t", ttl_seconds=60, disk_dir=str(tmp_path), max_disk_bytes=200)
+    for index in range(5):
+        cache.set(f"k{index}", "x" * 60, ttl_seconds=100 + index)
+    cache.sweep_disk()
+    assert cache.disk_bytes <= 200
+    assert (tmp_path / "k4.json").exists() and not (tmp_path / "k0.json").exists()
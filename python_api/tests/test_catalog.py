@@ -0,0 +1,79 @@
+import pytest
+
+from catalog import CatalogConflict, PlaceCatalogStore
+
+
+def place(place_id, name, rating=4.5):
+    return {"id": place_id, "name": name, "rating": rating, "latitude": 21.03, "longitude": 105.85}
+
+
+PLACES = {
+    "activities": [place("a1", "Hoan Kiem Lake"), place("a2", "Temple of Literature")],
+    "restaurants": [place("r1", "Pho Thin")],
+    "hotels": [place("h1", "Metropole")],
+}
+
+
+def test_content_hash_ignores_order_and_tracks_deltas():
+    store = PlaceCatalogStore(None)
+    meta, changed = store.replace("Hà Nội", PLACES)
+    assert changed and meta["version"] == 1
+
+    reordered = {category: list(reversed(places)) for category, places in PLACES.items()}
+    same, changed = store.replace("HANOI", reordered)
+    assert not changed and same["content_hash"] == meta["content_hash"] and same["version"] == 1
+
+    updated = store.apply_delta("Ha Noi", meta["content_hash"],
+                                {"restaurants": [place("r2", "Bun Cha Huong Lien")]}, {"activities": ["a2"]})
+    assert updated["version"] == 2
+    assert updated["counts"] == {"activities": 1, "restaurants": 2, "hotels": 1}
+
+    # Cùng nội dung upload lại toàn bộ -> cùng hash với kết quả delta
+    rebuilt = PlaceCatalogStore(None)
+    full, _ = rebuilt.replace("Hanoi", {
+        "activities": [PLACES["activities"][0]],
+        "restaurants": PLACES["restaurants"] + [place("r2", "Bun Cha Huong Lien")],
+        "hotels": PLACES["hotels"],
+    })
+    assert full["content_hash"] == updated["content_hash"]
+
+    with pytest.raises(CatalogConflict) as conflict:
+        store.apply_delta("Hanoi", meta["content_hash"], {}, {"hotels": ["h1"]})
+    assert conflict.value.current_hash == updated["content_hash"]
+    with pytest.raises(KeyError):
+        store.apply_delta("Da Nang", meta["content_hash"], {}, {})
+
+
+def test_stores_sharing_a_directory_see_each_others_writes(tmp_path):
+    first = PlaceCatalogStore(str(tmp_path))
+    second = PlaceCatalogStore(str(tmp_path))
+
+    # Lượt miss trước khi upload không được cache lại
+    assert second.get("Hanoi") is None
+    meta, _ = first.replace("Hanoi", PLACES)
+    assert second.get("Hanoi").content_hash == meta["content_hash"]
+
+    # Delta ở process này, process kia thấy phiên bản mới và delta tiếp không bị conflict giả
+    updated = first.apply_delta("Hanoi", meta["content_hash"], {}, {"hotels": ["h1"]})
+    assert second.get("Hanoi").content_hash == updated["content_hash"]
+    latest = second.apply_delta("Hanoi", updated["content_hash"], {"hotels": [place("h2", "Sofitel")]}, {})
+    assert first.get("Hanoi").content_hash == latest["content_hash"]
+    assert latest["version"] == 3
+    assert [city["city"] for city in PlaceCatalogStore(str(tmp_path)).cities()] == ["Hanoi"]
+
+
+def test_snapshot_is_stable_across_deltas():
+    store = PlaceCatalogStore(None)
+    assert store.snapshot("Hue") is None
+    meta, _ = store.replace("Hue", PLACES)
+
+    snapshot_meta, places_data = store.snapshot("Huế")
+    assert snapshot_meta == meta and places_data["catalog_hash"] == meta["content_hash"]
+    store.apply_delta("Hue", meta["content_hash"], {"hotels": [place("h2", "Azerai")]}, {"activities": ["a1"]})
+
+    # Snapshot đã lấy không đổi; lần lấy sau thấy phiên bản mới
+    assert [p["id"] for p in places_data["activities"]] == ["a1", "a2"]
+    assert len(places_data["hotels"]) == 1
+    new_meta, new_places = store.snapshot("Hue")
+    assert new_meta["version"] == 2 and new_places["catalog_hash"] == new_meta["content_hash"]
+    assert store.meta("Hue") == new_meta
@@ -0,0 +1,86 @@
+"""AdmissionController (429/503) và SingleFlight"""
+import asyncio
+import time
+
+import pytest
+
+from concurrency import AdmissionController, AdmissionRejected, SingleFlight
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_queue_full_rejects_with_429():
+    async def scenario():
+        controller = AdmissionController("test", max_in_flight=1, max_queue=1, max_wait_seconds=5)
+        await controller.acquire()
+        waiter = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.acquire()
+        assert rejected.value.status_code == 429
+        controller.release(0.01)
+        await waiter
+        controller.release(0.01)
+        assert controller.in_flight == 0
+
+    run(scenario())
+
+
+def test_wait_past_deadline_returns_503():
+    async def scenario():
+        controller = AdmissionController("test", max_in_flight=1, max_queue=4, max_wait_seconds=0.05)
+        await controller.acquire()
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.acquire()
+        assert rejected.value.status_code == 503
+        assert rejected.value.retry_after >= 1
+        assert controller.rejected_deadline == 1
+
+    run(scenario())
+
+
+def test_release_after_deadline_before_timeout_gives_503_not_cancel():
+    """release() chạy khi waiter đã quá hạn nhưng wait_for chưa kịp timeout (loop bị chặn)"""
+    async def scenario():
+        controller = AdmissionController("test", max_in_flight=1, max_queue=4, max_wait_seconds=0.05)
+        await controller.acquire()
+        waiter = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0)
+        time.sleep(0.1)  # chặn loop quá deadline của waiter
+        controller.release(0.01)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await waiter
+        assert rejected.value.status_code == 503
+        assert controller.rejected_deadline == 1
+        # Slot không bị mất: request kế tiếp vẫn vào được ngay
+        assert controller.in_flight == 0
+        await controller.acquire()
+        assert controller.in_flight == 1
+
+    run(scenario())
+
+
+def test_singleflight_coalesces_and_retries_after_failure():
+    async def scenario():
+        flights = SingleFlight("test")
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            if len(calls) == 1:
+                raise RuntimeError("upstream failed")
+            return "ok"
+
+        leader = asyncio.ensure_future(flights.do("k", fetch))
+        await asyncio.sleep(0)
+        followers = [asyncio.ensure_future(flights.do("k", fetch)) for _ in range(3)]
+        with pytest.raises(RuntimeError):
+            await leader
+        assert await asyncio.gather(*followers) == ["ok"] * 3
+        # Một lời gọi lỗi + một lần thử lại chung cho cả 3 follower
+        assert len(calls) == 2
+
+    run(scenario())
@@ -0,0 +1,61 @@
+"""Ghép lịch trình fan-out: bỏ trùng giữa các ngày rồi tính lại transfer"""
+import services
+
+
+def place(place_id, kind="activity", start="09:00"):
+    return {"type": kind, "place_id": place_id, "place_name": place_id, "start_time": start, "cost": 10.0}
+
+
+def transfer(start="08:30"):
+    return {"type": "transfer", "place_name": "Transfer", "start_time": start, "transport_mode": "taxi", "cost": 0.0}
+
+
+def day(number, *items):
+    return {"day": number, "activities": list(items)}
+
+
+def kinds(schedule_day):
+    return [item.get("place_id") or item["type"] for item in schedule_day["activities"]]
+
+
+def test_return_to_hotel_transfer_is_kept():
+    schedule = [
+        day(1, place("H1", "hotel"), transfer(), place("A1"), transfer("18:00")),
+        day(2, place("H1", "hotel"), transfer(), place("A1"), transfer(), place("A2"), transfer("18:00")),
+    ]
+    removed = services._remove_cross_day_duplicates(schedule)
+    assert kinds(schedule[0]) == ["H1", "transfer", "A1", "transfer"]
+    # A1 trùng: transfer tới A1 gộp với transfer tới A2, transfer về khách sạn giữ nguyên
+    assert kinds(schedule[1]) == ["H1", "transfer", "A2", "transfer"]
+    assert [item.get("place_id") or item["type"] for item in removed] == ["A1", "transfer"]
+
+
+def test_trailing_transfer_to_removed_duplicate_is_dropped():
+    schedule = [
+        day(1, place("H1", "hotel"), transfer(), place("A1")),
+        day(2, place("H1", "hotel"), transfer(), place("A3"), transfer("15:00"), place("A1", start="16:00")),
+    ]
+    services._remove_cross_day_duplicates(schedule)
+    assert kinds(schedule[1]) == ["H1", "transfer", "A3"]
+
+
+def test_duplicate_followed_by_return_transfer_keeps_one_return_ride():
+    schedule = [
+        day(1, place("A1")),
+        day(2, place("H1", "hotel"), transfer(), place("A3"), transfer("15:00"), place("A1"), transfer("18:00")),
+    ]
+    services._remove_cross_day_duplicates(schedule)
+    assert kinds(schedule[1]) == ["H1", "transfer", "A3", "transfer"]
+
+
+def test_return_transfer_is_costed_after_dedup():
+    coordinates = {"H1": (21.0285, 105.8542), "A1": (21.0368, 105.8342), "A2": (21.0245, 105.8412)}
+    schedule = [
+        day(1, place("H1", "hotel"), transfer(), place("A1"), transfer("18:00")),
+        day(2, place("H1", "hotel"), transfer(), place("A1"), transfer(), place("A2"), transfer("18:00")),
+    ]
+    services._remove_cross_day_duplicates(schedule)
+    services.compute_transfers(schedule, coordinates)
+    ride_back = schedule[1]["activities"][-1]
+    assert ride_back["type"] == "transfer"
+    assert ride_back["distance_km"] > 0 and ride_back["cost"] > 0
@@ -0,0 +1,277 @@
+"""Sync flight pipeline: filter_flights -> simplify_flights -> rank_flights"""
+import asyncio
+import copy
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import flight
+
+TARGET = date.today() + timedelta(days=30)
+
+
+def make_offer(number: str, hour: int, price: str, stop: bool = False) -> dict:
+    day = TARGET.isoformat()
+    if stop:
+        segments = [
+            {"departure": {"iataCode": "HAN", "at": f"{day}T{hour:02d}:00:00"},
+             "arrival": {"iataCode": "DAD", "at": f"{day}T{hour + 1:02d}:20:00"},
+             "carrierCode": "VN", "number": number},
+            {"departure": {"iataCode": "DAD", "at": f"{day}T{hour + 2:02d}:00:00"},
+             "arrival": {"iataCode": "BKK", "at": f"{day}T{hour + 3:02d}:30:00"},
+             "carrierCode": "VN", "number": f"{number}1"},
+        ]
+    else:
+        segments = [
+            {"departure": {"iataCode": "HAN", "at": f"{day}T{hour:02d}:00:00"},
+             "arrival": {"iataCode": "BKK", "at": f"{day}T{hour + 2:02d}:00:00"},
+             "carrierCode": "VJ", "number": number},
+        ]
+    return {"itineraries": [{"segments": segments}], "price": {"total": price, "currency": "VND"}}
+
+
+NAMES = {"VN": "Vietnam Airlines", "VJ": "VietJet Air"}
+
+
+def test_filter_then_simplify_sync_path():
+    offers = [make_offer("101", 8, "2500000.00", stop=True), make_offer("202", 10, "1500000.00")]
+    filtered = flight.filter_flights(offers, TARGET)
+    assert len(filtered) == 2
+    assert isinstance(filtered[0]["local_departure"], str)
+
+    simplified = flight.simplify_flights(filtered, NAMES)
+    assert [f["flight_code"] for f in simplified] == ["VN101", "VJ202"]
+    first = simplified[0]
+    assert first["airline"] == "Vietnam Airlines"
+    assert first["dep_timezone"] == "Asia/Ho_Chi_Minh"
+    assert first["arr_timezone"] == "Asia/Bangkok"
+    # HAN 08:00 (+07) -> BKK 11:30 (+07)
+    assert first["duration_minutes"] == 210
+    assert [stop["iata"] for stop in first["stops"]] == ["DAD"]
+
+
+def test_simplify_accepts_unfiltered_and_datetime_departures():
+    offer = make_offer("303", 9, "900000.00")
+    offer_with_datetime = dict(make_offer("404", 11, "800000.00"),
+                               local_departure=datetime.fromisoformat(f"{TARGET}T11:00:00+07:00"))
+    simplified = flight.simplify_flights([offer, offer_with_datetime], NAMES)
+    assert [f["dep_timezone"] for f in simplified] == ["Asia/Ho_Chi_Minh", "Asia/Ho_Chi_Minh"]
+
+
+def test_filter_drops_other_days():
+    other_day = make_offer("505", 9, "1.00")
+    other_day["itineraries"][0]["segments"][0]["departure"]["at"] = f"{TARGET + timedelta(days=1)}T09:00:00"
+    assert flight.filter_flights([other_day], TARGET) == []
+
+
+def test_rank_flights_sorts_and_paginates():
+    offers = [make_offer(str(100 + i), 6 + i, f"{1000 + (i * 7) % 5}.00") for i in range(6)]
+    built = [flight.ParsedOffer(o, o["itineraries"][0]["segments"], *flight_times(o)) for o in offers]
+    flights = [flight.simplify_offer(parsed, NAMES) for parsed in built]
+    sort_keys = [flight.flight_sort_key(f, parsed) for f, parsed in zip(flights, built)]
+
+    page, pagination = flight.rank_flights(flights, sort_keys, sort_by="price", limit=4)
+    prices = [float(f["price"]) for f in page]
+    assert prices == sorted(prices) and len(page) == 4
+    assert pagination["total"] == 6 and pagination["next_cursor"]
+
+    rest, pagination = flight.rank_flights(flights, sort_keys, sort_by="price", limit=4,
+                                           cursor=pagination["next_cursor"])
+    assert len(rest) == 2 and pagination["next_cursor"] is None
+    assert {f["flight_code"] for f in page + rest} == {f["flight_code"] for f in flights}
+
+
+def test_cursor_is_bound_to_its_search():
+    offers = [make_offer(str(100 + i), 6 + i, f"{1000 + i}.00") for i in range(4)]
+    built = [flight.ParsedOffer(o, o["itineraries"][0]["segments"], *flight_times(o)) for o in offers]
+    flights = [flight.simplify_offer(parsed, NAMES) for parsed in built]
+    sort_keys = [flight.flight_sort_key(f, parsed) for f, parsed in zip(flights, built)]
+    search = flight.cursor_search("Hanoi", "Bangkok", "2030-01-01", None, 1)
+
+    _, pagination = flight.rank_flights(flights, sort_keys, sort_by="price", limit=2, search=search)
+    cursor = pagination["next_cursor"]
+    assert flight.cursor_search(" hanoi", "BANGKOK", "2030-01-01", None, 1) == search
+    page, _ = flight.rank_flights(flights, sort_keys, sort_by="price", limit=2, cursor=cursor, search=search)
+    assert len(page) == 2
+
+    for other in (flight.cursor_search("Hanoi", "Bangkok", "2030-01-02", None, 1),
+                  flight.cursor_search("Hanoi", "Bangkok", "2030-01-01", "2030-01-05", 1),
+                  flight.cursor_search("Hanoi", "Bangkok", "2030-01-01", None, 2),
+                  flight.cursor_search("Hanoi", "Singapore", "2030-01-01", None, 1)):
+        with pytest.raises(flight.InvalidCursor):
+            flight.rank_flights(flights, sort_keys, sort_by="price", limit=2, cursor=cursor, search=other)
+
+
+def flight_times(offer):
+    segments = offer["itineraries"][0]["segments"]
+    departure = flight._local_time(segments[0]["departure"]["at"], flight.airport_timezone("HAN"))
+    arrival = flight._local_time(segments[-1]["arrival"]["at"], flight.airport_timezone("BKK"))
+    return departure, arrival
+
+
+def test_cached_offers_drop_departed_flights_when_served(monkeypatch):
+    async def airline_names(codes):
+        return NAMES
+
+    monkeypatch.setattr(flight, "get_airline_names_async", airline_names)
+    offers = [make_offer("101", 8, "2500000.00", stop=True), make_offer("202", 10, "1500000.00")]
+    built = asyncio.run(flight._build_offers(offers, TARGET))
+    # Bản cache giữ mọi chuyến trong ngày
+    assert len(built["simplified"]) == 2 == len(built["departures"])
+
+    before_first = datetime.fromisoformat(f"{TARGET}T07:00:00+07:00")
+    assert flight.upcoming_offers(built, before_first) is built
+
+    between = datetime.fromisoformat(f"{TARGET}T09:00:00+07:00")
+    served = flight.upcoming_offers(built, between)
+    assert [f["flight_code"] for f in served["simplified"]] == ["VJ202"]
+    assert len(served["sort_keys"]) == 1
+    assert len(built["simplified"]) == 2
+
+
+def test_flight_search_rejects_invalid_dates():
+    import httpx
+    import main
+
+    async def post(body):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/api/flight-search", json=body)
+
+    route = {"departure_city": "HAN", "arrival_city": "SGN"}
+    bad_format = asyncio.run(post({**route, "departure_date": "05/01/2030"}))
+    assert bad_format.status_code == 400 and "departure_date" in bad_format.json()["error"]
+
+    bad_return = asyncio.run(post({**route, "departure_date": "2030-01-05", "return_date": "2030-02-30"}))
+    assert bad_return.status_code == 400 and "return_date" in bad_return.json()["error"]
+
+    # So sánh theo ngày, không theo chuỗi ("2030-1-10" > "2030-01-20" nếu so chuỗi)
+    reversed_trip = asyncio.run(post({**route, "departure_date": "2030-01-20", "return_date": "2030-1-10"}))
+    assert reversed_trip.status_code == 400 and "before" in reversed_trip.json()["error"]
+
+
+def test_flight_search_slots_follow_the_running_loop():
+    async def slots():
+        first = flight._get_flight_search_slots()
+        assert flight._get_flight_search_slots() is first
+        return first
+
+    assert asyncio.run(slots()) is not asyncio.run(slots())
+
+
+def leg(code, dep_iata, arr_iata, day, hour, price, airline="VietJet Air", currency="VND"):
+    """Chuyến bay đã rút gọn (như simplify_offer), bay 2 tiếng"""
+    return {"flight_code": code, "airline": airline, "dep_iata": dep_iata, "arr_iata": arr_iata,
+            "dep_time": f"{day}T{hour:02d}:00:00", "arr_time": f"{day}T{hour + 2:02d}:00:00",
+            "price": price, "currency": currency}
+
+
+def test_round_trip_returns_the_return_leg_and_pairs_only(monkeypatch):
+    back = TARGET + timedelta(days=3)
+    legs = {
+        ("HAN", "BKK"): {"simplified": [leg("VJ1", "HAN", "BKK", TARGET, 8, "100.00")]},
+        ("BKK", "HAN"): {"simplified": [leg("VJ2", "BKK", "HAN", back, 9, "120.00")]},
+    }
+
+    async def resolve(dep, arr):
+        return dep, arr
+
+    async def search(dep_code, arr_code, day, adults):
+        return legs[(dep_code, arr_code)]
+
+    monkeypatch.setattr(flight, "_resolve_route_async", resolve)
+    monkeypatch.setattr(flight, "search_flight_offers_async", search)
+    trip = asyncio.run(flight.round_trip_search_async("HAN", "BKK", TARGET.isoformat(), back.isoformat()))
+
+    assert set(trip) == {"return", "pairs", "cheapest_total"}
+    assert [f["flight_code"] for f in trip["return"]["VietJet Air"]] == ["VJ2"]
+    assert trip["cheapest_total"] == 220.0
+    # Cặp trả về là bản copy, không trỏ vào dict trong cache
+    trip["pairs"][0]["outbound"]["price"] = "0"
+    assert legs[("HAN", "BKK")]["simplified"][0]["price"] == "100.00"
+
+
+def test_serving_cached_offers_never_modifies_the_cache(monkeypatch):
+    async def airline_names(codes):
+        return NAMES
+
+    monkeypatch.setattr(flight, "get_airline_names_async", airline_names)
+    offers = [make_offer(str(100 + i), 8 + i, f"{1000 + i}.00") for i in range(3)]
+    cached = asyncio.run(flight._build_offers(offers, TARGET))
+    snapshot = copy.deepcopy(cached)
+
+    grouped, _ = flight.present_flights(flight.upcoming_offers(cached), {"sort_by": "price", "limit": 2})
+    for flights in grouped.values():
+        for f in flights:
+            f["price"] = "0"
+            f.clear()
+    flight._calendar_day(TARGET, cached["simplified"], True)
+    assert cached == snapshot
+
+
+def test_flexible_search_builds_a_price_calendar(monkeypatch):
+    prices = {-2: ["900.00", "850.50"], -1: [], 1: None, 2: ["700.00"]}
+
+    async def resolve(dep, arr):
+        return dep, arr
+
+    async def search(dep_code, arr_code, day, adults):
+        offset = (day - TARGET).days
+        if prices.get(offset, ...) is None:
+            raise RuntimeError("amadeus down")
+        day_prices = prices.get(offset, ["1000.00", "980.00"])
+        return {"simplified": [leg(f"VJ{offset}{i}", "HAN", "BKK", day, 8 + i, price, airline=f"Air {i}")
+                               for i, price in enumerate(day_prices)],
+                "sort_keys": [(float(price), i, 120, 0) for i, price in enumerate(day_prices)]}
+
+    monkeypatch.setattr(flight, "_resolve_route_async", resolve)
+    monkeypatch.setattr(flight, "search_flight_offers_async", search)
+    result = asyncio.run(flight.flexible_date_search_async("HAN", "BKK", TARGET.isoformat(), 2))
+
+    calendar = {entry["date"]: entry for entry in result["calendar"]}
+    assert list(calendar) == [(TARGET + timedelta(days=offset)).isoformat() for offset in range(-2, 3)]
+    assert calendar[(TARGET - timedelta(days=2)).isoformat()]["cheapest_price"] == 850.5
+    assert calendar[(TARGET - timedelta(days=2)).isoformat()]["airline"] == "Air 1"
+    assert calendar[(TARGET - timedelta(days=1)).isoformat()]["flight_count"] == 0
+    assert calendar[(TARGET + timedelta(days=1)).isoformat()]["error"] is True
+    assert [entry["date"] for entry in result["calendar"] if entry["selected"]] == [TARGET.isoformat()]
+    assert result["cheapest_date"] == (TARGET + timedelta(days=2)).isoformat()
+    # data là chuyến bay của ngày được chọn
+    assert sorted(f["flight_code"] for flights in result["flights"].values() for f in flights) == ["VJ00", "VJ01"]
+
+    # Ngày đã qua không được tìm
+    today = datetime.now(flight.LOCAL_TZ).date()
+    searched = []
+
+    async def record(dep_code, arr_code, day, adults):
+        searched.append(day)
+        return {"simplified": [], "sort_keys": []}
+
+    monkeypatch.setattr(flight, "search_flight_offers_async", record)
+    asyncio.run(flight.flexible_date_search_async("HAN", "BKK", (today + timedelta(days=1)).isoformat(), 3))
+    assert min(searched) == today and max(searched) == today + timedelta(days=4)
+
+
+def test_pair_round_trips_orders_by_total_and_skips_impossible_pairs(monkeypatch):
+    back = TARGET + timedelta(days=2)
+    outbound = [leg("VJ1", "HAN", "BKK", TARGET, 8, "100.00"),
+                leg("VJ2", "HAN", "BKK", TARGET, 20, "60.00"),
+                leg("VN1", "HAN", "BKK", TARGET, 9, "50.00", currency="USD"),
+                leg("VJ3", "HAN", "BKK", TARGET, 10, "n/a")]
+    inbound = [leg("VJ8", "BKK", "HAN", back, 9, "80.00"),
+               leg("VJ9", "BKK", "HAN", back, 12, "70.00"),
+               # Về cùng ngày đi, trước khi chuyến đi buổi tối hạ cánh
+               leg("VJ7", "BKK", "HAN", TARGET, 21, "10.00")]
+
+    pairs = flight.pair_round_trips(outbound, inbound, max_pairs=10)
+    codes = [(pair["outbound"]["flight_code"], pair["return"]["flight_code"]) for pair in pairs]
+    assert codes == [("VJ1", "VJ7"), ("VJ2", "VJ9"), ("VJ2", "VJ8"), ("VJ1", "VJ9"), ("VJ1", "VJ8")]
+    assert [pair["total_price"] for pair in pairs] == [110.0, 130.0, 140.0, 170.0, 180.0]
+    # Khác tiền tệ hoặc không có giá thì không ghép
+    assert all(pair["currency"] == "VND" for pair in pairs)
+
+    assert len(flight.pair_round_trips(outbound, inbound, max_pairs=2)) == 2
+    # Chỉ xét chuyến rẻ nhất mỗi chiều: VN1 (USD) và VJ7 (VND) không ghép được
+    monkeypatch.setattr(flight, "ROUND_TRIP_LEG_CANDIDATES", 1)
+    assert flight.pair_round_trips(outbound, inbound, max_pairs=10) == []
+    assert flight.pair_round_trips([], inbound) == []
@@ -0,0 +1,72 @@
+"""FastJSONResponse encoding and CompressionMiddleware negotiation"""
+import asyncio
+import gzip
+import json
+from datetime import date
+
+import numpy as np
+from starlette.responses import PlainTextResponse, StreamingResponse
+
+import responses
+
+
+def test_pick_encoding():
+    assert responses._pick_encoding("gzip, deflate") == "gzip"
+    assert responses._pick_encoding("identity") is None
+    assert responses._pick_encoding("gzip;q=0") is None
+    assert responses._pick_encoding("") is None
+    expected_br = "br" if responses.brotli is not None else "gzip"
+    assert responses._pick_encoding("br, gzip") == expected_br
+
+
+def test_dumps_handles_non_json_types():
+    body = json.loads(responses.dumps({"day": date(2026, 1, 2), "n": np.int64(3), "tags": {"a"}, "name": "Hà Nội"}))
+    assert body == {"day": "2026-01-02", "n": 3, "tags": ["a"], "name": "Hà Nội"}
+
+
+def call(app, accept_encoding: str = "gzip"):
+    """Chạy một request ASGI, trả về (headers, body)"""
+    messages = []
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": [(b"accept-encoding", accept_encoding.encode())]}
+
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if requested:
+            # StreamingResponse chờ disconnect song song với việc stream
+            await asyncio.Event().wait()
+        requested = True
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(responses.CompressionMiddleware(app, minimum_size=100)(scope, receive, send))
+    headers = {key.decode(): value.decode() for key, value in messages[0]["headers"]}
+    return headers, b"".join(m.get("body", b"") for m in messages[1:])
+
+
+def test_large_response_is_gzipped():
+    headers, body = call(responses.FastJSONResponse({"items": ["x" * 50] * 20}))
+    assert headers["content-encoding"] == "gzip"
+    assert headers["content-length"] == str(len(body))
+    assert "Accept-Encoding" in headers["vary"]
+    assert json.loads(gzip.decompress(body))["items"][0] == "x" * 50
+
+
+def test_small_and_unnegotiated_responses_pass_through():
+    headers, body = call(PlainTextResponse("short"))
+    assert "content-encoding" not in headers and body == b"short"
+    headers, body = call(PlainTextResponse("y" * 500), accept_encoding="identity")
+    assert "content-encoding" not in headers and body == b"y" * 500
+
+
+def test_event_stream_is_not_compressed():
+    async def events():
+        for i in range(3):
+            yield f"event: day\ndata: {'z' * 200}\n\n"
+
+    headers, body = call(StreamingResponse(events(), media_type="text/event-stream"))
+    assert "content-encoding" not in headers
+    assert body.decode().count("event: day") == 3
@@ -0,0 +1,114 @@
+"""services: semaphore Gemini theo event loop, local planner không chặn loop, pre-rank top-k, compact encoding"""
+import asyncio
+
+import numpy as np
+
+import services
+from models import UserTourInfo
+
+
+def test_gemini_slots_follow_the_running_loop():
+    async def slots():
+        first = services._get_gemini_slots()
+        assert services._get_gemini_slots() is first
+        async with first:
+            pass
+        return first
+
+    # Mỗi event loop (vd. worker/test khác nhau) có semaphore riêng, tạo lúc dùng chứ không lúc import
+    assert asyncio.run(slots()) is not asyncio.run(slots())
+
+
+def test_local_planner_runs_off_the_event_loop(monkeypatch):
+    import planner
+
+    loop_threads = []
+
+    def fake_local_tour(user_input, destination_name, user_prefs, places_data):
+        try:
+            asyncio.get_running_loop()
+            loop_threads.append(True)
+        except RuntimeError:
+            loop_threads.append(False)
+        return {"schedule": [], "generated_by": "local_planner"}
+
+    monkeypatch.setattr(planner, "build_local_tour", fake_local_tour)
+    user_input = UserTourInfo({"user_id": "u1", "start_city_id": "Hanoi", "destination_city_id": "Hanoi",
+                               "duration_days": 2, "target_budget": 100.0})
+    result = asyncio.run(services.build_final_tour_json_async(
+        user_input, {}, destination_name="Hanoi", places_data={"activities": [{"name": "A"}]}, planner="local"
+    ))
+    assert result["generated_by"] == "local_planner"
+    assert loop_threads == [False]
+
+
+def test_top_k_handles_empty_and_oversized_limits():
+    places = [{"id": "a"}, {"id": "b"}, {"id": "c"}]
+    scores = np.array([0.2, 0.9, 0.5])
+    assert services._top_k(places, scores, 0, set()) == []
+    assert services._top_k(places, scores, -2, set()) == []
+    assert services._top_k([], np.array([]), 3, set()) == []
+    assert [p["id"] for p in services._top_k(places, scores, 10, set())] == ["b", "c", "a"]
+    assert [p["id"] for p in services._top_k(places, scores, 2, {"a"})] == ["a", "b"]
+
+
+def test_fanout_planning_respects_prerank_flag(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("prerank_places must not run when PRERANK_ENABLED is False")
+
+    monkeypatch.setattr(services.settings, "PRERANK_ENABLED", False)
+    monkeypatch.setattr(services, "prerank_places", fail)
+    places = {
+        "activities": [{"id": f"a{i}", "name": f"A{i}", "latitude": 21.0 + i / 100, "longitude": 105.8}
+                       for i in range(30)],
+        "restaurants": [{"id": f"r{i}", "name": f"R{i}"} for i in range(10)],
+        "hotels": [{"id": "h1", "name": "H1"}, {"id": "h2", "name": "H2"}],
+    }
+    user_input = UserTourInfo({"user_id": "u1", "start_city_id": "Hanoi", "destination_city_id": "Hanoi",
+                               "duration_days": 6, "target_budget": 600.0})
+    chunks = services.plan_day_chunks(user_input, {"liked_hotels": [{"id": "h2"}]}, places)
+    assert sum(len(chunk["places_data"]["activities"]) for chunk in chunks) == 30
+    assert all(chunk["places_data"]["hotels"][0]["id"] == "h2" for chunk in chunks)
+
+
+def _decode_compact(places_section: str) -> dict:
+    """Đọc lại bảng compact của prompt: {id ngắn: {cột: ô}}"""
+    rows = {}
+    for block in places_section.split("\n\n")[1:]:
+        lines = block.split("\n")
+        header = lines[1].split("|")
+        for line in lines[2:]:
+            cells = line.split("|")
+            rows[cells[0]] = dict(zip(header[1:], cells[1:]))
+    return rows
+
+
+def test_compact_encoding_round_trips_places_and_ids():
+    travel_data = {
+        "activities": [
+            {"id": "act-9", "name": "Hoan Kiem | Lake", "rating": 4.7, "reviews": 1200,
+             "latitude": 21.028511, "longitude": 105.854167, "avg_price": None},
+            {"id": "act-12", "name": {"text": "Temple of Literature"}, "rating": 4.5,
+             "latitude": 21.0294, "longitude": 105.8355},
+        ],
+        "restaurants": [{"place_id": "res-3", "name": "Pho Thin", "avg_price": 3.5}],
+        "hotels": [],
+    }
+    user_prefs = {"liked_hotels": [{"id": "hot-1", "name": "Metropole", "rating": 4.9}],
+                  "disliked_restaurants": [{"place_id": "res-3"}]}
+    encoded = services.encode_places_compact(travel_data, user_prefs)
+    rows = _decode_compact(encoded["places_section"])
+
+    assert rows["A1"] == {"name": "Hoan Kiem / Lake", "rating": "4.7", "reviews": "1200",
+                          "lat": "21.02851", "lon": "105.85417"}
+    assert rows["A2"]["name"] == "Temple of Literature" and rows["A2"]["reviews"] == ""
+    # Cột không có giá trị nào bị bỏ khỏi bảng
+    assert rows["R1"] == {"name": "Pho Thin", "price": "3.5"}
+    assert rows["H1"] == {"name": "Metropole", "rating": "4.9"}
+    assert "hotels[H1]" in encoded["preference_rules"] and "restaurants[R1]" in encoded["preference_rules"]
+
+    assert encoded["id_map"] == {"A1": "act-9", "A2": "act-12", "R1": "res-3", "H1": "hot-1"}
+    for short_id, original_id in encoded["id_map"].items():
+        activity = {"place_id": f" {short_id.lower()} "}
+        services._restore_place_id(activity, encoded["id_map"])
+        assert activity["place_id"] == original_id
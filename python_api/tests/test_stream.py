@@ -0,0 +1,60 @@
+import asyncio
+
+import httpx
+
+import main
+from config import settings
+from services import generation_admission
+
+
+async def post_stream(body=None):
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await client.post("/api/recommendations/stream", json=body or {})
+
+
+def test_stream_times_out_and_returns_the_admission_slot(monkeypatch):
+    closed = []
+
+    async def slow_stream(*args, admitted=False, **kwargs):
+        assert admitted
+        try:
+            yield "day", {"day": 1}
+            await asyncio.sleep(10)
+            yield "day", {"day": 2}
+        finally:
+            closed.append(True)
+
+    monkeypatch.setattr(main, "prepare_generation_inputs", lambda request: (None, None, None, "Hanoi"))
+    monkeypatch.setattr(main, "stream_final_tour_json", slow_stream)
+    monkeypatch.setattr(settings, "STREAM_TIMEOUT", 0.2)
+
+    response = asyncio.run(post_stream())
+    assert response.status_code == 200
+    events = response.text.split("\n\n")
+    # Comment keep-alive đi trước mọi event
+    assert events[0] == ": connected"
+    assert events[1].startswith("event: day")
+    assert events[2].startswith("event: error") and "timed out" in events[2]
+    assert closed == [True]
+    assert generation_admission.in_flight == 0
+
+
+def test_stream_is_rejected_before_headers_when_overloaded(monkeypatch):
+    monkeypatch.setattr(main, "prepare_generation_inputs", lambda request: (None, None, None, "Hanoi"))
+
+    async def scenario():
+        held = 0
+        try:
+            while generation_admission.in_flight < generation_admission.max_in_flight:
+                await generation_admission.acquire()
+                held += 1
+            monkeypatch.setattr(generation_admission, "max_queue", 0)
+            return await post_stream()
+        finally:
+            for _ in range(held):
+                generation_admission.release()
+
+    response = asyncio.run(scenario())
+    assert response.status_code == 429 and response.headers["Retry-After"]
+    assert generation_admission.in_flight == 0
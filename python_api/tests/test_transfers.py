@@ -0,0 +1,36 @@
+"""compute_transfers: khoảng cách/thời gian/chi phí transfer từ toạ độ item liền trước/liền sau"""
+import services
+
+
+def item(place_id, kind="activity", start="09:00"):
+    entry = {"type": kind, "place_name": place_id or "Street food tour", "start_time": start, "cost": 0.0}
+    if place_id:
+        entry["place_id"] = place_id
+    return entry
+
+
+def transfer(start):
+    return {"type": "transfer", "place_name": "Transfer", "start_time": start, "transport_mode": "taxi"}
+
+
+COORDINATES = {"H1": (21.0285, 105.8542), "A1": (21.0368, 105.8342), "A2": (21.0245, 105.8412)}
+
+
+def test_hotel_is_used_only_at_the_ends_of_the_day():
+    schedule = [{"day": 1, "activities": [
+        item("H1", "hotel", "08:00"), transfer("08:30"), item("A1"), transfer("12:00"), item("A2", start="13:00"),
+        transfer("18:00"),
+    ]}]
+    assert services.compute_transfers(schedule, COORDINATES) == 3
+    first, middle, back = (schedule[0]["activities"][i] for i in (1, 3, 5))
+    assert 0 < first["distance_km"] < 5 and 0 < middle["distance_km"] < 5 and 0 < back["distance_km"] < 5
+
+
+def test_place_without_id_in_the_middle_of_the_day_uses_fallback():
+    schedule = [{"day": 1, "activities": [
+        item("H1", "hotel", "08:00"), transfer("08:30"), item(None), transfer("12:00"), item("A2", start="13:00"),
+    ]}]
+    # Không được đo từ khách sạn tới khách sạn (0 km) hay từ khách sạn tới A2
+    assert services.compute_transfers(schedule, COORDINATES) == 0
+    to_unknown, from_unknown = schedule[0]["activities"][1], schedule[0]["activities"][3]
+    assert to_unknown["distance_km"] == 5.0 and from_unknown["distance_km"] == 5.0
@@ -0,0 +1,57 @@
+"""utils: bản vectorized của haversine và thời gian/chi phí di chuyển khớp bản scalar"""
+import numpy as np
+
+from utils import (calculate_transport_cost, calculate_transport_costs, calculate_travel_time,
+                   calculate_travel_times, haversine_distance, haversine_distances, haversine_matrix,
+                   haversine_paired)
+
+RNG = np.random.default_rng(7)
+LATS = RNG.uniform(-60, 60, 40)
+LONS = RNG.uniform(-180, 180, 40)
+
+
+def scalar_matrix(lats, lons, other_lats, other_lons):
+    return np.array([[haversine_distance(a, b, c, d) for c, d in zip(other_lats, other_lons)]
+                     for a, b in zip(lats, lons)])
+
+
+def test_haversine_matrix_matches_scalar():
+    expected = scalar_matrix(LATS, LONS, LATS, LONS)
+    np.fill_diagonal(expected, 0)
+
+    exact = haversine_matrix(LATS, LONS, dtype=np.float64)
+    assert np.allclose(exact, expected, rtol=1e-12, atol=1e-9)
+    assert np.allclose(haversine_matrix(LATS, LONS), expected, rtol=1e-6)
+
+    i, j = np.triu_indices(len(LATS), k=1)
+    assert np.allclose(haversine_matrix(LATS, LONS, condensed=True, dtype=np.float64), expected[i, j],
+                       rtol=1e-12, atol=1e-9)
+
+    rect = haversine_matrix(LATS[:5], LONS[:5], LATS[10:], LONS[10:], dtype=np.float64)
+    assert rect.shape == (5, 30)
+    assert np.allclose(rect, scalar_matrix(LATS[:5], LONS[:5], LATS[10:], LONS[10:]), rtol=1e-12)
+
+
+def test_haversine_vectors_match_scalar():
+    one_to_many = haversine_distances(LATS[0], LONS[0], LATS, LONS)
+    assert np.allclose(one_to_many, [haversine_distance(LATS[0], LONS[0], a, b) for a, b in zip(LATS, LONS)],
+                       rtol=1e-12, atol=1e-9)
+    paired = haversine_paired(LATS[:-1], LONS[:-1], LATS[1:], LONS[1:])
+    assert np.allclose(paired, [haversine_distance(*row) for row in zip(LATS[:-1], LONS[:-1], LATS[1:], LONS[1:])],
+                       rtol=1e-12)
+
+
+def test_travel_times_and_costs_match_scalar():
+    distances = np.concatenate([RNG.uniform(0, 40, 200), [0.0, 0.25, 0.75, 20.0, 20.0001, 4.125]])
+    modes = np.array((["walk", "Taxi", "bus", "ferry", "unknown", "metro"] * 40)[:len(distances)])
+    rush = np.arange(len(distances)) % 3 == 0
+
+    times = calculate_travel_times(distances, modes, rush)
+    costs = calculate_transport_costs(distances, modes)
+    for index, distance in enumerate(distances):
+        assert times[index] == calculate_travel_time(float(distance), modes[index], bool(rush[index]))
+        assert costs[index] == calculate_transport_cost(float(distance), modes[index])
+
+    # Một phương tiện cho cả ma trận
+    matrix = haversine_matrix(LATS[:6], LONS[:6], dtype=np.float64) / 1000
+    assert calculate_travel_times(matrix, "taxi").shape == (6, 6)
@@ -0,0 +1,53 @@
+"""Import nhẹ (SDK nặng nạp lười) và trạng thái warm-up cho /health"""
+import asyncio
+import os
+import subprocess
+import sys
+
+import warmup
+
+PYTHON_API = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_importing_main_does_not_load_heavy_modules():
+    code = ("import sys, main; "
+            "print(','.join(m for m in ('google.generativeai', 'amadeus', 'airportsdata') if m in sys.modules))")
+    output = subprocess.run([sys.executable, "-c", code], cwd=PYTHON_API, env=os.environ.copy(),
+                            capture_output=True, text=True, timeout=60, check=True).stdout
+    assert output.strip() == ""
+
+
+def test_warm_up_reports_each_step_and_never_raises(monkeypatch):
+    loaded = []
+
+    def broken():
+        raise RuntimeError("airline store unavailable")
+
+    monkeypatch.setattr(warmup.flight, "get_airports", lambda: loaded.append("airports"))
+    monkeypatch.setattr(warmup, "get_airport_index", lambda: loaded.append("airport_index"))
+    monkeypatch.setattr(warmup.airline_store, "load", broken)
+    monkeypatch.setattr(warmup.flight, "get_amadeus", lambda: loaded.append("amadeus_sdk"))
+    monkeypatch.setattr(warmup.settings, "GEMINI_API_KEY", "")
+    monkeypatch.setattr(warmup.settings, "AMADEUS_CLIENT_ID", "")
+    monkeypatch.setattr(warmup, "_state", {**warmup._state, "ready": False, "steps": {}})
+
+    asyncio.run(warmup.warm_up())
+    status = warmup.warmup_status()
+
+    assert status["ready"] and status["duration_ms"] is not None
+    assert sorted(loaded) == ["airport_index", "airports", "amadeus_sdk"]
+    assert set(status["steps"]) == {"airports", "airport_index", "airline_store", "amadeus_sdk"}
+    assert status["steps"]["airline_store"]["status"] == "error"
+    assert status["steps"]["airline_store"]["error"] == "airline store unavailable"
+    assert all(step["status"] == "ok" for name, step in status["steps"].items() if name != "airline_store")
+
+    # Snapshot cho /health không trỏ vào state đang được cập nhật
+    status["steps"]["airports"]["status"] = "changed"
+    assert warmup.warmup_status()["steps"]["airports"]["status"] == "ok"
+
+
+def test_disabled_warm_up_is_ready_immediately(monkeypatch):
+    monkeypatch.setattr(warmup.settings, "WARMUP_ENABLED", False)
+    monkeypatch.setattr(warmup, "_state", {**warmup._state, "ready": False, "steps": {}})
+    assert warmup.start_warm_up() is None
+    assert warmup.warmup_status()["ready"]
@@ -4,6 +4,8 @@ Utility functions for travel calculations
 import math
 from typing import Tuple, Optional
 
+import numpy as np
+
 def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """Tính khoảng cách Haversine (km)"""
     R = 6371.0
@@ -18,38 +20,165 @@ def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> fl
     return R * c
 
 
+def _haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Công thức Haversine trên mảng (broadcast), cùng thứ tự phép tính với haversine_distance"""
+    R = 6371.0
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    dphi = np.radians(lat2 - lat1)
+    dlambda = np.radians(lon2 - lon1)
+
+    a = (np.sin(dphi/2)**2 +
+         np.cos(phi1) * np.cos(phi2) * np.sin(dlambda/2)**2)
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
+
+    return R * c
+
+
+def haversine_distances(lat: float, lon: float, lats, lons) -> np.ndarray:
+    """Khoảng cách Haversine (km) từ một điểm tới nhiều điểm - bản vectorized của haversine_distance"""
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    return _haversine_km(float(lat), float(lon), lats, lons)
+
+
+def haversine_paired(lats1, lons1, lats2, lons2) -> np.ndarray:
+    """Khoảng cách Haversine (km) theo từng cặp (lats1[i], lons1[i]) -> (lats2[i], lons2[i])"""
+    return _haversine_km(np.asarray(lats1, dtype=np.float64), np.asarray(lons1, dtype=np.float64),
+                         np.asarray(lats2, dtype=np.float64), np.asarray(lons2, dtype=np.float64))
+
+
+# Số phần tử float64 tối đa cho mỗi khối hàng khi tính ma trận (giới hạn bộ nhớ tạm)
+MATRIX_BLOCK_ELEMENTS = 1 << 20
+
+
+def haversine_matrix(lats, lons, other_lats=None, other_lons=None,
+                     condensed: bool = False, dtype=np.float32) -> np.ndarray:
+    """
+    Ma trận khoảng cách Haversine (km) giữa nhiều điểm.
+
+    - Chỉ truyền lats/lons: ma trận N x N đối xứng giữa các điểm đó.
+    - Truyền thêm other_lats/other_lons: ma trận N x M từ mỗi điểm tới mỗi điểm khác.
+    - condensed=True (chỉ dùng với N x N): mảng 1 chiều N*(N-1)/2 phần tử, các cặp
+      i < j theo thứ tự hàng (giống scipy.spatial.distance.pdist).
+
+    Tính bằng float64 theo từng khối hàng rồi ép về `dtype` (mặc định float32).
+    """
+    lats = np.asarray(lats, dtype=np.float64).ravel()
+    lons = np.asarray(lons, dtype=np.float64).ravel()
+    pairwise = other_lats is None
+    if pairwise:
+        other_lats, other_lons = lats, lons
+    else:
+        if condensed:
+            raise ValueError("condensed=True is only supported for a square (pairwise) matrix")
+        other_lats = np.asarray(other_lats, dtype=np.float64).ravel()
+        other_lons = np.asarray(other_lons, dtype=np.float64).ravel()
+
+    n, m = len(lats), len(other_lats)
+    if condensed:
+        out = np.empty(n * (n - 1) // 2, dtype=dtype)
+        offset = 0
+        for i in range(n - 1):
+            row = _haversine_km(lats[i], lons[i], other_lats[i + 1:], other_lons[i + 1:])
+            out[offset:offset + len(row)] = row
+            offset += len(row)
+        return out
+
+    out = np.empty((n, m), dtype=dtype)
+    block = max(1, MATRIX_BLOCK_ELEMENTS // max(m, 1))
+    for start in range(0, n, block):
+        stop = min(start + block, n)
+        out[start:stop] = _haversine_km(lats[start:stop, None], lons[start:stop, None],
+                                        other_lats[None, :], other_lons[None, :])
+    if pairwise:
+        np.fill_diagonal(out, 0)
+    return out
+
+
+# Tốc độ trung bình cho từng phương tiện (km/h)
+TRANSPORT_SPEED_KMH = {
+    'walk': 4,
+    'bike': 12,
+    'bicycle': 12,
+    'scooter': 25,
+    'motorcycle': 25,
+    'motorbike': 25,
+    'taxi': 30,
+    'grab': 30,
+    'uber': 30,
+    'bus': 25,
+    'metro': 35,
+    'subway': 35,
+    'train': 40,
+    'car': 30,
+    'ojek': 25,
+    'grabbike': 25,
+    'rickshaw': 10,
+    'cyclo': 10,
+    'tricycle': 15,
+    'ferry': 20,
+    'boat': 20,
+    'ship': 25
+}
+DEFAULT_SPEED_KMH = 30  # Default to taxi speed
+# Phương tiện bị chậm 20% trong giờ cao điểm
+RUSH_HOUR_MODES = {'scooter', 'motorcycle', 'motorbike', 'taxi', 'grab', 'uber', 'car'}
+# Phương tiện cơ giới được cộng thêm 5 phút buffer
+MOTORIZED_BUFFER_MODES = {'scooter', 'motorcycle', 'taxi', 'grab', 'car', 'bus', 'metro'}
+
+TRANSPORT_COST_PER_KM = {
+    'walk': 0,      # Free
+    'bike': 2,      # Fixed rental cost
+    'bicycle': 2,   # Fixed rental cost
+    'scooter': 0.5, # Per km
+    'motorcycle': 0.5,
+    'motorbike': 0.5,
+    'taxi': 1.2,    # Per km 
+    'grab': 1.0,    # Per km
+    'uber': 1.0,
+    'bus': 0.3,     # Per km
+    'metro': 0.4,   # Per km
+    'subway': 0.4,
+    'train': 0.5,
+    'car': 1.0,     # Per km
+    'ojek': 0.4,
+    'grabbike': 0.4,
+    'rickshaw': 0.6,
+    'cyclo': 0.6,
+    'tricycle': 0.5,
+    'ferry': 2.0,
+    'boat': 2.0,
+    'ship': 3.0
+}
+DEFAULT_COST_PER_KM = 1.0
+# Phương tiện tính phí cố định thay vì theo km
+FIXED_COST_MODES = {'walk', 'bike', 'bicycle'}
+
+
+# Khung giờ cao điểm (phút trong ngày, [bắt đầu, kết thúc))
+RUSH_HOURS = ((7 * 60, 9 * 60), (17 * 60, 19 * 60))
+
+
+def is_rush_hour(start_time) -> bool:
+    """True nếu giờ bắt đầu ("HH:MM" hoặc số phút trong ngày) rơi vào giờ cao điểm"""
+    if isinstance(start_time, str):
+        try:
+            hours, minutes = start_time.strip().split(':')[:2]
+            start_time = int(hours) * 60 + int(minutes)
+        except ValueError:
+            return False
+    if not isinstance(start_time, (int, float)):
+        return False
+    return any(start <= start_time < end for start, end in RUSH_HOURS)
+
+
 def calculate_travel_time(distance_km: float, transport_mode: str, is_rush_hour: bool = False) -> int:
     """Tính thời gian di chuyển (phút) dựa trên khoảng cách và phương tiện"""
-    # Tốc độ trung bình cho từng phương tiện (km/h)
-    speed_map = {
-        'walk': 4,
-        'bike': 12,
-        'bicycle': 12,
-        'scooter': 25,
-        'motorcycle': 25,
-        'motorbike': 25,
-        'taxi': 30,
-        'grab': 30,
-        'uber': 30,
-        'bus': 25,
-        'metro': 35,
-        'subway': 35,
-        'train': 40,
-        'car': 30,
-        'ojek': 25,
-        'grabbike': 25,
-        'rickshaw': 10,
-        'cyclo': 10,
-        'tricycle': 15,
-        'ferry': 20,
-        'boat': 20,
-        'ship': 25
-    }
-    
-    base_speed = speed_map.get(transport_mode.lower(), 30)  # Default to taxi speed
+    mode_lower = transport_mode.lower()
+    base_speed = TRANSPORT_SPEED_KMH.get(mode_lower, DEFAULT_SPEED_KMH)
     
     # Điều chỉnh tốc độ trong giờ cao điểm
-    if is_rush_hour and transport_mode.lower() in ['scooter', 'motorcycle', 'motorbike', 'taxi', 'grab', 'uber', 'car']:
+    if is_rush_hour and mode_lower in RUSH_HOUR_MODES:
         base_speed *= 0.8  # Giảm 20% tốc độ trong giờ cao điểm
     
     # Tính thời gian cơ bản
@@ -57,7 +186,7 @@ def calculate_travel_time(distance_km: float, transport_mode: str, is_rush_hour:
     
     # Thêm buffer time
     buffer_time = 10  # Base buffer 10 phút
-    if transport_mode.lower() in ['scooter', 'motorcycle', 'taxi', 'grab', 'car', 'bus', 'metro']:
+    if mode_lower in MOTORIZED_BUFFER_MODES:
         buffer_time += 5  # Thêm 5 phút cho phương tiện cơ giới
     if distance_km > 20:
         buffer_time += 10  # Thêm 10 phút cho khoảng cách xa
@@ -69,39 +198,72 @@ def calculate_travel_time(distance_km: float, transport_mode: str, is_rush_hour:
 
 def calculate_transport_cost(distance_km: float, transport_mode: str) -> float:
     """Tính chi phí di chuyển dựa trên khoảng cách và phương tiện"""
-    cost_map = {
-        'walk': 0,      # Free
-        'bike': 2,      # Fixed rental cost
-        'bicycle': 2,   # Fixed rental cost
-        'scooter': 0.5, # Per km
-        'motorcycle': 0.5,
-        'motorbike': 0.5,
-        'taxi': 1.2,    # Per km 
-        'grab': 1.0,    # Per km
-        'uber': 1.0,
-        'bus': 0.3,     # Per km
-        'metro': 0.4,   # Per km
-        'subway': 0.4,
-        'train': 0.5,
-        'car': 1.0,     # Per km
-        'ojek': 0.4,
-        'grabbike': 0.4,
-        'rickshaw': 0.6,
-        'cyclo': 0.6,
-        'tricycle': 0.5,
-        'ferry': 2.0,
-        'boat': 2.0,
-        'ship': 3.0
-    }
-    
     mode_lower = transport_mode.lower()
-    if mode_lower in ['walk', 'bike', 'bicycle']:
-        return cost_map.get(mode_lower, 0)  # Fixed cost
+    if mode_lower in FIXED_COST_MODES:
+        return TRANSPORT_COST_PER_KM.get(mode_lower, 0)  # Fixed cost
     else:
-        base_cost = cost_map.get(mode_lower, 1.0) * distance_km
+        base_cost = TRANSPORT_COST_PER_KM.get(mode_lower, DEFAULT_COST_PER_KM) * distance_km
         return round(max(base_cost, 1.0), 1)  # Minimum $1
 
 
+def _mode_values(transport_modes, table: dict, default, shape=None):
+    """
+    Tra bảng theo phương tiện: một chuỗi -> một số (NumPy tự broadcast);
+    mảng chuỗi -> mảng giá trị, tra theo từng phương tiện duy nhất thay vì từng phần tử
+    """
+    if isinstance(transport_modes, str):
+        return table.get(transport_modes.lower(), default)
+    modes, codes = np.unique(np.asarray(transport_modes, dtype=str), return_inverse=True)
+    values = np.array([table.get(mode.lower(), default) for mode in modes], dtype=np.float64)
+    return values[codes].reshape(np.shape(transport_modes))
+
+
+def _mode_flags(transport_modes, group: set):
+    """True nếu phương tiện thuộc group (một bool hoặc mảng bool)"""
+    flags = {mode: 1.0 for mode in group}
+    return _mode_values(transport_modes, flags, 0.0) > 0
+
+
+def calculate_travel_times(distances_km, transport_modes, is_rush_hour=False) -> np.ndarray:
+    """
+    Bản vectorized của calculate_travel_time cho mảng/ma trận khoảng cách.
+
+    transport_modes và is_rush_hour có thể là một giá trị hoặc mảng broadcast
+    được với distances_km. Kết quả (int64) trùng khớp từng phần tử với
+    calculate_travel_time gọi trên float(distance).
+    """
+    distances = np.asarray(distances_km, dtype=np.float64)
+    speed = _mode_values(transport_modes, TRANSPORT_SPEED_KMH, DEFAULT_SPEED_KMH)
+    rush = np.asarray(is_rush_hour, dtype=bool) & _mode_flags(transport_modes, RUSH_HOUR_MODES)
+    speed = np.where(rush, np.multiply(speed, 0.8), speed)
+
+    base_time_minutes = (distances / speed) * 60
+    buffer_time = 10 + 5 * _mode_flags(transport_modes, MOTORIZED_BUFFER_MODES) + 10 * (distances > 20)
+    total_time = np.ceil(base_time_minutes + buffer_time)
+    return np.maximum(total_time, 5).astype(np.int64)
+
+
+def calculate_transport_costs(distances_km, transport_modes) -> np.ndarray:
+    """
+    Bản vectorized của calculate_transport_cost (float64, trùng khớp từng phần tử,
+    kể cả cách làm tròn 1 chữ số thập phân của round())
+    """
+    distances = np.asarray(distances_km, dtype=np.float64)
+    rate = _mode_values(transport_modes, TRANSPORT_COST_PER_KM, DEFAULT_COST_PER_KM)
+    base_cost = np.maximum(rate * distances, 1.0)
+
+    costs = np.round(base_cost, 1)
+    # np.round (x*10 rồi rint) có thể lệch round() của Python khi x*10 sát .5;
+    # tính lại riêng các phần tử đó bằng round() để kết quả giống hệt bản scalar
+    scaled = base_cost * 10
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if near_tie.any():
+        costs[near_tie] = [round(float(value), 1) for value in base_cost[near_tie]]
+
+    fixed = _mode_flags(transport_modes, FIXED_COST_MODES)
+    return np.where(fixed, rate, costs)
+
+
 def get_location_coordinates(cursor, place_type: str, place_id: str) -> Tuple[Optional[float], Optional[float]]:
     """Lấy tọa độ của địa điểm từ database"""
     try:
@@ -0,0 +1,76 @@
+"""
+Background warm-up run from the FastAPI lifespan
+
+Import main.py giờ không còn nạp google.generativeai, Amadeus SDK hay bảng
+sân bay; các bước dưới đây nạp chúng trong nền ngay sau khi worker khởi động
+để request đầu tiên không phải trả chi phí đó. /health báo trạng thái qua
+`warmup_status()`.
+"""
+import asyncio
+import time
+from typing import Optional
+
+import amadeus_client
+from airlines import airline_store
+from airport_index import get_airport_index
+import flight
+import services
+from config import settings
+
+_state = {
+    "enabled": settings.WARMUP_ENABLED,
+    "ready": False,
+    "started_at": None,
+    "duration_ms": None,
+    "steps": {},
+}
+
+
+async def _run_step(name: str, func, *, in_thread: bool = True):
+    start = time.perf_counter()
+    step = _state["steps"][name] = {"status": "running"}
+    try:
+        if in_thread:
+            await asyncio.to_thread(func)
+        else:
+            await func()
+        step["status"] = "ok"
+    except Exception as e:
+        # Warm-up không bao giờ làm hỏng worker: lỗi được báo qua /health, request sẽ tự thử lại
+        step["status"] = "error"
+        step["error"] = str(e)
+    step["duration_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+
+async def warm_up():
+    """Chạy song song các bước warm-up, đánh dấu ready khi tất cả đã xong (kể cả khi lỗi)"""
+    start = time.perf_counter()
+    _state["started_at"] = time.time()
+    steps = [
+        _run_step("airports", flight.get_airports),
+        _run_step("airport_index", get_airport_index),
+        _run_step("airline_store", airline_store.load),
+        _run_step("amadeus_sdk", flight.get_amadeus),
+    ]
+    if settings.GEMINI_API_KEY:
+        steps.append(_run_step("gemini", services.get_gemini_model))
+    if settings.AMADEUS_CLIENT_ID and settings.AMADEUS_CLIENT_SECRET:
+        steps.append(_run_step("amadeus_connection", amadeus_client.get_client().warm_up, in_thread=False))
+    await asyncio.gather(*steps)
+    _state["duration_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    _state["ready"] = True
+
+
+def start_warm_up() -> Optional[asyncio.Task]:
+    """Khởi chạy warm-up trong nền (gọi từ lifespan); None nếu WARMUP_ENABLED=False"""
+    if not settings.WARMUP_ENABLED:
+        _state["ready"] = True
+        return None
+    return asyncio.create_task(warm_up())
+
+
+def warmup_status() -> dict:
+    return {
+        **_state,
+        "steps": {name: dict(step) for name, step in _state["steps"].items()},
+    }